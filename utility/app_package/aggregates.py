@@ -0,0 +1,137 @@
+""" incremental maintenance of the count_aggregates table (models.CountAggregate) from the count write paths """
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from . import models, utils
+from .database import dialect_insert
+from .hierarchy import LEVEL_COLUMNS, hierarchy_ids
+
+# the headcount columns that are summed by the rollups
+COUNT_FIELDS = ("adult_male", "adult_female", "youth_male", "youth_female", "boys", "girls", "total")
+SUM_FIELDS = ("records",) + COUNT_FIELDS
+PERIODS = ("week", "month", "year")
+LEVEL_DEPTH = {"state": 3, "region": 4, "group": 5, "location": 6}
+KEY_FIELDS = ("level", "node_id", "church_type", "program_domain", "program_type", "period", "period_start")
+
+
+def period_start(day: date, period: str) -> date:
+    """ same buckets as utils.period_start, weeks start on monday """
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def snapshot(count) -> Optional[dict]:
+    """ the values of a count (a models.Counter or the dict it is inserted from) that feed the aggregates, None once
+    it is soft deleted """
+    get = count.get if isinstance(count, dict) else lambda field: getattr(count, field)
+    if get("is_deleted"):
+        return None
+
+    values = {field: get(field) for field in
+              ("location_id", "church_type", "program_domain", "program_type", "date") + COUNT_FIELDS}
+    if isinstance(values["date"], str):
+        values["date"] = date.fromisoformat(values["date"])
+    return values
+
+
+def _add_deltas(values: dict, sign: int, deltas: dict):
+    node_ids = hierarchy_ids(values["location_id"])
+    node_ids["location_id"] = values["location_id"]
+
+    for level, column in LEVEL_COLUMNS.items():
+        if node_ids[column] is None:
+            continue
+        for period in PERIODS:
+            key = (level, node_ids[column], values["church_type"], values["program_domain"], values["program_type"],
+                   period, period_start(values["date"], period))
+            delta = deltas.setdefault(key, dict.fromkeys(SUM_FIELDS, 0))
+            delta["records"] += sign
+            for field in COUNT_FIELDS:
+                delta[field] += sign * (values[field] or 0)
+
+
+def apply_count_change(db: Session, before: Optional[dict], after: Optional[dict]):
+    """ move a count out of the aggregates it was in (before) and into the ones it now belongs to (after).
+
+    Runs in the caller's transaction so the count and its aggregates are committed together. before is None for a
+    new count and after is None for a deleted one, both come from snapshot() """
+    apply_count_changes(db, [(before, after)])
+
+
+def apply_count_changes(db: Session, changes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """ apply_count_change for many counts at once, a batch upload costs one upsert per touched aggregate row """
+    deltas = {}
+    for before, after in changes:
+        if before:
+            _add_deltas(before, -1, deltas)
+        if after:
+            _add_deltas(after, 1, deltas)
+
+    # an update that touches none of the keys or the counts cancels out
+    rows = [dict(zip(KEY_FIELDS, key), **delta) for key, delta in deltas.items() if any(delta.values())]
+    if not rows:
+        return
+
+    table = models.CountAggregate.__table__
+    stmt = dialect_insert(db.get_bind())(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(KEY_FIELDS),
+        set_={**{field: table.c[field] + stmt.excluded[field] for field in SUM_FIELDS}, "last_modify": func.now()}
+    )
+    db.execute(stmt, rows)
+
+
+def covers(level: str, period: str, scopes, start_month=None, end_month=None, start_year=None, end_year=None,
+           from_date=None, to_date=None) -> bool:
+    """ whether a rollup can be answered from the aggregates instead of scanning the counts.
+
+    The nodes of the level must sit at or below every scope (a region admin cannot read a whole state bucket) and
+    the date filters must fall on period boundaries """
+    if any(len(scope.split("-")) > LEVEL_DEPTH[level] for scope in scopes if scope):
+        return False
+
+    if from_date or to_date:
+        return False
+
+    months = start_month and end_month
+    years = start_year and end_year
+    if period == "month":
+        return True
+    if period == "year":
+        return not months
+    return not (months or years)
+
+
+def rebuild(db: Session) -> int:
+    """ recompute the whole table from the counts, this reconciles any drift. Returns the number of aggregate rows """
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        # hold the count writers until the new totals are committed, otherwise their deltas could be lost
+        db.execute(text("LOCK TABLE counts IN SHARE MODE"))
+
+    db.execute(delete(models.CountAggregate))
+
+    counter = models.Counter
+    for level, column in LEVEL_COLUMNS.items():
+        node = getattr(counter, column)
+        for period in PERIODS:
+            bucket = utils.period_start(counter.date, period, dialect)
+            totals = select(
+                literal(level), node, counter.church_type, counter.program_domain, counter.program_type,
+                literal(period), bucket, func.count(counter.id),
+                *[func.sum(getattr(counter, field)) for field in COUNT_FIELDS]
+            ).where(
+                counter.is_deleted == False, node.isnot(None)
+            ).group_by(node, counter.church_type, counter.program_domain, counter.program_type, bucket)
+
+            db.execute(insert(models.CountAggregate).from_select(list(KEY_FIELDS + SUM_FIELDS), totals))
+
+    db.commit()
+    return db.query(func.count(models.CountAggregate.id)).scalar()
@@ -0,0 +1,107 @@
+""" pub/sub between the server processes that hold WebSocket connections. Every process publishes its fan-outs to
+the broker and delivers what it receives to its own sockets, so a notification reaches the users connected to any
+worker or node. The in-memory broker keeps everything in the process; BROKER_URL=redis://... shares it """
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional, only needed when BROKER_URL points to Redis
+    redis = None
+
+Handler = Callable[[str], Awaitable[None]]
+
+
+class Broker:
+    """ the interface of the brokers: publish a payload on a channel, subscribe a handler to the payloads of one """
+
+    async def publish(self, channel: str, data: str):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: Handler):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """ a single process: publishing calls the handlers directly """
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+
+    async def publish(self, channel: str, data: str):
+        for handler in self.handlers.get(channel, ()):
+            await handler(data)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+
+class RedisBroker(Broker):
+    """ Redis PUBLISH/SUBSCRIBE. client is a redis.asyncio client, or any object with the same publish() and
+    pubsub() methods (a local stand-in in tests). A publishing process receives its own messages back like the others,
+    so each message is delivered once per process """
+
+    def __init__(self, client, prefix: str = "utility:"):
+        self.client = client
+        self.prefix = prefix
+        self.handlers: Dict[str, List[Handler]] = {}
+        self.pubsub = None
+        self.reader = None
+
+    async def publish(self, channel: str, data: str):
+        await self.client.publish(self.prefix + channel, data)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers.setdefault(channel, []).append(handler)
+        if self.pubsub is None:
+            self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.prefix + channel)
+        if self.reader is None:
+            self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel, data = message["channel"], message["data"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    for handler in self.handlers.get(channel[len(self.prefix):], ()):
+                        try:
+                            await handler(data)
+                        except Exception as e:
+                            print(e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # the connection dropped, listen() reconnects and subscribes again on the next call
+                print(e)
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+
+
+def create_broker(url: str) -> Broker:
+    """ the broker of BROKER_URL: empty or memory:// for a single process, redis:// or rediss:// to share it """
+    if not url or url.startswith("memory://"):
+        return InMemoryBroker()
+
+    if url.startswith(("redis://", "rediss://")):
+        if redis is None:
+            raise RuntimeError("BROKER_URL points to Redis but the redis package is not installed")
+        return RedisBroker(redis.from_url(url))
+
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
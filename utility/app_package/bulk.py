@@ -0,0 +1,202 @@
+""" ingestion helpers for the create routes: rows are validated on their own, inserted with chunked Core executemany
+instead of one ORM object per row, and uploads carrying a client_uuid are written at most once """
+import json
+from typing import List, Optional, Tuple, Type
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, utils
+from .config import settings
+from .database import dialect_insert
+from .hierarchy import covering_scopes, with_hierarchy
+
+CHUNK_SIZE = 1000  # rows per INSERT, bounds the size of each statement and of its parameters
+# columns the database or the hierarchy fills in, a replay is not compared on them
+UNCOMPARED = {"client_uuid", "last_modify", "created_at", "operation", "is_deleted", "state_id", "region_id",
+              "group_id"}
+
+
+def validate_rows(schema: Type[BaseModel], rows: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """ the valid rows as insert dicts, and the validation errors of the others keyed by their index in the batch """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append(schema(**row).dict())
+        except ValidationError as e:
+            errors.append({"index": index, "errors": json.loads(e.json(include_url=False))})
+    return valid, errors
+
+
+def client_keys(rows: List[dict], idempotency_key: Optional[str]) -> List[dict]:
+    """ give the rows of a batch sent with an Idempotency-Key header a client_uuid derived from it and their position,
+    so a replayed batch maps onto the rows it already wrote. A client_uuid sent with a row is kept """
+    if idempotency_key:
+        for index, row in enumerate(rows):
+            if not row.get("client_uuid"):
+                row["client_uuid"] = f"{idempotency_key}:{index}"
+    return rows
+
+
+def owned_key(owner: str, key: Optional[str]) -> Optional[str]:
+    """ the client_uuid stored for a key sent by a user. Keys are free text chosen by the clients, prefixing them with
+    the uploader's user_id keeps two users sending the same key from ever meeting """
+    return f"{owner}:{key}" if key else None
+
+
+def same_values(stored: dict, row: dict) -> bool:
+    """ whether a stored row carries the values of row. Fields the request left out (None) are not compared """
+    return all(stored.get(key) == value for key, value in row.items()
+               if key in stored and key not in UNCOMPARED and value is not None)
+
+
+def same_upload(stored: dict, row: dict, scope) -> bool:
+    """ whether a stored row is the replay of row: inside the uploader's scope and carrying the same values """
+    return bool(scope) and scope in covering_scopes(stored.get("location_id")) and same_values(stored, row)
+
+
+async def uploader_scope(user) -> Optional[str]:
+    """ the access scope a replayed row is checked against, None for a user without one """
+    try:
+        return await utils.create_admin_access_id(user) or None
+    except ValueError:
+        return None
+
+
+def replay_conflict() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT,
+                         detail="This client_uuid or Idempotency-Key was already used for a different upload")
+
+
+def insert_values(model, row: dict) -> dict:
+    """ a row as the ORM would insert it. Core inserts skip the ORM events, so the hierarchy ids are filled in here,
+    and a None for a column with a server default is left out so the database still sets created_at and last_modify """
+    table = model.__table__
+    if issubclass(model, models.HierarchyMixin):
+        with_hierarchy(row)
+    return {key: value for key, value in row.items()
+            if key in table.c and not (value is None and table.c[key].server_default is not None)}
+
+
+async def insert_rows(db: AsyncSession, model, rows: List[dict]) -> List[Optional[str]]:
+    """ insert the rows in the caller's transaction, rows whose client_uuid is already stored are skipped. Returns the
+    client_uuid of every row written, None for the rows sent without one """
+    table = model.__table__
+    keyed = "client_uuid" in table.c
+    stmt = insert(table)
+    if keyed:
+        stmt = dialect_insert(db.get_bind())(table).on_conflict_do_nothing(index_elements=["client_uuid"])
+
+    # an executemany needs the same columns in every row, rows leaving out different defaults go in separate groups
+    groups = {}
+    for row in rows:
+        values = insert_values(model, row)
+        groups.setdefault(frozenset(values), []).append(values)
+
+    written = []
+    for group in groups.values():
+        for start in range(0, len(group), CHUNK_SIZE):
+            result = await db.execute(stmt.returning(table.c.client_uuid if keyed else table.c.id),
+                                      group[start:start + CHUNK_SIZE])
+            written += [row[0] if keyed else None for row in result]
+
+    return written
+
+
+async def create_batch(db: AsyncSession, schema: Type[BaseModel], model, items: List[dict], user,
+                       idempotency_key: Optional[str] = None) -> Tuple[dict, List[dict]]:
+    """ validate and insert the items of a batch route in the caller's transaction, the caller commits.
+
+    Returns the schemas.BatchResponse of the batch and the rows that were written. A batch with no valid item is
+    rejected with a 422, a batch over BATCH_MAX_ITEMS with a 413. An item whose key the user already stored with
+    other values is reported as a conflict and written nowhere """
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"A batch takes at most {settings.BATCH_MAX_ITEMS} items")
+
+    keyed = "client_uuid" in model.__table__.c
+    if keyed:
+        # keys are given before validation so they follow the position in the posted list
+        items = client_keys(items, idempotency_key)
+
+    rows, errors = validate_rows(schema, items)
+    if errors and not rows:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=errors)
+
+    # the client's key goes in the report, the key namespaced by the uploader in the database
+    sent = [row.get("client_uuid") for row in rows]
+    if keyed:
+        for row in rows:
+            row["client_uuid"] = owned_key(user.user_id, row.get("client_uuid"))
+
+    # a client_uuid repeated inside the batch is one upload, only its first copy goes to the database
+    first, unique = {}, []
+    for row in rows:
+        key = row.get("client_uuid")
+        if key is None or key not in first:
+            unique.append(row)
+            first[key] = row
+
+    written = set(await insert_rows(db, model, unique))
+
+    # the keys stored before this batch are replays only when the stored row is the same upload
+    stored, scope = {}, None
+    replayed = [key for key in first if key is not None and key not in written]
+    if replayed:
+        scope = await uploader_scope(user)
+        column = model.__table__.c.client_uuid
+        for start in range(0, len(replayed), CHUNK_SIZE):
+            result = await db.execute(select(model.__table__).filter(column.in_(replayed[start:start + CHUNK_SIZE])))
+            for row in result.mappings():
+                stored[row["client_uuid"]] = dict(row)
+
+    invalid = {error["index"]: error["errors"] for error in errors}
+    valid_rows = iter(zip(rows, sent))
+    report, created, conflicts = [], [], 0
+    for index in range(len(items)):
+        if index in invalid:
+            report.append({"index": index, "status": "invalid", "errors": invalid[index]})
+            continue
+
+        row, client_uuid = next(valid_rows)
+        key = row.get("client_uuid")
+        if key is None or key in written:
+            # the later copies of the key find it gone and are compared with this one
+            written.discard(key)
+            created.append(row)
+            report.append({"index": index, "status": "created", "client_uuid": client_uuid})
+        elif same_upload(stored[key], row, scope) if key in stored else same_values(first[key], row):
+            report.append({"index": index, "status": "replayed", "client_uuid": client_uuid})
+        else:
+            conflicts += 1
+            report.append({"index": index, "status": "conflict", "client_uuid": client_uuid,
+                           "errors": [{"msg": replay_conflict().detail}]})
+
+    return {
+        "detail": "Batch successfully saved",
+        "created": len(created),
+        "replayed": len(rows) - len(created) - conflicts,
+        "invalid": len(errors),
+        "conflict": conflicts,
+        "items": report,
+    }, created
+
+
+def insert_once(db: Session, model, row: dict, user, scope) -> Tuple[object, bool]:
+    """ insert a row carrying a client_uuid unless that upload was already stored by the same user. Returns the stored
+    row and whether this call created it, a replay reads the original row back and writes nothing. A key the user
+    already stored with other values, or for a row outside its scope, is a 409 """
+    row = {**row, "client_uuid": owned_key(user.user_id, row["client_uuid"])}
+    stmt = dialect_insert(db.get_bind())(model).values(**insert_values(model, row)).on_conflict_do_nothing(
+        index_elements=["client_uuid"]).returning(model)
+    created = db.execute(stmt).scalars().first()
+    if created is not None:
+        return created, True
+
+    stored = db.query(model).filter(model.client_uuid == row["client_uuid"]).one()
+    if not same_upload({column.key: getattr(stored, column.key) for column in model.__table__.c}, row, scope):
+        raise replay_conflict()
+    return stored, False
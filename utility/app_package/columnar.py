@@ -0,0 +1,128 @@
+""" Arrow IPC and Parquet files of the export routes. A file is written once for a given statement (scope, filters,
+projection) and version of the rows it covers, and kept on local disk so repeated analytic pulls are served from
+there """
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from typing import List
+
+from sqlalchemy import Boolean, Date, Float, Integer, TIMESTAMP, func, select
+
+from .config import settings
+from .database import async_read_session
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional, the routes answer 501 for these formats without it
+    pa = None
+
+MEDIA_TYPES = {"arrow": "application/vnd.apache.arrow.file", "parquet": "application/vnd.apache.parquet"}
+ROWS_PER_GROUP = 65536  # a month larger than this is split over several record batches / row groups
+
+
+def arrow_type(column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, TIMESTAMP):
+        return pa.timestamp("us", tz="UTC" if column.type.timezone else None)
+    if isinstance(column.type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+async def rows_version(db, model, conditions: list) -> str:
+    """ changes whenever a row of the export is added, edited or soft deleted: every write moves last_modify, and a
+    deleted row also leaves the count """
+    stmt = select(func.count(), func.max(model.last_modify), func.max(model.id)).filter(*conditions)
+    return ":".join(str(value) for value in (await db.execute(stmt)).one())
+
+
+def cache_path(stmt, version: str, format: str) -> str:
+    compiled = stmt.compile()
+    key = hashlib.sha256(f"{compiled}|{sorted(compiled.params.items())}|{version}".encode()).hexdigest()
+    return os.path.join(settings.EXPORT_CACHE_DIR, f"{key}.{format}")
+
+
+def write_rows(writer, schema, rows: List[tuple]):
+    arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+    writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+async def write_file(db, stmt, schema, path: str, format: str):
+    """ write the rows of stmt, ordered by date, with one record batch (Arrow) or row group (Parquet) per month. The
+    file is written under a temporary name and renamed once complete, so a reader never sees half a file """
+    temp = f"{path}.{uuid.uuid4().hex}.tmp"
+    writer = pa.ipc.new_file(temp, schema) if format == "arrow" else pa.parquet.ParquetWriter(temp, schema)
+    try:
+        result = await db.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH))
+        rows, month = [], None
+        async for row in result:
+            if rows and ((row[0].year, row[0].month) != month or len(rows) == ROWS_PER_GROUP):
+                await asyncio.to_thread(write_rows, writer, schema, rows)
+                rows = []
+            month = (row[0].year, row[0].month)
+            rows.append(tuple(row)[1:])
+
+        if rows:
+            await asyncio.to_thread(write_rows, writer, schema, rows)
+        writer.close()
+        os.replace(temp, path)
+    except Exception:
+        writer.close()
+        os.remove(temp)
+        raise
+
+
+def prune_cache(keep: str):
+    """ drop the least recently served files once the cache is over EXPORT_CACHE_MAX_MB, except keep and the files
+    served within EXPORT_CACHE_GRACE_SECONDS: another request may be about to send them. Files another worker removed
+    meanwhile are skipped """
+    files = []
+    for entry in os.scandir(settings.EXPORT_CACHE_DIR):
+        if entry.is_file() and not entry.name.endswith(".tmp") and entry.path != keep:
+            try:
+                files.append((entry.path, entry.stat()))
+            except FileNotFoundError:
+                continue
+
+    size = sum(stat.st_size for _, stat in files)
+    horizon = time.time() - settings.EXPORT_CACHE_GRACE_SECONDS
+    for path, stat in sorted(files, key=lambda file: file[1].st_mtime):
+        if size <= settings.EXPORT_CACHE_MAX_MB * 1024 * 1024 or stat.st_mtime > horizon:
+            break
+        size -= stat.st_size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+
+
+async def export_file(model, conditions: list, columns: list, format: str) -> str:
+    """ the path of the Arrow or Parquet file of the matching rows, written on the first pull of this statement and
+    version. A repeated pull only runs the version query """
+    stmt = select(model.date, *columns).filter(*conditions).order_by(model.date, model.id)
+
+    # the version and the rows come from the same session, so from the same replica
+    async with async_read_session() as db:
+        path = cache_path(stmt, await rows_version(db, model, conditions), format)
+
+        try:
+            os.utime(path)  # served, the pruning goes by last use
+            return path
+        except FileNotFoundError:
+            pass  # never written, or pruned since
+
+        os.makedirs(settings.EXPORT_CACHE_DIR, exist_ok=True)
+        schema = pa.schema([(column.key, arrow_type(column)) for column in columns])
+        await write_file(db, stmt, schema, path, format)
+
+    prune_cache(path)
+    return path
@@ -0,0 +1,69 @@
+"""
+Maintenance commands, run from the utility folder:
+
+    python -m app_package.commands upgrade-schema
+    python -m app_package.commands backfill-hierarchy [--batch-size 1000]
+    python -m app_package.commands rebuild-count-aggregates
+"""
+import argparse
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import models, aggregates
+from .database import SessionLocal, engine, upgrade_schema
+from .hierarchy import hierarchy_ids
+
+
+def backfill_hierarchy(db: Session, batch_size: int = 1000) -> dict:
+    """ fill state_id, region_id and group_id on the rows written before the columns existed """
+    updated = {}
+    for model in models.HIERARCHY_MODELS:
+        updated[model.__tablename__] = 0
+        last_id = 0
+        while True:
+            # walk the primary key instead of re-reading the NULL rows, ids too short to have a state stay NULL
+            rows = db.query(model.id, model.location_id).filter(
+                model.id > last_id, model.state_id.is_(None)
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            db.execute(update(model), [{"id": row.id, **hierarchy_ids(row.location_id)} for row in rows])
+            db.commit()
+            last_id = rows[-1].id
+            updated[model.__tablename__] += len(rows)
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app_package.commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("upgrade-schema", help="add the missing tables, columns and indexes")
+
+    backfill = commands.add_parser("backfill-hierarchy", help="add and fill the state/region/group columns")
+    backfill.add_argument("--batch-size", type=int, default=1000)
+
+    commands.add_parser("rebuild-count-aggregates", help="recompute count_aggregates from the counts table")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade-schema":
+        upgrade_schema(engine)
+        print("schema up to date")
+
+    elif args.command == "backfill-hierarchy":
+        upgrade_schema(engine)
+        with SessionLocal() as db:
+            for table, count in backfill_hierarchy(db, args.batch_size).items():
+                print(f"{table}: {count} rows")
+
+    elif args.command == "rebuild-count-aggregates":
+        upgrade_schema(engine)
+        with SessionLocal() as db:
+            print(f"count_aggregates: {aggregates.rebuild(db)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -6,6 +8,36 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     ALGORITHM: str
+    PERMISSION_CACHE_TTL_SECONDS: int = 30  # how long a worker trusts its role/permission map before re-reading it
+    STATELESS_TOKENS: bool = False  # sign role, score and scope into the token so requests skip the user lookup
+    STATELESS_TOKEN_RECHECK_SECONDS: int = 60  # how stale a stateless token may get before the user row is re-read
+    BCRYPT_ROUNDS: int = 12  # changing it rehashes each password transparently at the user's next login
+    HASHING_WORKERS: int = 2  # threads reserved for bcrypt hashing and verification
+    HASHING_MAX_PENDING: int = 64  # password operations allowed to wait for a thread before requests get a 503
+    SYNC_OVERLAP_SECONDS: int = 300  # how far back the next sync starts, covers writes still in flight during a sync
+    BATCH_MAX_ITEMS: int = 5000  # items one batch upload may carry, larger batches get a 413
+    EXPORT_BATCH: int = 1000  # rows an export reads per round trip of its server-side cursor
+    EXPORT_CACHE_DIR: str = ".export_cache"  # where the Arrow and Parquet exports are kept between pulls
+    EXPORT_CACHE_MAX_MB: int = 1024  # the least recently served exports are removed past this size
+    EXPORT_CACHE_GRACE_SECONDS: int = 300  # an export served more recently than this is never removed
+    WS_SEND_QUEUE_SIZE: int = 100  # messages waiting for one socket, more are dropped for that socket only
+    WS_SEND_TIMEOUT_SECONDS: float = 10  # a socket whose send takes longer is considered dead and evicted
+    PRESENCE_INTERVAL_SECONDS: float = 2  # joins and leaves are collected and sent to the viewers once per interval
+    PRESENCE_PAGE_SIZE: int = 100  # users per page of request_user_list
+    PRESENCE_HEARTBEAT_SECONDS: float = 10  # a worker silent for three beats has its users dropped from the others
+    PRESENCE_SNAPSHOT_BEATS: int = 6  # every so many heartbeats each viewer gets its whole scope, repairing lost deltas
+    BROKER_URL: str = ""  # redis://host:6379/0 shares the WebSocket fan-out between workers, empty keeps it local
+    DB_POOL_SIZE: int = 5  # connections each engine keeps open
+    DB_MAX_OVERFLOW: int = 10  # extra connections opened under load and closed once returned
+    DB_POOL_TIMEOUT: int = 30  # seconds a request waits for a free connection before it fails
+    DB_POOL_RECYCLE: int = 1800  # seconds after which a connection is replaced, poolers and proxies drop idle ones
+    DB_POOL_PRE_PING: bool = True  # test each connection on checkout instead of failing the request on a dead one
+    DB_STATEMENT_TIMEOUT_MS: int = 0  # cancel statements running longer than this on PostgreSQL, 0 keeps the server's
+    DB_TRANSACTION_POOLER: bool = False  # DATABASE_URL goes through a transaction mode pooler (pgbouncer, port 6543)
+    DATABASE_REPLICA_URLS: str = ""  # comma separated read replicas for the GET routes, empty reads from DATABASE_URL
+    REPLICA_SELECTION: Literal["round_robin", "least_loaded"] = "round_robin"
+    REPLICA_MAX_LAG_SECONDS: float = 10  # a replica further behind the primary is skipped until it catches up
+    REPLICA_LAG_CHECK_SECONDS: float = 5  # how often the lag of each replica is measured
 
     class Config:
         env_file = ".env"
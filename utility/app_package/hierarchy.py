@@ -0,0 +1,35 @@
+""" helpers for the dash-joined hierarchy ids: national-state-region-group-location, e.g. DCL-234-KW-GOI-GRP-01 """
+
+
+def hierarchy_ids(location_id: str) -> dict:
+    """ the state, region and group ids a location id belongs to, None for the levels it does not reach """
+    parts = (location_id or "").split("-")
+
+    return {
+        "state_id": "-".join(parts[:3]) if len(parts) >= 3 else None,
+        "region_id": "-".join(parts[:4]) if len(parts) >= 4 else None,
+        "group_id": "-".join(parts[:5]) if len(parts) >= 5 else None,
+    }
+
+
+def covering_scopes(location_id: str) -> list:
+    """ every access scope that covers a location id in the sense of utils.scope_filter: each of its dash-joined
+    prefixes, the national ones included """
+    parts = (location_id or "").split("-")
+    return ["-".join(parts[:size]) for size in range(1, len(parts) + 1)]
+
+
+def with_hierarchy(data: dict) -> dict:
+    """ add the denormalized hierarchy columns to an insert or update dict that sets the location_id """
+    if data.get("location_id"):
+        data.update(hierarchy_ids(data["location_id"]))
+    return data
+
+
+# hierarchy level -> the column of a fact table that holds the id of that level
+LEVEL_COLUMNS = {
+    "location": "location_id",
+    "group": "group_id",
+    "region": "region_id",
+    "state": "state_id",
+}
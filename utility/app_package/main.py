@@ -3,10 +3,11 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 
-from .database import engine
-from . import models
+from .database import engine, dispose_engines
+from . import models, utils
 from .routers import (counter, auth, region, user, state, group, location, workers, register, programs, attendance,
-                      tithes, fellowship, information, websocket, permissions, roles, rolescore, recovery)
+                      tithes, fellowship, information, websocket, permissions, roles, rolescore, recovery, metrics,
+                      sync, export)
 
 description = """
 This DCLM Utility server manages all the utility mobile and desktop application relating to the data management in the church
@@ -28,7 +29,9 @@ The app consists of seven(7) levels of admin privileges with a total of 11 admin
 
 """
 
-models.Base.metadata.create_all(bind=engine)  # create all the database tables
+# create the missing tables, the columns and indexes added to existing tables come from
+# `python -m app_package.commands upgrade-schema`, run once per deployment
+models.Base.metadata.create_all(bind=engine)
 
 # app instance initialization
 
@@ -38,6 +41,7 @@ app = FastAPI(
     description=description,
     summary="This server is still in development stage therefore, full description not available",
     version="0.0.4",
+    default_response_class=utils.FastJSONResponse,
     terms_of_service="http://example.com/terms/",
     contact={
         "name": "Impath-lab Technology",
@@ -70,6 +74,9 @@ app.include_router(location.router)  # this route is for the CRUD operations of
 app.include_router(programs.router)  # this route controls the CRUD operations for the program setup, local or statewide
 app.include_router(fellowship.router)  # the route that manage the fellowship CRUD operations
 app.include_router(information.router)
+app.include_router(sync.router)  # this route lets the mobile apps download only the rows changed since their last sync
+app.include_router(export.router)  # this route streams the scoped reports as CSV or NDJSON downloads
+app.include_router(metrics.router)  # this route exposes the in-process counters (caches, queues) of the server
 
 app.include_router(websocket.router)  # this route is for the websocket to manage realtime operations like notifications
 
@@ -84,6 +91,22 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
+# Exception handler for a saturated password hashing pool
+@app.exception_handler(utils.HashingBusyError)
+async def hashing_busy_exception_handler(request: Request, exc: utils.HashingBusyError):
+    logging.warning(f"Password hashing pool saturated: {utils.hashing_pool.stats()}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, please try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+# close the pooled connections so the database frees them as soon as the worker stops
+app.add_event_handler("shutdown", dispose_engines)
+app.add_event_handler("shutdown", websocket.manager.close)
+
+
 @app.get("/")
 def root():
     return {"message": "Deeper Christian Life Ministry"}
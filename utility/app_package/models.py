@@ -1,7 +1,42 @@
-from sqlalchemy import Column, Integer, String, TIMESTAMP, Date, func, ForeignKey, LargeBinary, Boolean, Float, Table
+from sqlalchemy import Column, Integer, String, TIMESTAMP, Date, func, ForeignKey, LargeBinary, Boolean, Float, Table, Index
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import event
 from sqlalchemy.orm import relationship
 
 from .database import Base
+from .hierarchy import hierarchy_ids
+
+
+def scope_index(table: str, column: str = "location_id") -> Index:
+    """ btree index that serves the anchored LIKE of utils.scope_filter whatever the database collation is """
+    return Index(f"ix_{table}_{column}_pattern", column, postgresql_ops={column: "text_pattern_ops"})
+
+
+def keyset_index(table: str, column: str = "date") -> Index:
+    """ composite index on the sort key of utils.paginate, so the cursor seek and the order by come from one scan """
+    return Index(f"ix_{table}_{column}_id", column, "id")
+
+
+def client_key_index(table: str) -> Index:
+    """ unique index on the client_uuid of an upload, the conflict target that makes a retried upload a no-op """
+    return Index(f"uq_{table}_client_uuid", "client_uuid", unique=True)
+
+
+class HierarchyMixin:
+    """ the state, region and group of the row's location_id, kept in indexed columns so dashboards can filter and
+    group by plain equality. They are filled in on every ORM insert/update, bulk writes use hierarchy.with_hierarchy """
+
+    state_id = Column(String, nullable=True, index=True)
+    region_id = Column(String, nullable=True, index=True)
+    group_id = Column(String, nullable=True, index=True)
+
+
+@event.listens_for(HierarchyMixin, "before_insert", propagate=True)
+@event.listens_for(HierarchyMixin, "before_update", propagate=True)
+def fill_hierarchy_ids(mapper, connection, target):
+    for key, value in hierarchy_ids(target.location_id).items():
+        setattr(target, key, value)
+
 
 # Association tables for many-to-many relationships
 role_permissions = Table(
@@ -69,6 +104,7 @@ class RoleScore(Base):
 class Workers(Base):
     """ *** THE WORKERS DATABASE SCHEMAS *** """
     __tablename__ = "workers"
+    __table_args__ = (scope_index("workers"), keyset_index("workers", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     user_id = Column(String, nullable=False, unique=True, index=True)
@@ -98,6 +134,7 @@ class Workers(Base):
 class User(Base):
     """ *** THE USER DATABASE SCHEMAS *** """
     __tablename__ = "users"
+    __table_args__ = (scope_index("users"),)
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     location_id = Column(String, nullable=False, index=True)
@@ -134,10 +171,12 @@ class PasswordResetToken(Base):
     users = relationship("User", back_populates="password_reset_tokens")
 
 
-class Counter(Base):
+class Counter(HierarchyMixin, Base):
     """ *** THE COUNTER DATABASE SCHEMAS *** """
 
     __tablename__: str = "counts"
+    __table_args__ = (scope_index("counts"), keyset_index("counts"), keyset_index("counts", "last_modify"),
+                      client_key_index("counts"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     program_domain = Column(String, nullable=False, index=True)
@@ -159,12 +198,44 @@ class Counter(Base):
     operation = Column(String, nullable=False, index=True)  # Delete, Update and create
     is_deleted = Column(Boolean, nullable=False, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    client_uuid = Column(String, nullable=True)  # set by the uploading device, a retry reuses it
+
 
+class CountAggregate(Base):
+    """ *** the counts summed per hierarchy node and period, kept up to date by aggregates.py on each count write *** """
 
-class Record(Base):
+    __tablename__: str = "count_aggregates"
+    __table_args__ = (
+        UniqueConstraint("level", "node_id", "church_type", "program_domain", "program_type", "period", "period_start",
+                         name="uq_count_aggregates_key"),
+        scope_index("count_aggregates", "node_id"),
+    )
+
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    level = Column(String, nullable=False)  # location, group, region or state
+    node_id = Column(String, nullable=False, index=True)
+    church_type = Column(String, nullable=False)
+    program_domain = Column(String, nullable=False)
+    program_type = Column(String, nullable=False)
+    period = Column(String, nullable=False)  # week, month or year
+    period_start = Column(Date, nullable=False, index=True)
+    records = Column(Integer, nullable=False, default=0)
+    adult_male = Column(Integer, nullable=False, default=0)
+    adult_female = Column(Integer, nullable=False, default=0)
+    youth_male = Column(Integer, nullable=False, default=0)
+    youth_female = Column(Integer, nullable=False, default=0)
+    boys = Column(Integer, nullable=False, default=0)
+    girls = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    last_modify = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+
+class Record(HierarchyMixin, Base):
     """ *** THIS CLASS MODEL CREATE THE INVITEE / CONVERT DATABASE *** """
 
     __tablename__: str = "record"
+    __table_args__ = (scope_index("record"), keyset_index("record"), keyset_index("record", "last_modify"),
+                      client_key_index("record"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     program_domain = Column(String, nullable=False, index=True)
@@ -190,12 +261,15 @@ class Record(Base):
     operation = Column(String, nullable=False, index=True)  # Delete, Update and create
     is_deleted = Column(Boolean, nullable=False, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    client_uuid = Column(String, nullable=True)  # set by the uploading device, a retry reuses it
 
 
-class Attendance(Base):
+class Attendance(HierarchyMixin, Base):
     """ *** THIS MODEL CREATE THE WORKER's AND LEADER's ATTENDANCE DATABASE *** """
 
     __tablename__: str = "attendance"
+    __table_args__ = (scope_index("attendance"), keyset_index("attendance"), keyset_index("attendance", "last_modify"),
+                      client_key_index("attendance"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     program_domain = Column(String, nullable=False, index=True)
@@ -217,12 +291,14 @@ class Attendance(Base):
     operation = Column(String, nullable=False, index=True)  # Delete, Update and create
     is_deleted = Column(Boolean, nullable=False, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    client_uuid = Column(String, nullable=True)  # set by the uploading device, a retry reuses it
 
 
 class States(Base):
     """ *** THIS MODEL CREATE THE INDIVIDUAL STATES IN EACH COUNTRY DATABASE *** """
 
     __tablename__: str = "states"
+    __table_args__ = (scope_index("states", "state_id"),)
 
     state_id = Column(String, primary_key=True, nullable=False, unique=True)
     country = Column(String, nullable=False, index=True)
@@ -243,6 +319,7 @@ class Region(Base):
     """ *** THIS MODEL CREATE THE VARIOUS REGIONS IN THE STATE DATABASE *** """
 
     __tablename__: str = "region"
+    __table_args__ = (scope_index("region", "region_id"),)
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     state_id = Column(String, ForeignKey("states.state_id"), nullable=False, index=True)
@@ -264,6 +341,7 @@ class Group(Base):
     """ *** THIS MODEL CREATE THE CHURCH GROUP DATABASE *** """
 
     __tablename__: str = "group"
+    __table_args__ = (scope_index("group", "group_id"),)
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     region_id = Column(String, ForeignKey("region.region_id"), nullable=False, index=True)
@@ -284,6 +362,7 @@ class Location(Base):
     """ *** THIS MODEL CREATE THE INDIVIDUAL CHURCH LOCATION DATABASE *** """
 
     __tablename__: str = "location"
+    __table_args__ = (scope_index("location"), keyset_index("location", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     group_id = Column(String, ForeignKey("group.group_id"), nullable=False, index=True)
@@ -309,6 +388,7 @@ class Location(Base):
 class Fellowship(Base):
     """ ** THIS MODEL CREATES THE FELLOWSHIP TABLE THAT SAVES THE FELLOWSHIP DATA ** """
     __tablename__ = 'fellowships'
+    __table_args__ = (scope_index("fellowships"), keyset_index("fellowships", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, nullable=False, unique=True, index=True)
@@ -334,6 +414,7 @@ class Fellowship(Base):
 
 class FellowshipMembers(Base):
     __tablename__ = 'fellowship_member'
+    __table_args__ = (scope_index("fellowship_member"), keyset_index("fellowship_member", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, ForeignKey('fellowships.fellowship_id'), nullable=False)
@@ -357,8 +438,10 @@ class FellowshipMembers(Base):
     location = relationship("Location", back_populates="fellowship_members")
 
 
-class FellowshipAttendance(Base):
+class FellowshipAttendance(HierarchyMixin, Base):
     __tablename__ = 'fellowship_attendance'
+    __table_args__ = (scope_index("fellowship_attendance"), keyset_index("fellowship_attendance"),
+                      keyset_index("fellowship_attendance", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, ForeignKey('fellowships.fellowship_id'), nullable=False)
@@ -378,8 +461,10 @@ class FellowshipAttendance(Base):
     location = relationship("Location", back_populates="fellowship_attendance")
 
 
-class AttendanceSum(Base):
+class AttendanceSum(HierarchyMixin, Base):
     __tablename__ = 'attendance_summaries'
+    __table_args__ = (scope_index("attendance_summaries"), keyset_index("attendance_summaries"),
+                      keyset_index("attendance_summaries", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, ForeignKey('fellowships.fellowship_id'), nullable=False)
@@ -401,6 +486,8 @@ class AttendanceSum(Base):
 
 class Testimony(Base):
     __tablename__ = 'testimonies'
+    __table_args__ = (scope_index("testimonies"), keyset_index("testimonies"),
+                      keyset_index("testimonies", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, ForeignKey('fellowships.fellowship_id'), nullable=False)
@@ -421,6 +508,8 @@ class Testimony(Base):
 
 class PrayerRequest(Base):
     __tablename__ = 'prayer_requests'
+    __table_args__ = (scope_index("prayer_requests"), keyset_index("prayer_requests"),
+                      keyset_index("prayer_requests", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     fellowship_id = Column(String, ForeignKey('fellowships.fellowship_id'), nullable=False)
@@ -442,6 +531,7 @@ class ChurchPrograms(Base):
     """ *** THIS MODEL CREATE THE CHURCH PROGRAMS SETUP DATABASE *** """
 
     __tablename__: str = "programs_setup"
+    __table_args__ = (scope_index("programs_setup"), keyset_index("programs_setup", "last_modify"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     location_id = Column(String, nullable=False, index=True)
@@ -458,8 +548,10 @@ class ChurchPrograms(Base):
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
 
-class TitheAndOffering(Base):
+class TitheAndOffering(HierarchyMixin, Base):
     __tablename__: str = "tithe_offering"
+    __table_args__ = (scope_index("tithe_offering"), keyset_index("tithe_offering"),
+                      keyset_index("tithe_offering", "last_modify"), client_key_index("tithe_offering"))
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     location_id = Column(String, nullable=False, index=True)
@@ -470,17 +562,19 @@ class TitheAndOffering(Base):
     operation = Column(String, nullable=False, index=True)  # Delete, Update and create
     is_deleted = Column(Boolean, nullable=False, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    client_uuid = Column(String, nullable=True)  # set by the uploading device, a retry reuses it
 
 
 class Information(Base):
     """ ** This model creates the table where the weekly information for each region will be saved ** """
     __tablename__ = "information"
+    __table_args__ = (scope_index("information", "region_id"),)
 
     information_id = Column(String, primary_key=True, nullable=False)
     region_id = Column(String, ForeignKey("region.region_id"), nullable=False)
     region_name = Column(String, nullable=False)
     meeting = Column(String, nullable=False)
-    date = Column(Date, nullable=False)
+    date = Column(Date, nullable=False, index=True)
     trets_topic = Column(String, nullable=True)
     trets_date = Column(Date, nullable=True)
     sws_topic = Column(String, nullable=True)
@@ -514,3 +608,7 @@ class InformationItems(Base):
     operation = Column(String, nullable=False, index=True)  # Delete, Update and create
     is_deleted = Column(Boolean, nullable=False, index=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+# the fact tables that carry the denormalized hierarchy columns
+HIERARCHY_MODELS = (Counter, Attendance, Record, TitheAndOffering, FellowshipAttendance, AttendanceSum)
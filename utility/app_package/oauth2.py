@@ -1,4 +1,10 @@
-from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, Optional, Tuple
+
 from jose import JWTError, jwt
 from fastapi import Depends, status, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
@@ -18,12 +24,31 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
 async def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # iat is whole seconds, iat_ms lets a revocation or user change in the same second be told apart from the login
+    to_encode.update({"exp": expire, "iat": now, "iat_ms": int(now.replace(tzinfo=timezone.utc).timestamp() * 1000)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def principal_claims(user: models.User, scope, db: Session) -> dict:
+    """ the claims of a stateless token, enough to rebuild schemas.UsersResponse without touching the database """
+
+    role = user.roles[0]
+    return {
+        "user_id": user.user_id,
+        "location_id": user.location_id,
+        "name": user.name,
+        "email": user.email,
+        "role_name": role.role_name,
+        "score": role.score.score,
+        "score_name": role.score.score_name,
+        "scope": scope or None,
+        "pv": permission_cache.fingerprint(db),
+    }
+
+
 def verify_access_token(token: str, credentials_exception):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
@@ -37,21 +62,38 @@ def verify_access_token(token: str, credentials_exception):
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme),
-                     db: Session = Depends(database.get_db)) -> schemas.UsersResponse:
-    credential_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"}
+def decode_access_token(token: str, credentials_exception) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
+    except JWTError:
+        raise credentials_exception
+    if payload.get("user_id") is None:
+        raise credentials_exception
+    return payload
+
+
+def _principal_from_claims(payload: dict) -> schemas.UsersResponse:
+    return schemas.UsersResponse(
+        user_id=payload["user_id"],
+        location_id=payload["location_id"],
+        name=payload["name"],
+        email=payload["email"],
+        scope=payload.get("scope"),
+        roles=[schemas.Role(
+            role_name=payload["role_name"],
+            score=schemas.RoleScore(
+                score=payload["score"],
+                score_name=payload["score_name"]
+            )
+        )]
     )
 
-    # Verify the token and get the token data
-    token_data = verify_access_token(token, credential_exception)
 
+def _load_principal(user_id: str, db: Session, credential_exception) -> Tuple[models.User, schemas.UsersResponse]:
     # Fetch the user from the database with eagerly loaded roles and role scores
     user = db.query(models.User).options(
         joinedload(models.User.roles).joinedload(models.Role.score)
-    ).filter(models.User.user_id == token_data.user_id).first()
+    ).filter(models.User.user_id == user_id).first()
 
     if user is None:
         raise credential_exception
@@ -71,24 +113,206 @@ def get_current_user(token: str = Depends(oauth2_scheme),
         ) for role in user.roles]
     )
 
+    return user, user_response
+
+
+def get_current_user(token: str = Depends(oauth2_scheme),
+                     db: Session = Depends(database.get_db)) -> schemas.UsersResponse:
+    credential_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+    # Verify the token and get the token data
+    payload = decode_access_token(token, credential_exception)
+    user_id = payload["user_id"]
+
+    if "pv" not in payload:
+        # a classic token only carries the user id, the principal always comes from the database
+        _, user_response = _load_principal(user_id, db, credential_exception)
+        return user_response
+
+    issued_at = payload.get("iat_ms", payload.get("iat", 0) * 1000)
+    if revocations.is_revoked(user_id, issued_at):
+        raise credential_exception
+
+    # the claims are trusted while the role/permission tables are unchanged and the user was checked recently
+    fingerprint = permission_cache.fingerprint(db)
+    if payload["pv"] == fingerprint and not revocations.needs_check(user_id):
+        return _principal_from_claims(payload)
+
+    user, user_response = _load_principal(user_id, db, credential_exception)
+
+    if user.is_deleted or not user.is_active:
+        revocations.revoke(user_id)
+        raise credential_exception
+
+    claims = _principal_from_claims(payload)
+    if (payload["pv"] != fingerprint or _modified_since(user, issued_at)
+            or claims.location_id != user_response.location_id or claims.roles[0] != user_response.roles[0]):
+        # the token was signed before a role, permission or user change, serve this request from the database
+        # and refuse the token from now on so the client logs in again
+        revocations.revoke(user_id)
+        return user_response
+
+    revocations.mark_checked(user_id)
     return user_response
 
 
+def _modified_since(user: models.User, issued_at: int) -> bool:
+    """ the user row was written after the token was signed, issued_at in milliseconds. The row is what every worker
+    shares, so an update or revocation made on one worker is seen by the others at their next check """
+    modified = user.last_modify
+    if modified is None:
+        return False
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)  # SQLite drops the zone, the writes store UTC
+    return int(modified.timestamp() * 1000) > issued_at
+
+
+class PermissionCache:
+    """ in-process map of role name -> permission names, rebuilt after an invalidation or once it is older than
+    PERMISSION_CACHE_TTL_SECONDS. invalidate() only reaches the worker that made the change, the other workers pick
+    the change up when their copy expires """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._permissions: Optional[Dict[str, FrozenSet[str]]] = None
+        self._fingerprint: Optional[str] = None
+        self._loaded_at = 0.0
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def _load(self, db: Session) -> Tuple[Dict[str, FrozenSet[str]], str]:
+        roles = db.query(models.Role).options(joinedload(models.Role.permissions),
+                                              joinedload(models.Role.score)).all()
+        permissions = {role.role_name: frozenset(p.permission for p in role.permissions) for role in roles}
+
+        # the fingerprint only depends on the table contents, so every worker computes the same value
+        snapshot = sorted((role.role_name, role.score.score if role.score else None,
+                           sorted(permissions[role.role_name])) for role in roles)
+        fingerprint = hashlib.sha1(json.dumps(snapshot).encode()).hexdigest()[:16]
+        return permissions, fingerprint
+
+    def _ensure_loaded(self, db: Session) -> Tuple[Dict[str, FrozenSet[str]], str]:
+        with self._lock:
+            permissions = self._permissions
+            fingerprint = self._fingerprint
+            version = self.version
+            if permissions is not None:
+                if time.monotonic() - self._loaded_at < settings.PERMISSION_CACHE_TTL_SECONDS:
+                    self.hits += 1
+                    return permissions, fingerprint
+                self.expirations += 1
+            self.misses += 1
+
+        loaded_at = time.monotonic()
+        permissions, fingerprint = self._load(db)
+
+        with self._lock:
+            # only publish the map if nothing was invalidated while it was being read
+            if self.version == version:
+                self._permissions = permissions
+                self._fingerprint = fingerprint
+                self._loaded_at = loaded_at
+        return permissions, fingerprint
+
+    def get(self, role_name: str, db: Session) -> Optional[FrozenSet[str]]:
+        permissions, _ = self._ensure_loaded(db)
+        return permissions.get(role_name)
+
+    def fingerprint(self, db: Session) -> str:
+        _, fingerprint = self._ensure_loaded(db)
+        return fingerprint
+
+    def invalidate(self):
+        with self._lock:
+            self._permissions = None
+            self._fingerprint = None
+            self.version += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "fingerprint": self._fingerprint,
+                "loaded": self._permissions is not None,
+                "roles": len(self._permissions) if self._permissions is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "expirations": self.expirations,
+            }
+
+
+permission_cache = PermissionCache()
+
+
+class TokenRevocations:
+    """ remembers which users must re-authenticate and when stateless tokens were last checked against the database.
+
+    Both maps are per worker, they only spare the database lookups. The decision itself comes from the database: a
+    worker re-reads the user row at least every STATELESS_TOKEN_RECHECK_SECONDS and compares the permission
+    fingerprint with a map at most PERMISSION_CACHE_TTL_SECONDS old, so a revocation made on another worker takes
+    effect here within those bounds """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked: Dict[str, float] = {}
+        self._checked: Dict[str, float] = {}
+
+    def revoke(self, user_id: str):
+        now = time.time()
+        with self._lock:
+            self._revoked[user_id] = now
+            self._checked.pop(user_id, None)
+            # tokens outlive a revocation by at most their own lifetime, older entries are useless
+            horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            for key in [key for key, revoked_at in self._revoked.items() if revoked_at < horizon]:
+                del self._revoked[key]
+
+    def is_revoked(self, user_id: str, issued_at: int) -> bool:
+        """ issued_at in milliseconds, the iat_ms claim. A token signed in the same millisecond as the revocation is
+        refused; a token without iat_ms counts from the start of its second, so one signed in the second of the
+        revocation is refused too """
+        with self._lock:
+            revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= int(revoked_at * 1000)
+
+    def needs_check(self, user_id: str) -> bool:
+        with self._lock:
+            checked_at = self._checked.get(user_id)
+        return checked_at is None or time.time() - checked_at > settings.STATELESS_TOKEN_RECHECK_SECONDS
+
+    def mark_checked(self, user_id: str):
+        with self._lock:
+            self._checked[user_id] = time.time()
+
+
+revocations = TokenRevocations()
+
+
+def revoke_user_tokens(user_id: str):
+    """ call after a user is deleted, deactivated or has its roles or location changed """
+    revocations.revoke(user_id)
+
+
 def has_permission(permission: str):
     def permission_checker(current_user: str = Depends(get_current_user), db: Session = Depends(database.get_db)):
 
         user_role = current_user.roles[0].role_name
-        # Fetch the role of the current user
-        role = db.query(models.Role).filter(models.Role.role_name == user_role).first()
+        # Fetch the permissions of the current user's role, the database is only read when the cache is cold
+        role_permissions = permission_cache.get(user_role, db)
 
-        if role is None:
+        if role_permissions is None:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Role not found")
 
-        # Check if the role has the required permission
-        role_permissions = db.query(models.Permission).join(models.Role.permissions).filter(
-            models.Role.id == role.id).all()
-
-        if not any(p.permission == permission for p in role_permissions):
+        if permission not in role_permissions:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough Privilege")
 
         return current_user
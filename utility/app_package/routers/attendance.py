@@ -1,12 +1,12 @@
 import json
-from datetime import datetime
-from typing import List, Optional, Union
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
-from sqlalchemy.orm import Session
-
-from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas, utils, models, oauth2, bulk
+from ..database import get_async_db, get_async_read_db
 from .websocket import manager
 
 router = APIRouter(
@@ -17,7 +17,7 @@ router = APIRouter(
 
 @router.get('/get-worker-for-attendance/', response_model=Union[schemas.WorkerResponse, List[schemas.WorkerResponse]])
 async def get_workers(
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_read_db),
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
         current_user: str = Depends(oauth2.get_current_user),
@@ -33,15 +33,15 @@ async def get_workers(
     if not location_id:
         raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail="Location Id is required")
 
-    query = db.query(models.Workers).filter(models.Workers.location_id.ilike(f'%{location_id}%'),
-                                            models.Workers.is_deleted == False)
+    query = select(models.Workers).filter(utils.scope_filter(models.Workers.location_id, location_id),
+                                          models.Workers.is_deleted == False)
 
     # Filter query based on provided parameters
     if worker_id:
         query = query.filter(models.Workers.user_id == worker_id)
 
     if location_id:
-        query = query.filter(models.Workers.location_id.ilike(f'%{location_id}%'))
+        query = query.filter(utils.scope_filter(models.Workers.location_id, location_id))
 
     if gender:
         query = query.filter(models.Workers.gender == gender)
@@ -62,7 +62,7 @@ async def get_workers(
     query = query.offset(offset).limit(limit)
 
     # Execute the query
-    workers = query.all()
+    workers = (await db.execute(query)).scalars().all()
 
     if not workers:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -78,13 +78,16 @@ async def get_workers(
     return workers
 
 
-@router.get('/read-attendance/', response_model=Union[schemas.AttendanceResponse, List[schemas.AttendanceResponse]])
+@router.get('/read-attendance/', response_model=schemas.sparse(schemas.AttendanceResponse))
 async def get_attendance(
+        response: Response,
         _id: Optional[int] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         program_domain: Optional[str] = None,
         program_type: Optional[str] = None,
         location: Optional[str] = None,
@@ -94,6 +97,8 @@ async def get_attendance(
         end_month: Optional[int] = None,
         start_year: Optional[int] = None,
         end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
         # Add other query parameters as needed
 ):
     role = await utils.create_admin_access_id(current_user)
@@ -101,8 +106,10 @@ async def get_attendance(
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.Attendance).filter(models.Attendance.location_id.ilike(f'%{role}%'),
-                                               models.Attendance.is_deleted == False)
+    names = utils.response_fields(schemas.AttendanceResponse, fields)
+    keyset = (models.Attendance.date, models.Attendance.id)
+    query = select(*utils.response_columns(models.Attendance, names, keyset)).filter(
+        utils.scope_filter(models.Attendance.location_id, role), models.Attendance.is_deleted == False)
 
     if _id:
         query = query.filter(models.Attendance.id == _id)
@@ -117,35 +124,29 @@ async def get_attendance(
         query = query.filter(models.Attendance.location == location)
 
     if date:
-        query = query.filter(models.Attendance.date == date)
+        query = query.filter(models.Attendance.date == utils.parse_date(date, "date"))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.Attendance.date) >= start_month,
-            extract('month', models.Attendance.date) <= end_month)
+    query = query.filter(*utils.date_range_filter(models.Attendance.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.Attendance.date) >= start_year,
-            extract('year', models.Attendance.date) <= end_year)
-
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    attendance = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    attendance = (await db.execute(query)).all()
+    utils.set_next_cursor(response, attendance, keyset, limit)
 
     if not attendance:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found!')
 
     if get_all:
-        return attendance
+        return utils.rows_response(response, attendance, names)
 
     # If a single attendance was requested by ID, return just that attendance
     if _id:
         if len(attendance) == 1:
-            return attendance[0]
+            return utils.rows_response(response, attendance[0], names)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Attendance with id: {_id} not found!')
 
-    return attendance
+    return utils.rows_response(response, attendance, names)
 
 
 # @router.post('/create-attendance/', status_code=status.HTTP_201_CREATED, response_model=schemas.AttendanceResponse)
@@ -189,37 +190,43 @@ async def upload_records(records: List[Record], db: Session):
 """
 
 
-@router.post('/create-attendance/', status_code=status.HTTP_201_CREATED)
-async def batch_create_attendance(attendance_batch: List[schemas.CreateAttendance],
-                                  db: Session = Depends(get_db),
-                                  current_user: str = Depends(oauth2.get_current_user)):
+# this api route saves a batch of attendance rows (schemas.CreateAttendance) and reports what happened to each item
+@router.post('/create-attendance/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def batch_create_attendance(attendance_batch: List[Dict[str, Any]],
+                                  db: AsyncSession = Depends(get_async_db),
+                                  current_user: str = Depends(oauth2.get_current_user),
+                                  idempotency_key: Optional[str] = Header(None)):
     try:
-        # print(attendance_batch)
-        for attendance_data in attendance_batch:
-            attendance = models.Attendance(**attendance_data.dict())
-            db.add(attendance)
-        db.commit()
-
-        date_time = await utils.format_date_time(str(datetime.utcnow()))
-
-        await manager.broadcast(json.dumps(
-            {
-                "type": "notification",
-                "user_id": current_user.user_id,
-                "data": date_time,
-                "note": "Batch attendance submitted to the database"
-            }
-        ))
-
-        return {"detail": "Batch attendance successfully created"}
+        # each row is validated on its own so one bad row does not reject a whole convention batch, and a retried
+        # batch carries the same key (or the same client_uuid per row) so its stored rows are skipped
+        result, created = await bulk.create_batch(db, schemas.CreateAttendance, models.Attendance, attendance_batch,
+                                                  current_user, idempotency_key)
+        await db.commit()
+
+        if created:
+            date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+            await manager.publish(json.dumps(
+                {
+                    "type": "notification",
+                    "user_id": current_user.user_id,
+                    "data": date_time,
+                    "note": "Batch attendance submitted to the database"
+                }
+            ), *{row["location_id"] for row in created})
+
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        print(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Batch attendance could not be created.")
 
 
 @router.delete("/delete-attendance/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_attendance(_id: str, db: Session = Depends(get_db),
+async def delete_attendance(_id: int, db: AsyncSession = Depends(get_async_db),
                             current_user: str = Depends(oauth2.get_current_user)):
     role = await utils.create_admin_access_id(current_user)
 
@@ -228,23 +235,24 @@ async def delete_attendance(_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    attendance = db.query(models.Attendance).filter(models.Attendance.id == _id,
-                                                    models.Attendance.is_deleted == False,
-                                                    models.Attendance.location_id.ilike(f'%{role}%')).first()
+    attendance = (await db.execute(select(models.Attendance).filter(
+        models.Attendance.id == _id,
+        models.Attendance.is_deleted == False,
+        utils.scope_filter(models.Attendance.location_id, role)))).scalars().first()
 
     if attendance is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Data with id: {_id} not found!")
 
     update_data = schemas.UpdateAttendance(
         is_deleted=True,
-        last_modify=datetime.now()
+        last_modify=datetime.now(timezone.utc)
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(attendance, field, value)
 
-    db.commit()
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Attendance record with ID: {_id} deleted successfully!"
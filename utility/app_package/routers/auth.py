@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from .. import utils, models, oauth2, database, schemas
+from ..config import settings
 
 router = APIRouter(
     prefix="/login",
@@ -38,15 +41,19 @@ router = APIRouter(
 #
 
 @router.post('/', response_model=schemas.LoginResponse)
-async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(),
+                db: AsyncSession = Depends(database.get_async_db)):
     # user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
-    user = db.query(models.User).options(joinedload(models.User.roles)).filter(
-        models.User.email == user_credentials.username).first()
+    user = (await db.execute(select(models.User).options(
+        joinedload(models.User.roles).joinedload(models.Role.score)).filter(
+        models.User.email == user_credentials.username))).unique().scalars().first()
 
     if not user:  # check if user exists
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User Not Found!")
 
-    if not await utils.verify_password(user_credentials.password, user.password):  # verify the user password
+    # verify the user password
+    verified, new_hash = await utils.verify_and_update_password(user_credentials.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid Credentials")
 
     if user.is_deleted:
@@ -56,8 +63,9 @@ async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Ses
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Account not activated, please contact admin")
 
-    # create user access token to be used with other api endpoints
-    access_token = await oauth2.create_access_token(data={"user_id": user.user_id, "location_id": user.location_id})
+    if new_hash:  # the stored hash used an older bcrypt cost, upgrade it now that the plain password is known
+        user.password = new_hash
+        await db.commit()
 
     if user.roles:
         role = user.roles[0]  # Get the first role for simplicity
@@ -66,6 +74,15 @@ async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Ses
     else:
         raise HTTPException(status_code=404, detail="Role not found for user")
 
+    # create user access token to be used with other api endpoints
+    if settings.STATELESS_TOKENS:
+        scope = await utils.create_admin_access_id(user)
+        claims = await db.run_sync(lambda sync_db: oauth2.principal_claims(user, scope, sync_db))
+        access_token = await oauth2.create_access_token(data=claims)
+    else:
+        access_token = await oauth2.create_access_token(data={"user_id": user.user_id,
+                                                              "location_id": user.location_id})
+
     response = {
         "access_token": access_token,
         "token_type": "bearer",
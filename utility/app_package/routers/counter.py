@@ -1,12 +1,12 @@
 import json
-from datetime import datetime
-from typing import List, Optional, Union
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
-from sqlalchemy.orm import Session
-
-from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Literal, Optional, Union
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Response
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas, utils, models, oauth2, hierarchy, aggregates, bulk
+from ..database import get_async_db, get_async_read_db
 from .websocket import manager
 
 router = APIRouter(
@@ -15,14 +15,17 @@ router = APIRouter(
 )
 
 
-@router.get('/read-counts/', response_model=Union[schemas.CountResponse, List[schemas.CountResponse]])
+@router.get('/read-counts/', response_model=schemas.sparse(schemas.CountResponse))
 async def get_counts(
+        response: Response,
         _id: Optional[int] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_count")),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         program_domain: Optional[str] = None,
         program_type: Optional[str] = None,
         location_id: Optional[str] = None,
@@ -32,6 +35,8 @@ async def get_counts(
         end_month: Optional[int] = None,  # End month of range
         start_year: Optional[int] = None,  # Start year of range
         end_year: Optional[int] = None,  # End year of range
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
         # Add other query parameters as needed
 ):
     user_type = await utils.create_admin_access_id(current_user)
@@ -39,8 +44,11 @@ async def get_counts(
     if user_type is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.Counter).filter(models.Counter.location_id.ilike(f'%{user_type}%'),
-                                            models.Counter.is_deleted == False)
+    # rows of the response columns, not ORM objects: they are serialized as read, see utils.rows_response
+    names = utils.response_fields(schemas.CountResponse, fields)
+    keyset = (models.Counter.date, models.Counter.id)
+    query = select(*utils.response_columns(models.Counter, names, keyset)).filter(
+        utils.scope_filter(models.Counter.location_id, user_type), models.Counter.is_deleted == False)
 
     if _id:
         query = query.filter(models.Counter.id == _id)
@@ -55,69 +63,187 @@ async def get_counts(
         query = query.filter(models.Counter.location_id == location_id)
 
     if date:
-        query = query.filter(models.Counter.date == date)
+        query = query.filter(models.Counter.date == utils.parse_date(date, "date"))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.Counter.date) >= start_month,
-            extract('month', models.Counter.date) <= end_month)
-
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.Counter.date) >= start_year,
-            extract('year', models.Counter.date) <= end_year)
+    query = query.filter(*utils.date_range_filter(models.Counter.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
     # Add conditions for other parameters
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    counts = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    counts = (await db.execute(query)).all()
+    utils.set_next_cursor(response, counts, keyset, limit)
     if not counts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found')
 
     if get_all:
-        return counts
+        return utils.rows_response(response, counts, names)
 
     # If a single user was requested by ID, return just that user
     if _id:
         if len(counts) == 1:
-            return counts[0]
+            return utils.rows_response(response, counts[0], names)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Count with id: {_id} not found!')
 
-    return counts
+    return utils.rows_response(response, counts, names)
+
+
+# this api route returns the counts summed per location, group, region or state and per week, month or year
+@router.get('/rollup/', response_model=List[schemas.CountRollup])
+async def get_rollup(
+        level: Literal["location", "group", "region", "state"] = "state",
+        period: Literal["week", "month", "year"] = "month",
+        db: AsyncSession = Depends(get_async_read_db),
+        current_user: str = Depends(oauth2.get_current_user),
+        user_access: None = Depends(oauth2.has_permission("read_count")),
+        program_domain: Optional[str] = None,
+        program_type: Optional[str] = None,
+        church_type: Optional[str] = None,
+        location_id: Optional[str] = None,  # only roll up this node of the hierarchy and what sits below it
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        fresh: Optional[bool] = False,  # sum the counts table itself instead of the maintained aggregates
+):
+    user_type = await utils.create_admin_access_id(current_user)
+
+    if not user_type:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+
+    use_aggregates = not fresh and aggregates.covers(level, period, (user_type, location_id), start_month, end_month,
+                                                     start_year, end_year, from_date, to_date)
+
+    if use_aggregates:
+        # one summary row per node, period and program: the read does not depend on the number of counts
+        source = models.CountAggregate
+        node, bucket, records = source.node_id, source.period_start, func.sum(source.records)
+        scoped, date_column = source.node_id, source.period_start
+        conditions = [source.level == level, source.period == period]
+    else:
+        source = models.Counter
+        node = getattr(source, hierarchy.LEVEL_COLUMNS[level])
+        bucket = utils.period_start(source.date, period, db.get_bind().dialect.name)
+        records = func.count(source.id)
+        scoped, date_column = source.location_id, source.date
+        conditions = [source.is_deleted == False, node.isnot(None)]
+
+    # the database does the summing, one row comes back per node and period
+    query = select(node.label("node_id"), bucket.label("period"), records.label("records"),
+                   *[func.sum(getattr(source, field)).label(field) for field in aggregates.COUNT_FIELDS]
+                   ).filter(utils.scope_filter(scoped, user_type), *conditions)
+
+    if program_domain:
+        query = query.filter(source.program_domain == program_domain)
+
+    if program_type:
+        query = query.filter(source.program_type == program_type)
+
+    if church_type:
+        query = query.filter(source.church_type == church_type)
+
+    if location_id:
+        query = query.filter(utils.scope_filter(scoped, location_id))
+
+    query = query.filter(*utils.date_range_filter(date_column, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
+
+    query = query.group_by(node, bucket)
+    if use_aggregates:
+        # buckets whose counts were all deleted or moved stay behind with zero records
+        query = query.having(func.sum(source.records) > 0)
+
+    rows = (await db.execute(query.order_by(bucket, node))).all()
+
+    return [schemas.CountRollup(level=level, **row._mapping) for row in rows]
 
 
 @router.post('/create-counts/', status_code=status.HTTP_201_CREATED, response_model=schemas.CountResponse)
-async def create_count(counts: schemas.CreateCount, db: Session = Depends(get_db),
+async def create_count(counts: schemas.CreateCount, response: Response, db: AsyncSession = Depends(get_async_db),
                        current_user: str = Depends(oauth2.get_current_user),
+                       idempotency_key: Optional[str] = Header(None),  # a retry sends the same key, or client_uuid
                        # user_access: None = Depends(oauth2.has_permission("create_count"))
                        ):
     try:
-        new_count = models.Counter(**counts.dict())
-        db.add(new_count)
-        db.commit()
-        db.refresh(new_count)
+        row = counts.dict()
+        row["client_uuid"] = row.get("client_uuid") or idempotency_key
+
+        if row["client_uuid"]:
+            new_count, created = await db.run_sync(bulk.insert_once, models.Counter, row, current_user,
+                                                   await bulk.uploader_scope(current_user))
+        else:
+            new_count, created = models.Counter(**row), True
+            db.add(new_count)
+
+        if not created:
+            # the upload is already stored and counted, answer with that row and write nothing
+            response.headers["Idempotent-Replayed"] = "true"
+            return new_count
+
+        await db.run_sync(aggregates.apply_count_change, None, aggregates.snapshot(new_count))
+        await db.commit()
+        await db.refresh(new_count)
 
         date_time = await utils.format_date_time(str(new_count.created_at))
 
-        await manager.broadcast(json.dumps(
+        await manager.publish(json.dumps(
             {
                 "type": "notification",
                 "user_id": current_user.user_id,
                 "data": date_time,
                 "note": "New count data submitted to the database, please check data for descriptions and more details"
             }
-        ))
+        ), new_count.location_id)
         return new_count
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()  # Rollback changes in case of exception
+        await db.rollback()  # Rollback changes in case of exception
         print(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error! Count could not be saved.")
 
 
+# this api route saves a list of new count records in one transaction and reports what happened to each item
+@router.post('/create-counts/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_counts_batch(counts: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                              current_user: str = Depends(oauth2.get_current_user),
+                              idempotency_key: Optional[str] = Header(None)):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateCount, models.Counter, counts, current_user,
+                                                  idempotency_key)
+        await db.run_sync(aggregates.apply_count_changes, [(None, aggregates.snapshot(row)) for row in created])
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Counts could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} new count records submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 # this api route update the counts already submitted to the database
 @router.patch("/update-counts/", response_model=schemas.CountResponse)
-async def update_count(count_id: str, counts: schemas.UpdateCount, db: Session = Depends(get_db),
+async def update_count(count_id: int, counts: schemas.UpdateCount, db: AsyncSession = Depends(get_async_db),
                        current_user: str = Depends(oauth2.get_current_user),
                        user_access: None = Depends(oauth2.has_permission("update_count"))):
     role = await utils.create_admin_access_id(current_user)
@@ -125,11 +251,11 @@ async def update_count(count_id: str, counts: schemas.UpdateCount, db: Session =
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    count_query = db.query(models.Counter).filter(models.Counter.id == count_id,
-                                                  models.Counter.is_deleted == False,
-                                                  models.Counter.location_id.ilike(f"%{role}%"))
+    count_query = select(models.Counter).filter(models.Counter.id == count_id,
+                                                models.Counter.is_deleted == False,
+                                                utils.scope_filter(models.Counter.location_id, role))
 
-    record = count_query.first()
+    record = (await db.execute(count_query)).scalars().first()
 
     if record is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -139,28 +265,33 @@ async def update_count(count_id: str, counts: schemas.UpdateCount, db: Session =
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Record not found!")
 
+    before = aggregates.snapshot(record)
+
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = counts.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    count_query.update(updated_data)
-    db.commit()
-    db.refresh(record)
+    await db.execute(update(models.Counter).filter(models.Counter.id == record.id)
+                     .values(**hierarchy.with_hierarchy(updated_data)))
+    # the session copy of the record now holds the new values, move its totals in the same transaction
+    await db.run_sync(aggregates.apply_count_change, before, aggregates.snapshot(record))
+    await db.commit()
+    await db.refresh(record)
 
-    await manager.broadcast(json.dumps(
+    await manager.publish(json.dumps(
         {
             "type": "notification",
             "user_id": current_user.user_id,
             "data": record.location_id
         }
-    ))
+    ), record.location_id)
 
     return record
 
 
 @router.delete("/delete-counts/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_count(_id: str, db: Session = Depends(get_db),
+async def delete_count(_id: int, db: AsyncSession = Depends(get_async_db),
                        current_user: str = Depends(oauth2.get_current_user),
                        user_access: None = Depends(oauth2.has_permission("delete_count"))
                        ):
@@ -170,23 +301,28 @@ async def delete_count(_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    count = db.query(models.Counter).filter(models.Counter.id == _id,
-                                            models.Counter.is_deleted == False,
-                                            models.Counter.location_id.ilike(f'%{role}%')).first()
+    count = (await db.execute(select(models.Counter).filter(
+        models.Counter.id == _id,
+        models.Counter.is_deleted == False,
+        utils.scope_filter(models.Counter.location_id, role)))).scalars().first()
 
     if count is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Data with id: {_id} does not exist")
 
     update_data = schemas.UpdateCount(
+        date=count.date,  # required by the schema, unchanged
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
+    before = aggregates.snapshot(count)
+
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(count, field, value)
-    db.commit()
+    await db.run_sync(aggregates.apply_count_change, before, None)
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Count record with ID: {_id} deleted successfully!"
@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+from typing import Literal, Optional
+
+from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import select
+
+from .. import utils, models, oauth2, columnar
+from ..config import settings
+from ..database import async_read_session
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"]
+)
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", **columnar.MEDIA_TYPES}
+Format = Literal["csv", "ndjson", "arrow", "parquet"]
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+async def _access(current_user) -> str:
+    user_type = await utils.create_admin_access_id(current_user)
+
+    if not user_type:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access")
+    return user_type
+
+
+def _filters(model, user_type, location_id, start_month, end_month, start_year, end_year, from_date, to_date) -> list:
+    """ the conditions of every export: the caller's scope, live rows only and the usual date range. location_id
+    narrows the export to a node of the hierarchy and what sits below it """
+    conditions = [utils.scope_filter(model.location_id, user_type), model.is_deleted == False,
+                  *utils.date_range_filter(model.date, start_month, end_month, start_year, end_year,
+                                           from_date, to_date)]
+
+    if location_id:
+        conditions.append(utils.scope_filter(model.location_id, location_id))
+    return conditions
+
+
+def _projection(model, columns: Optional[str]) -> list:
+    """ the table columns named in a comma separated list, all of them when none is given """
+    if not columns:
+        return list(model.__table__.columns)
+
+    names = [name.strip() for name in columns.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.__table__.c]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown columns: {', '.join(unknown)}")
+    return [model.__table__.c[name] for name in names]
+
+
+async def _partitions(stmt):
+    # the route's own session is closed before the body is sent, the stream reads through a session of its own
+    async with async_read_session() as db:
+        result = await db.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH))
+        async for rows in result.partitions():
+            yield rows
+
+
+async def _export(name: str, model, conditions: list, format: str, columns: Optional[str]):
+    """ the projected columns of the matching rows. CSV and NDJSON are streamed one chunk per EXPORT_BATCH rows so
+    memory stays flat, Arrow and Parquet are served from the export cache """
+    columns = _projection(model, columns)
+    filename = f"{name}.{format}"
+
+    if format in columnar.MEDIA_TYPES:
+        if columnar.pa is None:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                                detail=f"The {format} export needs pyarrow installed on the server")
+        path = await columnar.export_file(model, conditions, columns, format)
+        return FileResponse(path, media_type=MEDIA_TYPES[format], filename=filename)
+
+    keys = [column.key for column in columns]
+    stmt = select(*columns).filter(*conditions).order_by(model.date, model.id)
+
+    async def csv_body():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(keys)
+        async for rows in _partitions(stmt):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()  # the header alone when nothing matched
+
+    async def ndjson_body():
+        async for rows in _partitions(stmt):
+            yield "".join(json.dumps(dict(zip(keys, row)), default=_json_default) + "\n" for row in rows)
+
+    return StreamingResponse(csv_body() if format == "csv" else ndjson_body(), media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# this api route streams the counts of the user's scope as CSV, NDJSON, Arrow or Parquet
+@router.get('/counts/')
+async def export_counts(
+        format: Format = "csv",
+        columns: Optional[str] = None,  # comma separated column names, all of them by default
+        current_user: str = Depends(oauth2.get_current_user),
+        user_access: None = Depends(oauth2.has_permission("read_count")),
+        program_domain: Optional[str] = None,
+        program_type: Optional[str] = None,
+        location_id: Optional[str] = None,
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+):
+    user_type = await _access(current_user)
+    conditions = _filters(models.Counter, user_type, location_id, start_month, end_month, start_year, end_year,
+                          from_date, to_date)
+
+    if program_domain:
+        conditions.append(models.Counter.program_domain == program_domain)
+
+    if program_type:
+        conditions.append(models.Counter.program_type == program_type)
+
+    return await _export("counts", models.Counter, conditions, format, columns)
+
+
+# this api route streams the workers attendance of the user's scope as CSV, NDJSON, Arrow or Parquet
+@router.get('/attendance/')
+async def export_attendance(
+        format: Format = "csv",
+        columns: Optional[str] = None,  # comma separated column names, all of them by default
+        current_user: str = Depends(oauth2.get_current_user),
+        program_domain: Optional[str] = None,
+        program_type: Optional[str] = None,
+        location_id: Optional[str] = None,
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+):
+    user_type = await _access(current_user)
+    conditions = _filters(models.Attendance, user_type, location_id, start_month, end_month, start_year, end_year,
+                          from_date, to_date)
+
+    if program_domain:
+        conditions.append(models.Attendance.program_domain == program_domain)
+
+    if program_type:
+        conditions.append(models.Attendance.program_type == program_type)
+
+    return await _export("attendance", models.Attendance, conditions, format, columns)
+
+
+# this api route streams the newcomer and convert records of the user's scope as CSV, NDJSON, Arrow or Parquet
+@router.get('/records/')
+async def export_records(
+        format: Format = "csv",
+        columns: Optional[str] = None,  # comma separated column names, all of them by default
+        current_user: str = Depends(oauth2.get_current_user),
+        user_access: None = Depends(oauth2.has_permission("read_record")),
+        program_domain: Optional[str] = None,
+        program_type: Optional[str] = None,
+        location_id: Optional[str] = None,
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+):
+    user_type = await _access(current_user)
+    conditions = _filters(models.Record, user_type, location_id, start_month, end_month, start_year, end_year,
+                          from_date, to_date)
+
+    if program_domain:
+        conditions.append(models.Record.program_domain == program_domain)
+
+    if program_type:
+        conditions.append(models.Record.program_type == program_type)
+
+    return await _export("records", models.Record, conditions, format, columns)
+
+
+# this api route streams the tithes and offerings of the user's scope as CSV, NDJSON, Arrow or Parquet
+@router.get('/tithes/')
+async def export_tithes(
+        format: Format = "csv",
+        columns: Optional[str] = None,  # comma separated column names, all of them by default
+        current_user: str = Depends(oauth2.get_current_user),
+        user_access: None = Depends(oauth2.has_permission("read_tithe")),
+        location_id: Optional[str] = None,
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+):
+    user_type = await _access(current_user)
+    conditions = _filters(models.TitheAndOffering, user_type, location_id, start_month, end_month, start_year,
+                          end_year, from_date, to_date)
+
+    return await _export("tithes", models.TitheAndOffering, conditions, format, columns)
+
+
+# this api route streams the fellowship attendance of the user's scope as CSV, NDJSON, Arrow or Parquet
+@router.get('/fellowship-attendance/')
+async def export_fellowship_attendance(
+        format: Format = "csv",
+        columns: Optional[str] = None,  # comma separated column names, all of them by default
+        current_user: str = Depends(oauth2.get_current_user),
+        user_access: None = Depends(oauth2.has_permission("read_fellowship_attendance")),
+        fellowship_id: Optional[str] = None,
+        location_id: Optional[str] = None,
+        start_month: Optional[int] = None,
+        end_month: Optional[int] = None,
+        start_year: Optional[int] = None,
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+):
+    user_type = await _access(current_user)
+    conditions = _filters(models.FellowshipAttendance, user_type, location_id, start_month, end_month, start_year,
+                          end_year, from_date, to_date)
+
+    if fellowship_id:
+        conditions.append(models.FellowshipAttendance.fellowship_id == fellowship_id)
+
+    return await _export("fellowship_attendance", models.FellowshipAttendance, conditions, format, columns)
@@ -1,14 +1,14 @@
 import json
-from datetime import datetime
-from typing import List, Union, Optional
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Union, Optional
 
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, Depends, APIRouter, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .websocket import manager
-from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from .. import schemas, utils, models, oauth2, hierarchy, bulk
+from ..database import get_async_db, get_async_read_db
 
 router = APIRouter(
     prefix="/fellowship",
@@ -18,11 +18,13 @@ router = APIRouter(
 
 @router.get('/read-fellowship/', response_model=Union[schemas.FellowshipResponse, List[schemas.FellowshipResponse]])
 async def get_fellowship(
+        response: Response,
         id: Optional[int] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
         fellowship_id: Optional[str] = None,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship")),
         location_id: Optional[str] = None,
@@ -33,12 +35,12 @@ async def get_fellowship(
 
     role = await utils.create_admin_access_id(current_user)
 
-    query = db.query(models.Fellowship).filter(models.Fellowship.Fellowship.id.ilike(f'%{role}%'),
-                                               models.Fellowship.is_deleted == False)
-
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
+    query = select(models.Fellowship).filter(utils.scope_filter(models.Fellowship.location_id, role),
+                                             models.Fellowship.is_deleted == False)
+
     if id:
         query = query.filter(models.Fellowship.id == id)
 
@@ -51,8 +53,10 @@ async def get_fellowship(
     if fellowship_name:
         query = query.filter(models.Fellowship.location_name.ilike(f'%{fellowship_name}%'))
 
-    query = query.offset(offset).limit(limit)
-    fellowships = query.all()
+    keyset = (models.Fellowship.id,)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    fellowships = (await db.execute(query)).scalars().all()
+    utils.set_next_cursor(response, fellowships, keyset, limit)
 
     if not fellowships:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Record not found!")
@@ -71,29 +75,29 @@ async def get_fellowship(
 
 # this endpoint handles all incoming data for the fellowship creation
 @router.post('/create-fellowship/', status_code=status.HTTP_201_CREATED, response_model=schemas.FellowshipResponse)
-async def create_fellowship(fellowship: schemas.CreateFellowship, db: Session = Depends(get_db),
+async def create_fellowship(fellowship: schemas.CreateFellowship, db: AsyncSession = Depends(get_async_db),
                             current_user: str = Depends(oauth2.get_current_user),
                             user_access: None = Depends(oauth2.has_permission("create_fellowships"))
                             ):
     try:
         new_fellowship = models.Fellowship(**fellowship.dict())
         db.add(new_fellowship)
-        db.commit()
-        db.refresh(new_fellowship)
+        await db.commit()
+        await db.refresh(new_fellowship)
 
         date_time = await utils.format_date_time(str(new_fellowship.created_at))
 
         return new_fellowship
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Internal Error! Fellowship could not be created.")
 
 
 @router.patch("/update-fellowship/", response_model=schemas.FellowshipResponse)
 async def update_fellowship(fellowship_id: str, fellowship_: schemas.UpdateFellowship,
-                            db: Session = Depends(get_db),
+                            db: AsyncSession = Depends(get_async_db),
                             user_access: None = Depends(oauth2.has_permission("update_fellowship")),
                             current_user: str = Depends(oauth2.get_current_user)):
     role = await utils.create_admin_access_id(current_user)
@@ -101,11 +105,11 @@ async def update_fellowship(fellowship_id: str, fellowship_: schemas.UpdateFello
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
-    fellowship_query = db.query(models.Fellowship).filter(models.Fellowship.fellowship_id == fellowship_id,
-                                                          models.Fellowship.is_deleted == False,
-                                                          models.Fellowship.location_id.ilike(f'%{role}%'))
+    fellowship_query = select(models.Fellowship).filter(models.Fellowship.fellowship_id == fellowship_id,
+                                                        models.Fellowship.is_deleted == False,
+                                                        utils.scope_filter(models.Fellowship.location_id, role))
 
-    fellowship = fellowship_query.first()
+    fellowship = (await db.execute(fellowship_query)).scalars().first()
 
     if fellowship is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -117,18 +121,18 @@ async def update_fellowship(fellowship_id: str, fellowship_: schemas.UpdateFello
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = fellowship_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    fellowship_query.update(updated_data)
-    db.commit()
-    db.refresh(fellowship)
+    await db.execute(update(models.Fellowship).filter(models.Fellowship.id == fellowship.id).values(**updated_data))
+    await db.commit()
+    await db.refresh(fellowship)
 
-    return fellowship_query.first()
+    return fellowship
 
 
 @router.delete("/delete-fellowship/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_fellowship(fellowship_id: str, db: Session = Depends(get_db),
+async def delete_fellowship(fellowship_id: str, db: AsyncSession = Depends(get_async_db),
                             user_access: None = Depends(oauth2.has_permission("delete_fellowship")),
                             current_user: str = Depends(oauth2.get_current_user)):
     role = await utils.create_admin_access_id(current_user)
@@ -136,9 +140,10 @@ async def delete_fellowship(fellowship_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
-    fellowship = db.query(models.Fellowship).filter(models.Fellowship.fellowship_id == fellowship_id,
-                                                    models.Fellowship.is_deleted == False,
-                                                    models.Fellowship.location_id.ilike(f'%{role}%')).first()
+    fellowship = (await db.execute(select(models.Fellowship).filter(
+        models.Fellowship.fellowship_id == fellowship_id,
+        models.Fellowship.is_deleted == False,
+        utils.scope_filter(models.Fellowship.location_id, role)))).scalars().first()
 
     if fellowship is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -146,14 +151,14 @@ async def delete_fellowship(fellowship_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateFellowship(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(fellowship, field, value)
-    db.commit()
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Fellowship with ID: {fellowship_id} deleted successfully!"
@@ -165,11 +170,13 @@ async def delete_fellowship(fellowship_id: str, db: Session = Depends(get_db),
 
 @router.get('/read-attendance/', response_model=Union[schemas.FAttendanceResponse, List[schemas.FAttendanceResponse]])
 async def get_attendance(
+        response: Response,
         id: Optional[int] = None,
         fellowship_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship_attendance")),
         location_id: Optional[str] = None,
@@ -180,6 +187,8 @@ async def get_attendance(
         end_month: Optional[int] = None,  # End month of range
         start_year: Optional[int] = None,  # Start year of range
         end_year: Optional[int] = None,  # End year of range
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     """ this api route returns the lists of all locations in the state depending on certain criteria of the admin """
 
@@ -188,8 +197,9 @@ async def get_attendance(
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.FellowshipAttendance).filter(models.FellowshipAttendance.location_id.ilike(f'%{role}%'),
-                                                         models.FellowshipAttendance.is_deleted == False)
+    query = select(models.FellowshipAttendance).filter(
+        utils.scope_filter(models.FellowshipAttendance.location_id, role),
+        models.FellowshipAttendance.is_deleted == False)
 
     if id:
         query = query.filter(models.FellowshipAttendance.id == id)
@@ -198,7 +208,7 @@ async def get_attendance(
         query = query.filter(models.FellowshipAttendance.location_id == location_id)
 
     if date:
-        query = query.filter(models.FellowshipAttendance.date == date)
+        query = query.filter(models.FellowshipAttendance.date == utils.parse_date(date, "date"))
 
     if fellowship_id:
         query = query.filter(models.FellowshipAttendance.fellowship_id == fellowship_id)
@@ -206,19 +216,14 @@ async def get_attendance(
     if fellowship_name:
         query = query.filter(models.FellowshipAttendance.fellowship_name.ilike(f'%{fellowship_name}%'))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.FellowshipAttendance.date) >= start_month,
-            extract('month', models.FellowshipAttendance.date) <= end_month)
+    query = query.filter(*utils.date_range_filter(models.FellowshipAttendance.date, start_month,
+                                                  end_month, start_year, end_year, from_date, to_date))
 
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.FellowshipAttendance.date) >= start_year,
-            extract('year', models.FellowshipAttendance.date) <= end_year)
-
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    attendance = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    keyset = (models.FellowshipAttendance.date, models.FellowshipAttendance.id)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    attendance = (await db.execute(query)).scalars().all()
+    utils.set_next_cursor(response, attendance, keyset, limit)
     if not attendance:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found!')
 
@@ -235,36 +240,70 @@ async def get_attendance(
 
 
 @router.post('/create-attendance/', status_code=status.HTTP_201_CREATED, response_model=schemas.FAttendanceResponse)
-async def create_attendance(fellowship: schemas.CreateFAttendance, db: Session = Depends(get_db),
+async def create_attendance(fellowship: schemas.CreateFAttendance, db: AsyncSession = Depends(get_async_db),
                             current_user: str = Depends(oauth2.get_current_user),
                             user_access: None = Depends(oauth2.has_permission("create_fellowship_attendance")),
                             ):
     try:
         new_fellowship = models.FellowshipAttendance(**fellowship.dict())
         db.add(new_fellowship)
-        db.commit()
-        db.refresh(new_fellowship)
+        await db.commit()
+        await db.refresh(new_fellowship)
 
         date_time = await utils.format_date_time(str(new_fellowship.created_at))
 
-        await manager.broadcast(json.dumps(
+        await manager.publish(json.dumps(
             {
                 "type": "notification",
                 "user_id": current_user.user_id,
                 "data": date_time,
                 "note": "New count data submitted to the database, please check data for descriptions and more details"
             }
-        ))
+        ), new_fellowship.location_id)
 
         return new_fellowship
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Internal Error! Attendance could not be created.")
 
 
+# this api route saves a list of fellowship attendance records in one transaction and reports what happened to each item
+@router.post('/create-attendance/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_attendance_batch(attendance: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                                  current_user: str = Depends(oauth2.get_current_user),
+                                  user_access: None = Depends(oauth2.has_permission("create_fellowship_attendance"))):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateFAttendance, models.FellowshipAttendance,
+                                                  attendance, current_user)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Attendance could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} fellowship attendance records submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.patch("/update-attendance/", response_model=schemas.FAttendanceResponse)
-async def update_attendance(fellowship_id: str, fellowship_: schemas.UpdateFAttendance, db: Session = Depends(get_db),
+async def update_attendance(fellowship_id: str, fellowship_: schemas.UpdateFAttendance,
+                            db: AsyncSession = Depends(get_async_db),
                             current_user: str = Depends(oauth2.get_current_user),
                             user_access: None = Depends(oauth2.has_permission("update_fellowship_attendance")), ):
     role = await utils.create_admin_access_id(current_user)
@@ -272,12 +311,11 @@ async def update_attendance(fellowship_id: str, fellowship_: schemas.UpdateFAtte
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    fellowship_query = db.query(models.FellowshipAttendance).filter(
-        models.FellowshipAttendance.fellowship_id == fellowship_id,
-        models.FellowshipAttendance.is_deleted == False,
-        models.FellowshipAttendance.location_id.ilike(f'%{role}%'))
+    conditions = (models.FellowshipAttendance.fellowship_id == fellowship_id,
+                  models.FellowshipAttendance.is_deleted == False,
+                  utils.scope_filter(models.FellowshipAttendance.location_id, role))
 
-    fellowship = fellowship_query.first()
+    fellowship = (await db.execute(select(models.FellowshipAttendance).filter(*conditions))).scalars().first()
 
     if fellowship is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -289,18 +327,20 @@ async def update_attendance(fellowship_id: str, fellowship_: schemas.UpdateFAtte
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = fellowship_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    fellowship_query.update(updated_data)
-    db.commit()
-    db.refresh(fellowship)
+    # every attendance row of the fellowship in the user's scope, not only the one returned
+    await db.execute(update(models.FellowshipAttendance).filter(*conditions)
+                     .values(**hierarchy.with_hierarchy(updated_data)))
+    await db.commit()
+    await db.refresh(fellowship)
 
-    return fellowship_query.first()
+    return fellowship
 
 
 @router.delete("/delete-attendance/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_attendance(fellowship_id: str, db: Session = Depends(get_db),
+async def delete_attendance(fellowship_id: str, db: AsyncSession = Depends(get_async_db),
                             current_user: str = Depends(oauth2.get_current_user),
                             user_access: None = Depends(oauth2.has_permission("delete_fellowship_attendance"))
                             ):
@@ -309,10 +349,10 @@ async def delete_attendance(fellowship_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    fellowship = db.query(models.FellowshipAttendance).filter(
+    fellowship = (await db.execute(select(models.FellowshipAttendance).filter(
         models.FellowshipAttendance.fellowship_id == fellowship_id,
         models.FellowshipAttendance.is_deleted == False,
-        models.FellowshipAttendance.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.FellowshipAttendance.location_id, role)))).scalars().first()
 
     if fellowship is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -320,14 +360,14 @@ async def delete_attendance(fellowship_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateFAttendance(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(fellowship, field, value)
-    db.commit()
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Count record with ID: {fellowship_id} deleted successfully!"
@@ -337,22 +377,25 @@ async def delete_attendance(fellowship_id: str, db: Session = Depends(get_db),
 # #####################################################################################################################
 # ########################### the fellowship member routes ###############################################
 
-@router.get('/read-member/', response_model=Union[schemas.FMembersResponse, List[schemas.FMembersResponse]])
+@router.get('/read-member/', response_model=schemas.sparse(schemas.FMembersResponse))
 async def get_members(
+        response: Response,
         id: Optional[int] = None,
         fellowship_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship_member")),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         location_id: Optional[str] = None,
         date: Optional[str] = None,
         fellowship_name: Optional[str] = None,
         get_all: Optional[bool] = None,
-        gender: Optional[int] = None,  # Start month of range
-        phone: Optional[int] = None,  # End month of range
-        local_church: Optional[int] = None,  # Start year of range
+        gender: Optional[str] = None,
+        phone: Optional[str] = None,
+        local_church: Optional[str] = None,
 ):
     """ this api route returns the lists of all locations in the state depending on certain criteria of the admin """
 
@@ -361,8 +404,10 @@ async def get_members(
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.FellowshipMembers).filter(models.FellowshipMembers.location_id.ilike(f'%{role}%'),
-                                                      models.FellowshipMembers.is_deleted == False)
+    names = utils.response_fields(schemas.FMembersResponse, fields)
+    keyset = (models.FellowshipMembers.id,)
+    query = select(*utils.response_columns(models.FellowshipMembers, names, keyset)).filter(
+        utils.scope_filter(models.FellowshipMembers.location_id, role), models.FellowshipMembers.is_deleted == False)
 
     if id:
         query = query.filter(models.FellowshipMembers.id == id)
@@ -371,7 +416,10 @@ async def get_members(
         query = query.filter(models.FellowshipMembers.location_id == location_id)
 
     if date:
-        query = query.filter(models.FellowshipMembers.date == date)
+        # members carry no date of their own, the day they were added (UTC) stands for it
+        day = datetime.combine(utils.parse_date(date, "date"), time.min, tzinfo=timezone.utc)
+        query = query.filter(models.FellowshipMembers.created_at >= day,
+                             models.FellowshipMembers.created_at < day + timedelta(days=1))
 
     if fellowship_id:
         query = query.filter(models.FellowshipMembers.fellowship_id == fellowship_id)
@@ -388,44 +436,78 @@ async def get_members(
     if local_church:
         query = query.filter(models.FellowshipMembers.local_church == local_church)
 
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    members = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    members = (await db.execute(query)).all()
+    utils.set_next_cursor(response, members, keyset, limit)
     if not members:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found!')
 
     if get_all:
-        return members
+        return utils.rows_response(response, members, names)
 
     # If a single user was requested by ID, return just that user
     if id:
         if len(members) == 1:
-            return members[0]
+            return utils.rows_response(response, members[0], names)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Members with id: {id} not found!')
 
-    return members
+    return utils.rows_response(response, members, names)
 
 
 @router.post('/create-member/', status_code=status.HTTP_201_CREATED, response_model=schemas.FMembersResponse)
-async def create_members(members: schemas.CreateFMembers, db: Session = Depends(get_db),
+async def create_members(members: schemas.CreateFMembers, db: AsyncSession = Depends(get_async_db),
                          current_user: str = Depends(oauth2.get_current_user),
                          user_access: None = Depends(oauth2.has_permission("create_fellowship_member"))
                          ):
     try:
         new_members = models.FellowshipMembers(**members.dict())
         db.add(new_members)
-        db.commit()
-        db.refresh(new_members)
+        await db.commit()
+        await db.refresh(new_members)
 
         return new_members
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Internal Error! Attendance could not be created.")
 
 
+# this api route saves a list of fellowship members in one transaction and reports what happened to each item
+@router.post('/create-member/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_members_batch(members: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                               current_user: str = Depends(oauth2.get_current_user),
+                               user_access: None = Depends(oauth2.has_permission("create_fellowship_member"))):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateFMembers, models.FellowshipMembers, members,
+                                                  current_user)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Members could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} fellowship members submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.patch("/update-member/", response_model=schemas.FMembersResponse)
-async def update_members(member_id: str, fellowship_: schemas.UpdateFMembers, db: Session = Depends(get_db),
+async def update_members(member_id: str, fellowship_: schemas.UpdateFMembers, db: AsyncSession = Depends(get_async_db),
                          current_user: str = Depends(oauth2.get_current_user),
                          user_access: None = Depends(oauth2.has_permission("update_fellowship_memeber"))):
     role = await utils.create_admin_access_id(current_user)
@@ -433,12 +515,11 @@ async def update_members(member_id: str, fellowship_: schemas.UpdateFMembers, db
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    member_query = db.query(models.FellowshipMembers).filter(
-        models.FellowshipMembers.fellowship_id == member_id,
-        models.FellowshipMembers.is_deleted == False,
-        models.FellowshipMembers.location_id.ilike(f'%{role}%'))
+    conditions = (models.FellowshipMembers.fellowship_id == member_id,
+                  models.FellowshipMembers.is_deleted == False,
+                  utils.scope_filter(models.FellowshipMembers.location_id, role))
 
-    member = member_query.first()
+    member = (await db.execute(select(models.FellowshipMembers).filter(*conditions))).scalars().first()
 
     if member is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -450,18 +531,19 @@ async def update_members(member_id: str, fellowship_: schemas.UpdateFMembers, db
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = fellowship_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    member_query.update(updated_data)
-    db.commit()
-    db.refresh(member)
+    # every member row of the fellowship in the user's scope, not only the one returned
+    await db.execute(update(models.FellowshipMembers).filter(*conditions).values(**updated_data))
+    await db.commit()
+    await db.refresh(member)
 
-    return member_query.first()
+    return member
 
 
 @router.delete("/member-delete/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_member(member_id: str, db: Session = Depends(get_db),
+async def delete_member(member_id: str, db: AsyncSession = Depends(get_async_db),
                         current_user: str = Depends(oauth2.get_current_user),
                         user_access: None = Depends(oauth2.has_permission("delete_fellowship_member"))
                         ):
@@ -470,10 +552,10 @@ async def delete_member(member_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    member = db.query(models.FellowshipMembers).filter(
+    member = (await db.execute(select(models.FellowshipMembers).filter(
         models.FellowshipMembers.fellowship_id == member_id,
         models.FellowshipMembers.is_deleted == False,
-        models.FellowshipMembers.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.FellowshipMembers.location_id, role)))).scalars().first()
 
     if member is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -481,14 +563,14 @@ async def delete_member(member_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateFMembers(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(member, field, value)
-    db.commit()
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Member's record with ID: {member_id} deleted successfully!"
@@ -501,11 +583,13 @@ async def delete_member(member_id: str, db: Session = Depends(get_db),
 @router.get('/read-attendance_summaries/',
             response_model=Union[schemas.FAttendanceSumResponse, List[schemas.FAttendanceSumResponse]])
 async def get_attendance_summaries(
+        response: Response,
         id: Optional[int] = None,
         fellowship_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship_attendance_summary")),
         location_id: Optional[str] = None,
@@ -516,6 +600,8 @@ async def get_attendance_summaries(
         end_month: Optional[int] = None,  # End month of range
         start_year: Optional[int] = None,  # Start year of range
         end_year: Optional[int] = None,  # End year of range
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     """ this api route returns the lists of all locations in the state depending on certain criteria of the admin """
 
@@ -524,8 +610,8 @@ async def get_attendance_summaries(
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
-    query = db.query(models.AttendanceSum).filter(models.AttendanceSum.location_id.ilike(f'%{role}%'),
-                                                  models.AttendanceSum.is_deleted == False)
+    query = select(models.AttendanceSum).filter(utils.scope_filter(models.AttendanceSum.location_id, role),
+                                                models.AttendanceSum.is_deleted == False)
 
     if id:
         query = query.filter(models.AttendanceSum.id == id)
@@ -534,7 +620,7 @@ async def get_attendance_summaries(
         query = query.filter(models.AttendanceSum.location_id == location_id)
 
     if date:
-        query = query.filter(models.AttendanceSum.date == date)
+        query = query.filter(models.AttendanceSum.date == utils.parse_date(date, "date"))
 
     if fellowship_id:
         query = query.filter(models.AttendanceSum.fellowship_id == fellowship_id)
@@ -542,19 +628,14 @@ async def get_attendance_summaries(
     if fellowship_name:
         query = query.filter(models.AttendanceSum.fellowship_name.ilike(f'%{fellowship_name}%'))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.AttendanceSum.date) >= start_month,
-            extract('month', models.AttendanceSum.date) <= end_month)
-
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.AttendanceSum.date) >= start_year,
-            extract('year', models.AttendanceSum.date) <= end_year)
+    query = query.filter(*utils.date_range_filter(models.AttendanceSum.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    summary = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    keyset = (models.AttendanceSum.date, models.AttendanceSum.id)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    summary = (await db.execute(query)).scalars().all()
+    utils.set_next_cursor(response, summary, keyset, limit)
 
     if not summary:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Record not found!")
@@ -573,7 +654,7 @@ async def get_attendance_summaries(
 
 @router.post('/create-attendance_summaries/', status_code=status.HTTP_201_CREATED,
              response_model=schemas.FAttendanceSumResponse)
-async def create_attendance_summaries(summary: schemas.CreateFAttendanceSum, db: Session = Depends(get_db),
+async def create_attendance_summaries(summary: schemas.CreateFAttendanceSum, db: AsyncSession = Depends(get_async_db),
                                       user_access: None = Depends(
                                           oauth2.has_permission("create_fellowship_attendance_summary")),
                                       current_user: str = Depends(oauth2.get_current_user)
@@ -581,21 +662,21 @@ async def create_attendance_summaries(summary: schemas.CreateFAttendanceSum, db:
     try:
         new_summary = models.AttendanceSum(**summary.dict())
         db.add(new_summary)
-        db.commit()
-        db.refresh(new_summary)
+        await db.commit()
+        await db.refresh(new_summary)
 
         date_time = await utils.format_date_time(str(new_summary.created_at))
 
         return new_summary
     except Exception as e:
-        db.rollback()  # Rollback changes in case of exception
+        await db.rollback()  # Rollback changes in case of exception
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error! Attendance summary could not be saved.")
 
 
 @router.patch("/update-attendance_summaries/", response_model=schemas.FAttendanceSumResponse)
-async def update_attendance_summaries(summary_id: str, fellowship_: schemas.UpdateFAttendanceSum,
-                                      db: Session = Depends(get_db),
+async def update_attendance_summaries(summary_id: int, fellowship_: schemas.UpdateFAttendanceSum,
+                                      db: AsyncSession = Depends(get_async_db),
                                       current_user: str = Depends(oauth2.get_current_user),
                                       user_access: None = Depends(
                                           oauth2.has_permission("update_fellowship_attendance_summary"))
@@ -605,12 +686,12 @@ async def update_attendance_summaries(summary_id: str, fellowship_: schemas.Upda
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    summary_query = db.query(models.AttendanceSum).filter(
+    summary_query = select(models.AttendanceSum).filter(
         models.AttendanceSum.id == summary_id,
         models.AttendanceSum.is_deleted == False,
-        models.AttendanceSum.location_id.ilike(f'%{role}%'))
+        utils.scope_filter(models.AttendanceSum.location_id, role))
 
-    fellowship = summary_query.first()
+    fellowship = (await db.execute(summary_query)).scalars().first()
 
     if fellowship is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -622,18 +703,19 @@ async def update_attendance_summaries(summary_id: str, fellowship_: schemas.Upda
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = fellowship_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    summary_query.update(updated_data)
-    db.commit()
-    db.refresh(fellowship)
+    await db.execute(update(models.AttendanceSum).filter(models.AttendanceSum.id == fellowship.id)
+                     .values(**hierarchy.with_hierarchy(updated_data)))
+    await db.commit()
+    await db.refresh(fellowship)
 
-    return summary_query.first()
+    return fellowship
 
 
 @router.delete("/delete-attendance_summaries/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_attendance_summaries(summary_id: str, db: Session = Depends(get_db),
+async def delete_attendance_summaries(summary_id: int, db: AsyncSession = Depends(get_async_db),
                                       current_user: str = Depends(oauth2.get_current_user),
                                       user_access: None = Depends(oauth2.has_permission("delete_count"))):
     role = await utils.create_admin_access_id(current_user)
@@ -641,10 +723,10 @@ async def delete_attendance_summaries(summary_id: str, db: Session = Depends(get
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    summary = db.query(models.AttendanceSum).filter(
+    summary = (await db.execute(select(models.AttendanceSum).filter(
         models.AttendanceSum.id == summary_id,
         models.AttendanceSum.is_deleted == False,
-        models.AttendanceSum.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.AttendanceSum.location_id, role)))).scalars().first()
 
     if summary is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -652,14 +734,14 @@ async def delete_attendance_summaries(summary_id: str, db: Session = Depends(get
 
     update_data = schemas.UpdateFAttendanceSum(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(summary, field, value)
-    db.commit()
+    await db.commit()
     return {"status": "successful!",
             "message": f"Attendance record with ID: {summary_id} deleted successfully!"
             }
@@ -671,11 +753,13 @@ async def delete_attendance_summaries(summary_id: str, db: Session = Depends(get
 @router.get('/read-testimonies/',
             response_model=Union[schemas.TestimoniesResponse, List[schemas.TestimoniesResponse]])
 async def get_testimonies(
+        response: Response,
         id: Optional[int] = None,
         fellowship_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship_testimony")),
         location_id: Optional[str] = None,
@@ -686,6 +770,8 @@ async def get_testimonies(
         end_month: Optional[int] = None,  # End month of range
         start_year: Optional[int] = None,  # Start year of range
         end_year: Optional[int] = None,  # End year of range
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     """ this api route returns the lists of all locations in the state depending on certain criteria of the admin """
 
@@ -694,8 +780,8 @@ async def get_testimonies(
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.Testimony).filter(models.Testimony.location_id.ilike(f'%{role}%'),
-                                              models.Testimony.is_deleted == False)
+    query = select(models.Testimony).filter(utils.scope_filter(models.Testimony.location_id, role),
+                                            models.Testimony.is_deleted == False)
 
     if id:
         query = query.filter(models.Testimony.id == id)
@@ -704,7 +790,7 @@ async def get_testimonies(
         query = query.filter(models.Testimony.location_id == location_id)
 
     if date:
-        query = query.filter(models.Testimony.date == date)
+        query = query.filter(models.Testimony.date == utils.parse_date(date, "date"))
 
     if fellowship_id:
         query = query.filter(models.Testimony.fellowship_id == fellowship_id)
@@ -712,19 +798,14 @@ async def get_testimonies(
     if fellowship_name:
         query = query.filter(models.Testimony.fellowship_name.ilike(f'%{fellowship_name}%'))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.Testimony.date) >= start_month,
-            extract('month', models.Testimony.date) <= end_month)
+    query = query.filter(*utils.date_range_filter(models.Testimony.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.Testimony.date) >= start_year,
-            extract('year', models.Testimony.date) <= end_year)
-
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    testimony = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    keyset = (models.Testimony.date, models.Testimony.id)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    testimony = (await db.execute(query)).scalars().all()
+    utils.set_next_cursor(response, testimony, keyset, limit)
 
     if not testimony:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found!')
@@ -742,25 +823,58 @@ async def get_testimonies(
 
 
 @router.post('/create-testimonies/', status_code=status.HTTP_201_CREATED, response_model=schemas.TestimoniesResponse)
-async def create_testimony(testimony: schemas.CreateTestimonies, db: Session = Depends(get_db),
+async def create_testimony(testimony: schemas.CreateTestimonies, db: AsyncSession = Depends(get_async_db),
                            current_user: str = Depends(oauth2.get_current_user),
                            user_access: None = Depends(oauth2.has_permission("create_fellowship_testimony"))):
     try:
         new_testimony = models.Testimony(**testimony.dict())
         db.add(new_testimony)
-        db.commit()
-        db.refresh(new_testimony)
+        await db.commit()
+        await db.refresh(new_testimony)
 
         return new_testimony
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Attendance could not be created.")
 
 
+# this api route saves a list of testimonies in one transaction and reports what happened to each item
+@router.post('/create-testimonies/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_testimonies_batch(testimonies: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                                   current_user: str = Depends(oauth2.get_current_user),
+                                   user_access: None = Depends(oauth2.has_permission("create_fellowship_testimony"))):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateTestimonies, models.Testimony, testimonies,
+                                                  current_user)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Testimonies could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} testimonies submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.patch("/update-testimonies/", response_model=schemas.TestimoniesResponse)
-async def update_testimony(testimony_id: str, testimony_: schemas.UpdateTestimonies,
-                           db: Session = Depends(get_db),
+async def update_testimony(testimony_id: int, testimony_: schemas.UpdateTestimonies,
+                           db: AsyncSession = Depends(get_async_db),
                            current_user: str = Depends(oauth2.get_current_user),
                            user_access: None = Depends(oauth2.has_permission("update_fellowship_testimony"))):
     role = await utils.create_admin_access_id(current_user)
@@ -768,12 +882,12 @@ async def update_testimony(testimony_id: str, testimony_: schemas.UpdateTestimon
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    testimony_query = db.query(models.Testimony).filter(
+    testimony_query = select(models.Testimony).filter(
         models.Testimony.id == testimony_id,
         models.Testimony.is_deleted == False,
-        models.Testimony.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.Testimony.location_id, role))
 
-    testimony = testimony_query.first()
+    testimony = (await db.execute(testimony_query)).scalars().first()
 
     if testimony is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -785,18 +899,18 @@ async def update_testimony(testimony_id: str, testimony_: schemas.UpdateTestimon
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = testimony_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    testimony_query.update(updated_data)
-    db.commit()
-    db.refresh(testimony)
+    await db.execute(update(models.Testimony).filter(models.Testimony.id == testimony.id).values(**updated_data))
+    await db.commit()
+    await db.refresh(testimony)
 
-    return testimony_query
+    return testimony
 
 
 @router.delete("/delete-testimonies/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_testimony(testimony_id: str, db: Session = Depends(get_db),
+async def delete_testimony(testimony_id: int, db: AsyncSession = Depends(get_async_db),
                            current_user: str = Depends(oauth2.get_current_user),
                            user_access: None = Depends(oauth2.has_permission("delete_fellowship_testimony"))):
     role = await utils.create_admin_access_id(current_user)
@@ -804,10 +918,10 @@ async def delete_testimony(testimony_id: str, db: Session = Depends(get_db),
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    testimony = db.query(models.Testimony).filter(
+    testimony = (await db.execute(select(models.Testimony).filter(
         models.Testimony.id == testimony_id,
         models.Testimony.is_deleted == False,
-        models.Testimony.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.Testimony.location_id, role)))).scalars().first()
 
     if testimony is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -815,14 +929,14 @@ async def delete_testimony(testimony_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateTestimonies(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
     # Update the user with the new data
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(testimony, field, value)
-    db.commit()
+    await db.commit()
 
     return {"status": "successful!",
             "message": f"Testimony record with ID: {testimony_id} deleted successfully!"
@@ -835,11 +949,13 @@ async def delete_testimony(testimony_id: str, db: Session = Depends(get_db),
 @router.get('/read-prayer_request/',
             response_model=Union[schemas.PrayerRequestResponse, List[schemas.PrayerRequestResponse]])
 async def get_prayer(
+        response: Response,
         id: Optional[int] = None,
         fellowship_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_fellowship_prayer")),
         location_id: Optional[str] = None,
@@ -850,6 +966,8 @@ async def get_prayer(
         end_month: Optional[int] = None,  # End month of range
         start_year: Optional[int] = None,  # Start year of range
         end_year: Optional[int] = None,  # End year of range
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     """ this api route returns the lists of all locations in the state depending on certain criteria of the admin """
 
@@ -858,8 +976,8 @@ async def get_prayer(
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.PrayerRequest).filter(models.PrayerRequest.location_id.ilike(f'%{user_type}%'),
-                                                  models.PrayerRequest.is_deleted == False)
+    query = select(models.PrayerRequest).filter(utils.scope_filter(models.PrayerRequest.location_id, role),
+                                                models.PrayerRequest.is_deleted == False)
 
     if id:
         query = query.filter(models.PrayerRequest.id == id)
@@ -868,7 +986,7 @@ async def get_prayer(
         query = query.filter(models.PrayerRequest.location_id == location_id)
 
     if date:
-        query = query.filter(models.PrayerRequest.date == date)
+        query = query.filter(models.PrayerRequest.date == utils.parse_date(date, "date"))
 
     if fellowship_id:
         query = query.filter(models.PrayerRequest.fellowship_id == fellowship_id)
@@ -876,19 +994,14 @@ async def get_prayer(
     if fellowship_name:
         query = query.filter(models.PrayerRequest.fellowship_name.ilike(f'%{fellowship_name}%'))
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.PrayerRequest.date) >= start_month,
-            extract('month', models.PrayerRequest.date) <= end_month)
-
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.PrayerRequest.date) >= start_year,
-            extract('year', models.PrayerRequest.date) <= end_year)
+    query = query.filter(*utils.date_range_filter(models.PrayerRequest.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
-    prayer = query.all()
+    # Page by cursor when one is given, by limit and offset otherwise
+    keyset = (models.PrayerRequest.date, models.PrayerRequest.id)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
+    prayer = (await db.execute(query)).scalars().all()
+    utils.set_next_cursor(response, prayer, keyset, limit)
 
     if not prayer:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Record not found')
@@ -906,26 +1019,59 @@ async def get_prayer(
 
 
 @router.post('/create-prayer_request/', status_code=status.HTTP_201_CREATED, response_model=schemas.PrayerRequestResponse)
-async def create_prayer(prayer: schemas.CreatePrayerRequest, db: Session = Depends(get_db),
+async def create_prayer(prayer: schemas.CreatePrayerRequest, db: AsyncSession = Depends(get_async_db),
                         current_user: str = Depends(oauth2.get_current_user),
                         user_access: None = Depends(oauth2.has_permission("create_fellowship_prayer"))
                         ):
     try:
         new_prayer = models.PrayerRequest(**prayer.dict())
         db.add(new_prayer)
-        db.commit()
-        db.refresh(new_prayer)
+        await db.commit()
+        await db.refresh(new_prayer)
 
         return new_prayer
     except Exception as e:
-        db.rollback()  # Rollback changes in case of exception
+        await db.rollback()  # Rollback changes in case of exception
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error! Data could not be saved.")
 
 
+# this api route saves a list of prayer requests in one transaction and reports what happened to each item
+@router.post('/create-prayer_request/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_prayers_batch(prayers: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                               current_user: str = Depends(oauth2.get_current_user),
+                               user_access: None = Depends(oauth2.has_permission("create_fellowship_prayer"))):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreatePrayerRequest, models.PrayerRequest, prayers,
+                                                  current_user)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Prayer requests could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} prayer requests submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.patch("/update-prayer_request/", response_model=schemas.PrayerRequestResponse)
-async def update_prayer(prayer_id: str, prayer_: schemas.UpdatePrayerRequest,
-                        db: Session = Depends(get_db),
+async def update_prayer(prayer_id: int, prayer_: schemas.UpdatePrayerRequest,
+                        db: AsyncSession = Depends(get_async_db),
                         current_user: str = Depends(oauth2.get_current_user),
                         user_access: None = Depends(oauth2.has_permission("update_fellowship_prayer"))):
     role = await utils.create_admin_access_id(current_user)
@@ -933,12 +1079,12 @@ async def update_prayer(prayer_id: str, prayer_: schemas.UpdatePrayerRequest,
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    prayer_query = db.query(models.PrayerRequest).filter(
+    prayer_query = select(models.PrayerRequest).filter(
         models.PrayerRequest.id == prayer_id,
         models.PrayerRequest.is_deleted == False,
-        models.PrayerRequest.location_id.ilike(f'%{role}%'))
+        utils.scope_filter(models.PrayerRequest.location_id, role))
 
-    prayer = prayer_query.first()
+    prayer = (await db.execute(prayer_query)).scalars().first()
 
     if prayer is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -949,28 +1095,28 @@ async def update_prayer(prayer_id: str, prayer_: schemas.UpdatePrayerRequest,
                             detail="Record not found!.")
 
     updated_data = prayer_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    prayer_query.update(updated_data)
-    db.commit()
-    db.refresh(prayer)
+    await db.execute(update(models.PrayerRequest).filter(models.PrayerRequest.id == prayer.id).values(**updated_data))
+    await db.commit()
+    await db.refresh(prayer)
 
     return prayer
 
 
 @router.delete("/delete-prayer_request/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_prayer(prayer_id: str, db: Session = Depends(get_db),
+async def delete_prayer(prayer_id: int, db: AsyncSession = Depends(get_async_db),
                         current_user: str = Depends(oauth2.get_current_user)):
     role = await utils.create_admin_access_id(current_user)
 
     if not role:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
-    prayer = db.query(models.PrayerRequest).filter(
+    prayer = (await db.execute(select(models.PrayerRequest).filter(
         models.PrayerRequest.id == prayer_id,
         models.PrayerRequest.is_deleted == False,
-        models.Counter.location_id.ilike(f'%{role}%')).first()
+        utils.scope_filter(models.PrayerRequest.location_id, role)))).scalars().first()
 
     if prayer is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -982,7 +1128,7 @@ async def delete_prayer(prayer_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdatePrayerRequest(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
@@ -990,7 +1136,7 @@ async def delete_prayer(prayer_id: str, db: Session = Depends(get_db),
     for field, value in update_data.dict(exclude_unset=True).items():
         setattr(prayer, field, value)
 
-    db.commit()
+    await db.commit()
     return {"status": "successful!",
             "message": f"Record with ID: {prayer_id} deleted successfully!"
             }
@@ -1,13 +1,13 @@
 import random
 import string
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
 from fastapi import status, HTTPException, Depends, APIRouter
 from sqlalchemy.orm import Session
 
 from .. import schemas, models, oauth2, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/groups",
@@ -19,7 +19,7 @@ router = APIRouter(
 async def get_groups(
         id: Optional[int] = None,
         group_id: Optional[str] = None,
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_group")),
         group_name: Optional[str] = None,
@@ -31,7 +31,7 @@ async def get_groups(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
     if get_all:
-        groups = db.query(models.Group).filter(models.Group.group_id.ilike(f"%{role}%"),
+        groups = db.query(models.Group).filter(utils.scope_filter(models.Group.group_id, role),
                                                models.Group.is_deleted == False).all()
         return groups
 
@@ -40,7 +40,7 @@ async def get_groups(
     if id:
         group = query.filter(models.Group.id == id,
                              models.Group.is_deleted == False,
-                             models.Group.group_id.ilike(f"%{role}%")).first()
+                             utils.scope_filter(models.Group.group_id, role)).first()
         if not group:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f'Group with id: {id} not found!')
@@ -49,7 +49,7 @@ async def get_groups(
     if group_id:
         group = query.filter(models.Group.group_id == group_id,
                              models.Group.is_deleted == False,
-                             models.Group.group_id.ilike(f"%{role}%")).first()
+                             utils.scope_filter(models.Group.group_id, role)).first()
         if not group:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f'Group with id: {group_id} not found!')
@@ -58,7 +58,7 @@ async def get_groups(
     if group_name:
         query = query.filter(models.Group.group_name.ilike(f'%{group_name}%'),
                              models.Group.is_deleted == False,
-                             models.Group.group_id.ilike(f"%{role}%"))
+                             utils.scope_filter(models.Group.group_id, role))
 
     groups = query.all()
     if not groups:
@@ -99,7 +99,7 @@ async def update_groups(group_id: str, groups: schemas.UpdateGroups, db: Session
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No privilege for user type!")
 
     group_query = db.query(models.Group).filter(models.Group.group_id == group_id,
-                                                models.Group.goup_id.ilike(f"%{role}%"))
+                                                utils.scope_filter(models.Group.group_id, role))
 
     group = group_query.first()
 
@@ -112,7 +112,7 @@ async def update_groups(group_id: str, groups: schemas.UpdateGroups, db: Session
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = groups.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     group_query.update(updated_data)
@@ -134,14 +134,14 @@ async def delete_group(group_id: str, db: Session = Depends(get_db),
 
     group = db.query(models.Group).filter(models.Group.group_id == group_id,
                                           models.Group.is_deleted == False,
-                                          models.Group.goup_id.ilike(f"%{role}%")).first()
+                                          utils.scope_filter(models.Group.group_id, role)).first()
 
     if group is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Group with id: {group_id} does not exist")
 
     update_data = schemas.UpdateGroups(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
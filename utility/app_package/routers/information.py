@@ -1,14 +1,13 @@
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import List, Union, Optional
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from fastapi import status, HTTPException, Depends, APIRouter, Query
-from sqlalchemy import extract
 from sqlalchemy.orm import Session
 
 from .. import schemas, models, oauth2, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 # Initialize the scheduler
 scheduler = BackgroundScheduler()
@@ -25,7 +24,7 @@ async def get_information(
         id: Optional[str] = None,
         limit: Optional[int] = Query(10, ge=1),  # Default limit of 10, with a minimum value of 1
         offset: Optional[int] = Query(0, ge=0),  # Default offset of 0, with a minimum value of 0
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         program_type: Optional[str] = None,
         program_title: Optional[str] = None,
@@ -37,13 +36,15 @@ async def get_information(
         start_month: Optional[int] = None,
         end_month: Optional[int] = None,
         start_year: Optional[int] = None,
-        end_year: Optional[int] = None
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     try:
         region_id = await utils.return_region_filter(current_user)
         # Construct the base query
         query = db.query(models.Information).filter(
-            models.Information.region_id.ilike(f'%{region_id}%'),
+            utils.scope_filter(models.Information.region_id, region_id),
             models.Information.is_deleted == False
         )
 
@@ -84,17 +85,8 @@ async def get_information(
         if date:
             query = query.filter(models.Information.date == date)
 
-        if start_month is not None and end_month is not None:
-            query = query.filter(
-                extract('month', models.Information.date) >= start_month,
-                extract('month', models.Information.date) <= end_month
-            )
-
-        if start_year is not None and end_year is not None:
-            query = query.filter(
-                extract('year', models.Information.date) >= start_year,
-                extract('year', models.Information.date) <= end_year
-            )
+        query = query.filter(*utils.date_range_filter(models.Information.date, start_month, end_month,
+                                                      start_year, end_year, from_date, to_date))
 
         # Apply limit and offset to the query
         information = query.offset(offset).limit(limit).all()
@@ -147,7 +139,7 @@ async def update_information(information_id: str, setup_: schemas.UpdateInformat
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
     information_query = db.query(models.Information).filter(models.Information.id == information_id,
-                                                            models.Information.region_id.ilike(f'%{role}%'))
+                                                            utils.scope_filter(models.Information.region_id, role))
 
     information = information_query.first()
 
@@ -160,7 +152,7 @@ async def update_information(information_id: str, setup_: schemas.UpdateInformat
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = setup_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     information_query.update(updated_data)
@@ -180,7 +172,7 @@ async def delete_information(information_id: str, db: Session = Depends(get_db),
 
     information = db.query(models.Information).filter(models.Information.id == information_id,
                                                       models.Information.is_deleted == False,
-                                                      models.Information.location_id.ilike(f'%{role}%')).first()
+                                                      utils.scope_filter(models.Information.region_id, role)).first()
 
     if information is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -188,7 +180,7 @@ async def delete_information(information_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateInformation(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
@@ -1,5 +1,5 @@
 import random
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
 from fastapi import status, HTTPException, Depends, APIRouter
@@ -7,7 +7,7 @@ from sqlalchemy import func, Integer
 from sqlalchemy.orm import Session
 
 from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/locations",
@@ -20,7 +20,7 @@ async def get_locations(
         location_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_location")),
         group_id: Optional[str] = None,
@@ -34,7 +34,7 @@ async def get_locations(
     if user_type is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.Location).filter(models.Location.location_id.ilike(f'%{user_type}%'),
+    query = db.query(models.Location).filter(utils.scope_filter(models.Location.location_id, user_type),
                                              models.Location.is_deleted == False)
 
     if location_id:
@@ -90,7 +90,7 @@ async def update_locations(location_id: str, location_: schemas.UpdateLocations,
 
     location_query = db.query(models.Location).filter(models.Location.location_id == location_id,
                                                       models.Location.is_deleted == False,
-                                                      models.Location.location_id.ilike(f'%{role}%'))
+                                                      utils.scope_filter(models.Location.location_id, role))
 
     location = location_query.first()
 
@@ -104,7 +104,7 @@ async def update_locations(location_id: str, location_: schemas.UpdateLocations,
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = location_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     location_query.update(updated_data)
@@ -126,7 +126,7 @@ async def delete_locations(locations_id: str, db: Session = Depends(get_db),
 
     locations = db.query(models.Location).filter(models.Location.location_id == locations_id,
                                                  models.Location.is_deleted == False,
-                                                 models.Location.location_id.ilike(f'%{role}%')).first()
+                                                 utils.scope_filter(models.Location.location_id, role)).first()
 
     if locations is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -134,7 +134,7 @@ async def delete_locations(locations_id: str, db: Session = Depends(get_db),
 
     update_data = schemas.UpdateLocations(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
@@ -0,0 +1,23 @@
+from fastapi import Depends, APIRouter
+
+from .. import oauth2, utils, database
+from .websocket import manager
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"]
+)
+
+
+# gated on read_permission, which the administrators managing roles and permissions already hold
+@router.get("/")
+async def get_metrics(user_access: None = Depends(oauth2.has_permission("read_permission"))):
+    """ this api route returns the in-process counters of the server, they reset whenever the worker restarts """
+
+    return {
+        "permission_cache": oauth2.permission_cache.stats(),
+        "password_hashing": utils.hashing_pool.stats(),
+        "database_pool": database.pool_stats(),
+        "read_replicas": database.replicas.stats(),
+        "websocket": manager.stats(),
+    }
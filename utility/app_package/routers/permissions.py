@@ -63,6 +63,7 @@ async def update_permission(permission_id: int, permission: schemas.UpdatePermis
         setattr(db_permission, key, value)
     db.commit()
     db.refresh(db_permission)
+    oauth2.permission_cache.invalidate()
     return db_permission
 
 
@@ -74,4 +75,5 @@ async def delete_permission(permission_id: int, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Permission not found")
     db.delete(db_permission)
     db.commit()
+    oauth2.permission_cache.invalidate()
     return db_permission
@@ -1,12 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
 from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
 from sqlalchemy.orm import Session
 
 from .. import schemas, models, oauth2, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/programs",
@@ -19,7 +18,7 @@ async def get_programs(
         id: Optional[int] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_program")),
         program_type: Optional[str] = None,
@@ -31,14 +30,16 @@ async def get_programs(
         start_month: Optional[int] = None,
         end_month: Optional[int] = None,
         start_year: Optional[int] = None,
-        end_year: Optional[int] = None
+        end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     role = await utils.create_admin_access_id(current_user)
 
     if role is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.ChurchPrograms).filter(models.ChurchPrograms.location_id.ilike(f'%{role}%'),
+    query = db.query(models.ChurchPrograms).filter(utils.scope_filter(models.ChurchPrograms.location_id, role),
                                                    models.ChurchPrograms.is_deleted == False)
 
     if id:
@@ -57,17 +58,10 @@ async def get_programs(
         query = query.filter(models.ChurchPrograms.location_id == location_id)
 
     if date:
-        query = query.filter(models.ChurchPrograms.date == date)
+        query = query.filter(models.ChurchPrograms.start_date == date)
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.ChurchPrograms.date) >= start_month,
-            extract('month', models.ChurchPrograms.date) <= end_month)
-
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.ChurchPrograms.date) >= start_year,
-            extract('year', models.ChurchPrograms.date) <= end_year)
+    query = query.filter(*utils.date_range_filter(models.ChurchPrograms.start_date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
     # Apply limit and offset to the query
     query = query.offset(offset).limit(limit)
@@ -119,7 +113,7 @@ async def update_programs(program_id: str, setup_: schemas.UpdatePrograms, db: S
 
     setup_query = db.query(models.ChurchPrograms).filter(models.ChurchPrograms.id == program_id,
                                                          models.ChurchPrograms.is_deleted == False,
-                                                         models.ChurchPrograms.location_id.ilike(f'%{role}%'))
+                                                         utils.scope_filter(models.ChurchPrograms.location_id, role))
 
     setup = setup_query.first()
 
@@ -132,7 +126,7 @@ async def update_programs(program_id: str, setup_: schemas.UpdatePrograms, db: S
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = setup_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     setup_query.update(updated_data)
@@ -154,14 +148,14 @@ async def delete_programs(program_id: str, db: Session = Depends(get_db),
 
     setup = db.query(models.ChurchPrograms).filter(models.ChurchPrograms.id == program_id,
                                                    models.ChurchPrograms.is_deleted == False,
-                                                   models.ChurchPrograms.location_id.ilike(f'%{role}%')).first()
+                                                   utils.scope_filter(models.ChurchPrograms.location_id, role)).first()
 
     if setup is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {program_id} does not exist")
 
     update_data = schemas.UpdatePrograms(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
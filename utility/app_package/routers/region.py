@@ -1,13 +1,13 @@
 import random
 import string
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
 from fastapi import status, HTTPException, Depends, APIRouter
 from sqlalchemy.orm import Session
 
 from .. import schemas, models, oauth2, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/regions",
@@ -21,7 +21,7 @@ async def get_regions(
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
         region_id: Optional[str] = None,
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         # user_access: None = Depends(oauth2.has_permission("read_region")),
         region_name: Optional[str] = None,
@@ -34,7 +34,7 @@ async def get_regions(
 
     user_type = await utils.create_admin_access_id(current_user)
 
-    query = db.query(models.Region).filter(models.Region.region_id.ilike(f'%{user_type}%'),
+    query = db.query(models.Region).filter(utils.scope_filter(models.Region.region_id, user_type),
                                            models.Region.is_deleted == False)
 
     if id:
@@ -97,7 +97,7 @@ async def update_regions(region_id: str, region_: schemas.UpdateRegions, db: Ses
 
     region_query = db.query(models.Region).filter(models.Region.region_id == region_id,
                                                   models.Region.is_deleted == False,
-                                                  models.Region.region_id.ilike(f"%{role}%"))
+                                                  utils.scope_filter(models.Region.region_id, role))
 
     region = region_query.first()
 
@@ -110,7 +110,7 @@ async def update_regions(region_id: str, region_: schemas.UpdateRegions, db: Ses
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = region_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     region_query.update(updated_data)
@@ -132,14 +132,14 @@ async def delete_region(region_id: str, db: Session = Depends(get_db),
 
     region = db.query(models.Region).filter(models.Region.region_id == region_id,
                                             models.Region.is_deleted == False,
-                                            models.Region.region_id.ilike(f"%{role}%")).first()
+                                            utils.scope_filter(models.Region.region_id, role)).first()
 
     if region is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Region with id: {region_id} does not exist")
 
     update_data = schemas.UpdateRegions(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
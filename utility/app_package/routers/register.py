@@ -1,11 +1,13 @@
-from datetime import datetime
-from typing import List, Optional, Union
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from .. import schemas, utils, models, oauth2, hierarchy, bulk
+from ..database import get_async_db, get_db, get_read_db
+from .websocket import manager
 
 router = APIRouter(
     prefix="/records",
@@ -13,14 +15,17 @@ router = APIRouter(
 )
 
 
-@router.get('/read-record/', response_model=Union[schemas.RecordResponse, List[schemas.RecordResponse]])
+@router.get('/read-record/', response_model=schemas.sparse(schemas.RecordResponse))
 async def get_records(
+        response: Response,
         _id: Optional[str] = None,
         offset: Optional[int] = 0,  # Default offset set to 0
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
         limit: Optional[int] = 100,  # Default limit set to 100
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_record")),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         program_domain: Optional[str] = None,
         program_type: Optional[str] = None,
         location: Optional[str] = None,
@@ -29,14 +34,18 @@ async def get_records(
         get_all: Optional[bool] = None,
         month: Optional[int] = None,
         year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     user_type = await utils.create_admin_access_id(current_user)
 
     if user_type is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.Record).filter(models.Record.location_id.ilike(f'%{user_type}%'),
-                                           models.Record.is_deleted == False)
+    names = utils.response_fields(schemas.RecordResponse, fields)
+    keyset = (models.Record.date, models.Record.id)
+    query = db.query(*utils.response_columns(models.Record, names, keyset)).filter(
+        utils.scope_filter(models.Record.location_id, user_type), models.Record.is_deleted == False)
 
     if _id:
         query = query.filter(models.Record.id == _id)
@@ -56,50 +65,97 @@ async def get_records(
     if date:
         query = query.filter(models.Record.date == date)
 
-    if month:
-        query = query.filter(extract('month', models.Record.date) == month,
-                             models.Record.location_id.ilike(f'%{user_type}%'))
-    if year:
-        query = query.filter(extract('year', models.Record.date) == year,
-                             models.Record.location_id.ilike(f'%{user_type}%'))
+    # a single month (and/or year) is the range from that month to itself
+    query = query.filter(*utils.date_range_filter(models.Record.date, month, month, year, year, from_date, to_date))
 
-    query = query.offset(offset).limit(limit)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
     record = query.all()
+    utils.set_next_cursor(response, record, keyset, limit)
 
     if not record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No data found!")
 
     if get_all:
-        return record
+        return utils.rows_response(response, record, names)
 
     # If a single user was requested by ID, return just that user
     if _id:
         if len(record) == 1:
-            return record[0]
+            return utils.rows_response(response, record[0], names)
 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Record with id: {_id} not found!')
 
-    return record
+    return utils.rows_response(response, record, names)
 
 
 @router.post('/create-record/', status_code=status.HTTP_201_CREATED, response_model=schemas.RecordResponse)
-async def create_record(record: schemas.CreateRecord, db: Session = Depends(get_db),
+async def create_record(record: schemas.CreateRecord, response: Response, db: Session = Depends(get_db),
                         current_user: str = Depends(oauth2.get_current_user),
+                        idempotency_key: Optional[str] = Header(None),  # a retry sends the same key, or client_uuid
                         # user_access: None = Depends(oauth2.has_permission("create_record"))
                         ):
     try:
-        new_record = models.Record(**record.dict())
-        db.add(new_record)
+        row = record.dict()
+        row["client_uuid"] = row.get("client_uuid") or idempotency_key
+
+        if row["client_uuid"]:
+            new_record, created = bulk.insert_once(db, models.Record, row, current_user,
+                                                   await bulk.uploader_scope(current_user))
+        else:
+            new_record, created = models.Record(**row), True
+            db.add(new_record)
+
+        if not created:
+            # the upload is already stored, answer with that row and write nothing
+            response.headers["Idempotent-Replayed"] = "true"
+            return new_record
+
         db.commit()
         db.refresh(new_record)
 
         return new_record
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()  # Rollback changes in case of exception
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error! Record could not be saved.")
 
 
+# this api route saves a list of newcomer and convert records in one transaction and reports what happened to each item
+@router.post('/create-record/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_records_batch(records: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                               current_user: str = Depends(oauth2.get_current_user),
+                               idempotency_key: Optional[str] = Header(None)):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateRecord, models.Record, records, current_user,
+                                                  idempotency_key)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Records could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} newcomer and convert records submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.patch("/update-record/", response_model=schemas.RecordResponse)
 async def update_record(record_id: str, records: schemas.UpdateRecord, db: Session = Depends(get_db),
                         current_user: str = Depends(oauth2.get_current_user),
@@ -111,7 +167,7 @@ async def update_record(record_id: str, records: schemas.UpdateRecord, db: Sessi
 
     record_query = db.query(models.Record).filter(models.Record.id == record_id,
                                                   models.Record.is_deleted == False,
-                                                  models.Record.location_id.ilike(f"%{role}%"))
+                                                  utils.scope_filter(models.Record.location_id, role))
 
     record = record_query.first()
 
@@ -124,10 +180,10 @@ async def update_record(record_id: str, records: schemas.UpdateRecord, db: Sessi
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = records.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    record_query.update(updated_data)
+    record_query.update(hierarchy.with_hierarchy(updated_data))
     db.commit()
     db.refresh(record)
 
@@ -146,14 +202,14 @@ async def delete_record(record_id: str, db: Session = Depends(get_db),
 
     record = db.query(models.Record).filter(models.Record.id == record_id,
                                             models.Record.is_deleted == False,
-                                            models.Record.location_id.ilike(f'%{role}%')).first()
+                                            utils.scope_filter(models.Record.location_id, role)).first()
 
     if record is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Record with id: {record_id} does not exist")
 
     update_data = schemas.UpdateRecord(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
@@ -27,6 +27,7 @@ async def create_roles(role: schemas.CreateRoles, db: Session = Depends(get_db),
         db.add(new_role)
         db.commit()
         db.refresh(new_role)
+        oauth2.permission_cache.invalidate()
         return new_role
     except Exception as e:
         db.rollback()  # Rollback changes in case of exception
@@ -63,6 +64,7 @@ async def update_role(role_id: int, role: schemas.UpdateRoles, db: Session = Dep
         setattr(db_role, key, value)
     db.commit()
     db.refresh(db_role)
+    oauth2.permission_cache.invalidate()
     return db_role
 
 
@@ -79,6 +81,7 @@ def assign_permissions_to_role(assign_permissions: schemas.AssignPermissionsToRo
     # Clear existing permissions (if needed) and add new ones
     role.permissions = permissions
     db.commit()
+    oauth2.permission_cache.invalidate()
 
     return {"status": "success", "message": "Permissions assigned to role successfully"}
 
@@ -99,6 +102,7 @@ def remove_permissions_from_role(role_id: int, permission_ids: List[int], db: Se
             role.permissions.remove(permission)
 
     db.commit()
+    oauth2.permission_cache.invalidate()
 
     return {
         "status": "success",
@@ -116,4 +120,5 @@ async def delete_role(role_id: int, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Role not found")
     db.delete(db_role)
     db.commit()
+    oauth2.permission_cache.invalidate()
     return db_role
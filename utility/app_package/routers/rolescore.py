@@ -67,6 +67,7 @@ async def update_level(level_id: int, role: schemas.UpdateRoleScore, db: Session
         setattr(db_level, key, value)
     db.commit()
     db.refresh(db_level)
+    oauth2.permission_cache.invalidate()  # the role scores are part of the permission fingerprint
     return db_level
 
 
@@ -78,4 +79,5 @@ async def delete_level(level_id: int, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Level not found")
     db.delete(db_level)
     db.commit()
+    oauth2.permission_cache.invalidate()
     return db_level
@@ -1,11 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
 from fastapi import status, HTTPException, Depends, APIRouter
 from sqlalchemy.orm import Session
 
 from .. import schemas, models, oauth2, utils
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/state",
@@ -19,7 +19,7 @@ async def get_state(
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
         state_id: Optional[str] = None,
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         # user_access: None = Depends(oauth2.has_permission("read_state")),
         state_name: Optional[str] = None,
@@ -32,7 +32,7 @@ async def get_state(
 
     query = db.query(models.States).filter(models.States.id == id,
                                            models.States.is_deleted == False,
-                                           models.States.location_id.ilike(f'%{role}%')).first()
+                                           utils.scope_filter(models.States.state_id, role)).first()
 
     if id:
         query = db.query(models.States).filter(models.States.id == id)
@@ -91,7 +91,7 @@ async def update_state(state_id: str, state_: schemas.UpdateState, db: Session =
 
     state_query = db.query(models.States).filter(models.States.state_id == state_id,
                                                  models.States.is_deleted == False,
-                                                 models.States.state_id.ilike(f"%{role}%"))
+                                                 utils.scope_filter(models.States.state_id, role))
 
     state = state_query.first()
 
@@ -104,7 +104,7 @@ async def update_state(state_id: str, state_: schemas.UpdateState, db: Session =
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = state.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
     state_query.update(updated_data)
@@ -126,14 +126,14 @@ async def delete_state(state_id: str, db: Session = Depends(get_db),
 
     state = db.query(models.States).filter(models.States.state_id == state_id,
                                            models.States.is_deleted == False,
-                                           models.States.state_id.ilike(f"%{role}%")).first()
+                                           utils.scope_filter(models.States.state_id, role)).first()
 
     if state is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f" State ID: {state_id} does not exist")
 
     update_data = schemas.UpdateState(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import status, HTTPException, Depends, APIRouter, Query
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from .. import schemas, utils, models, oauth2
+from ..config import settings
+from ..database import get_db
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["Sync"]
+)
+
+# the tables a device keeps offline, in the order a sync walks them: (name, model, scope column, read permission).
+# Users are left out on purpose, their rows carry credentials
+SYNC_TABLES = (
+    ("location", models.Location, "location_id", "read_location"),
+    ("workers", models.Workers, "location_id", "read_worker"),
+    ("programs_setup", models.ChurchPrograms, "location_id", "read_program"),
+    ("counts", models.Counter, "location_id", "read_count"),
+    ("record", models.Record, "location_id", "read_record"),
+    ("attendance", models.Attendance, "location_id", None),
+    ("tithe_offering", models.TitheAndOffering, "location_id", "read_tithe"),
+    ("fellowships", models.Fellowship, "location_id", "read_fellowship"),
+    ("fellowship_member", models.FellowshipMembers, "location_id", "read_fellowship_member"),
+    ("fellowship_attendance", models.FellowshipAttendance, "location_id", "read_fellowship_attendance"),
+    ("attendance_summaries", models.AttendanceSum, "location_id", "read_fellowship_attendance_summary"),
+    ("testimonies", models.Testimony, "location_id", "read_fellowship_testimony"),
+    ("prayer_requests", models.PrayerRequest, "location_id", "read_fellowship_prayer"),
+)
+
+# table index, last_modify and primary key of the last row sent, the since and high water mark of the sync
+CURSOR_TYPES = (int, datetime, str, datetime, datetime)
+
+
+def _parse_since(since: str) -> datetime:
+    try:
+        value = datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="since must be an ISO 8601 date and time")
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _row_data(model, row) -> dict:
+    if row.is_deleted:
+        # a tombstone only needs to tell the device which row to drop
+        return {column.key: getattr(row, column.key) for column in model.__mapper__.primary_key}
+    return {attribute.key: getattr(row, attribute.key) for attribute in model.__mapper__.column_attrs}
+
+
+# this api route returns the rows created, updated or deleted since the device last synced, page by page
+@router.get('/changes/', response_model=schemas.SyncChanges)
+async def get_changes(
+        since: Optional[str] = None,  # high_water of the previous sync, leave out for a first full download
+        cursor: Optional[str] = None,  # next_cursor of the previous page of this sync
+        limit: Optional[int] = Query(500, ge=1, le=2000),
+        db: Session = Depends(get_db),
+        current_user: str = Depends(oauth2.get_current_user),
+):
+    user_type = await utils.create_admin_access_id(current_user)
+
+    if not user_type:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access")
+
+    if cursor:
+        table_index, last_modify, last_key, since_at, high_water = utils.decode_cursor(cursor, CURSOR_TYPES)
+        position = (last_modify, last_key) if last_modify is not None else None
+    else:
+        # rows committed while this sync runs may carry an older last_modify, the next sync starts early to catch them
+        high_water = datetime.now(timezone.utc) - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+        since_at = _parse_since(since) if since else None
+        table_index, position = 0, None
+
+    permissions = oauth2.permission_cache.get(current_user.roles[0].role_name, db) or frozenset()
+
+    changes = []
+    while table_index < len(SYNC_TABLES) and len(changes) < limit:
+        name, model, scope_column, permission = SYNC_TABLES[table_index]
+
+        if permission is None or permission in permissions:
+            key = model.__mapper__.primary_key[0]
+            query = db.query(model).filter(utils.scope_filter(getattr(model, scope_column), user_type))
+
+            if since_at is not None:
+                query = query.filter(model.last_modify >= since_at)
+
+            if position is not None:
+                query = query.filter(tuple_(model.last_modify, key) > (position[0], key.type.python_type(position[1])))
+
+            rows = query.order_by(model.last_modify, key).limit(limit - len(changes)).all()
+
+            changes += [schemas.SyncChange(table=name, operation=row.operation, is_deleted=row.is_deleted,
+                                           last_modify=row.last_modify, data=_row_data(model, row)) for row in rows]
+
+            if len(changes) == limit and rows:
+                # the page is full, resume this table after its last row
+                position = (rows[-1].last_modify, getattr(rows[-1], key.key))
+                break
+
+        table_index += 1
+        position = None
+
+    next_cursor = None
+    if table_index < len(SYNC_TABLES):
+        next_cursor = utils.encode_cursor([table_index, position[0] if position else None,
+                                           str(position[1]) if position else None, since_at, high_water])
+
+    return schemas.SyncChanges(changes=changes, next_cursor=next_cursor, high_water=high_water)
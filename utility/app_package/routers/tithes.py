@@ -1,11 +1,13 @@
-from datetime import datetime
-from typing import List, Optional, Union
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy import extract
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas, utils, models, oauth2
-from ..database import get_db
+from .. import schemas, utils, models, oauth2, hierarchy, bulk
+from ..database import get_async_db, get_db, get_read_db
+from .websocket import manager
 
 router = APIRouter(
     prefix="/tithes",
@@ -13,14 +15,17 @@ router = APIRouter(
 )
 
 
-@router.get('/read-tithe/', response_model=Union[schemas.TitheResponse, List[schemas.TitheResponse]])
+@router.get('/read-tithe/', response_model=schemas.sparse(schemas.TitheResponse))
 async def get_tithes(
+        response: Response,
         _id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_tithe")),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         location_id: Optional[str] = None,
         date: Optional[str] = None,
         get_all: Optional[bool] = None,
@@ -29,14 +34,18 @@ async def get_tithes(
         end_month: Optional[int] = None,
         start_year: Optional[int] = None,
         end_year: Optional[int] = None,
+        from_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
+        to_date: Optional[str] = None,  # YYYY-MM-DD, inclusive
 ):
     user_type = await utils.create_admin_access_id(current_user)
 
     if user_type is None:
         raise HTTPException(status_code=403, detail="Unauthorized access")
 
-    query = db.query(models.TitheAndOffering).filter(models.TitheAndOffering.location_id.ilike(f'%{user_type}%'),
-                                                     models.TitheAndOffering.is_deleted == False)
+    names = utils.response_fields(schemas.TitheResponse, fields)
+    keyset = (models.TitheAndOffering.date, models.TitheAndOffering.id)
+    query = db.query(*utils.response_columns(models.TitheAndOffering, names, keyset)).filter(
+        utils.scope_filter(models.TitheAndOffering.location_id, user_type), models.TitheAndOffering.is_deleted == False)
 
     if _id:
         query = query.filter(models.TitheAndOffering.id == _id)
@@ -50,53 +59,97 @@ async def get_tithes(
     if date:
         query = query.filter(models.TitheAndOffering.date == date)
 
-    if start_month and end_month:
-        query = query.filter(
-            extract('month', models.TitheAndOffering.date) >= start_month,
-            extract('month', models.TitheAndOffering.date) <= end_month
-        )
+    query = query.filter(*utils.date_range_filter(models.TitheAndOffering.date, start_month, end_month,
+                                                  start_year, end_year, from_date, to_date))
 
-    if start_year and end_year:
-        query = query.filter(
-            extract('year', models.TitheAndOffering.date) >= start_year,
-            extract('year', models.TitheAndOffering.date) <= end_year)
-
-    # Apply limit and offset to the query
-    query = query.offset(offset).limit(limit)
+    # Page by cursor when one is given, by limit and offset otherwise
+    query = utils.paginate(query, keyset, cursor, offset, limit)
     tithe = query.all()
+    utils.set_next_cursor(response, tithe, keyset, limit)
 
     if not tithe:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No data found')
 
     if get_all:
-        return tithe
+        return utils.rows_response(response, tithe, names)
 
     # If a single user was requested by ID, return just that user
     if _id:
         if len(tithe) == 1:
-            return tithe[0]
+            return utils.rows_response(response, tithe[0], names)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Tithe with id: {_id} not found!')
 
-    return tithe
+    return utils.rows_response(response, tithe, names)
 
 
 @router.post('/create-tithe/', status_code=status.HTTP_201_CREATED, response_model=schemas.TitheResponse)
-async def create_tithes(tithes: schemas.CreateTithe, db: Session = Depends(get_db),
+async def create_tithes(tithes: schemas.CreateTithe, response: Response, db: Session = Depends(get_db),
                         current_user: str = Depends(oauth2.get_current_user),
-                        user_access: None = Depends(oauth2.has_permission("create_tithe"))):
+                        user_access: None = Depends(oauth2.has_permission("create_tithe")),
+                        idempotency_key: Optional[str] = Header(None)):  # a retry sends the same key, or client_uuid
     try:
-        tithe = models.TitheAndOffering(**tithes.dict())
-        db.add(tithe)
+        row = tithes.dict()
+        row["client_uuid"] = row.get("client_uuid") or idempotency_key
+
+        if row["client_uuid"]:
+            tithe, created = bulk.insert_once(db, models.TitheAndOffering, row, current_user,
+                                              await bulk.uploader_scope(current_user))
+        else:
+            tithe, created = models.TitheAndOffering(**row), True
+            db.add(tithe)
+
+        if not created:
+            # the upload is already stored, answer with that row and write nothing
+            response.headers["Idempotent-Replayed"] = "true"
+            return tithe
+
         db.commit()
         db.refresh(tithe)
 
         return tithe
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()  # Rollback changes in case of exception
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Error! Tithe record could not be saved.")
 
 
+# this api route saves a list of tithe and offering records in one transaction and reports what happened to each item
+@router.post('/create-tithe/batch/', status_code=status.HTTP_201_CREATED, response_model=schemas.BatchResponse)
+async def create_tithes_batch(tithes: List[Dict[str, Any]], db: AsyncSession = Depends(get_async_db),
+                              current_user: str = Depends(oauth2.get_current_user),
+                              user_access: None = Depends(oauth2.has_permission("create_tithe")),
+                              idempotency_key: Optional[str] = Header(None)):
+    try:
+        result, created = await bulk.create_batch(db, schemas.CreateTithe, models.TitheAndOffering, tithes,
+                                                  current_user, idempotency_key)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Error! Tithe records could not be saved.")
+
+    if created:
+        # one notification for the whole batch
+        date_time = await utils.format_date_time(str(datetime.utcnow()))
+
+        await manager.publish(json.dumps(
+            {
+                "type": "notification",
+                "user_id": current_user.user_id,
+                "data": date_time,
+                "note": f"{len(created)} tithe and offering records submitted to the database"
+            }
+        ), *{row["location_id"] for row in created})
+
+    return result
+
+
 @router.put("/update-tithe/", response_model=schemas.TitheResponse)
 async def update_tithe(tithe_id: str, tithe_: schemas.UpdateTithe, db: Session = Depends(get_db),
                        current_user: str = Depends(oauth2.get_current_user),
@@ -108,7 +161,7 @@ async def update_tithe(tithe_id: str, tithe_: schemas.UpdateTithe, db: Session =
 
     tithe_query = db.query(models.TitheAndOffering).filter(models.TitheAndOffering.id == tithe_id,
                                                            models.TitheAndOffering.is_deleted == False,
-                                                           models.TitheAndOffering.location_id.ilike(f"%{role}%"))
+                                                           utils.scope_filter(models.TitheAndOffering.location_id, role))
 
     tithe = tithe_query.first()
 
@@ -121,10 +174,10 @@ async def update_tithe(tithe_id: str, tithe_: schemas.UpdateTithe, db: Session =
 
     # Update the record with new data, and set the operation and last_modify fields
     updated_data = tithe_.dict(exclude_unset=True)
-    updated_data["last_modify"] = datetime.utcnow()
+    updated_data["last_modify"] = datetime.now(timezone.utc)
     updated_data["operation"] = "update"
 
-    tithe_query.update(updated_data)
+    tithe_query.update(hierarchy.with_hierarchy(updated_data))
     db.commit()
     db.refresh(tithe)
 
@@ -142,14 +195,14 @@ async def delete_tithes(tithe_id: str, db: Session = Depends(get_db),
 
     tithe = db.query(models.TitheAndOffering).filter(models.TitheAndOffering.id == tithe_id,
                                                      models.TitheAndOffering.is_deleted == False,
-                                                     models.TitheAndOffering.location_id.ilike(f'%{role}%'))
+                                                     utils.scope_filter(models.TitheAndOffering.location_id, role))
 
     if tithe.first() is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tithe with id: {tithe_id} not found")
 
     update_data = schemas.UpdateTithe(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation="delete"
     )
 
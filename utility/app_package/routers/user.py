@@ -1,8 +1,8 @@
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Union, List, Optional
 
-from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi import status, HTTPException, Depends, APIRouter, Response
 from sqlalchemy.orm import Session, joinedload
 
 from .. import schemas, utils, models, oauth2
@@ -64,23 +64,23 @@ async def get_region_state(db: Session = Depends(get_db),
 async def create_users(user: schemas.UserCreate, db: Session = Depends(get_db),
                        # user_access: None = Depends(oauth2.has_permission("create_user"))
                        ):
-    try:
-        # hash the password - user.password
-        hashed_password = await utils.hash_password(user.password)
-        user.password = hashed_password
+    # hash the password - user.password (outside the try so a busy hashing pool surfaces as a 503)
+    hashed_password = await utils.hash_password(user.password)
+    user.password = hashed_password
 
+    try:
         new_user = models.User(**user.dict())
         db.add(new_user)
         db.commit()
         db.refresh(new_user)
 
-        await manager.broadcast(json.dumps(
+        await manager.publish(json.dumps(
             {
                 "type": "new_user",
                 "user_id": "",
                 "data": new_user.location_id
             }
-        ))
+        ), new_user.location_id)
 
         return new_user
     except Exception as e:
@@ -91,9 +91,11 @@ async def create_users(user: schemas.UserCreate, db: Session = Depends(get_db),
 
 @router.get('/read-user/', response_model=Union[schemas.UserResponse, List[schemas.UserResponse]])
 async def get_user(
+        response: Response,
         user_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
         db: Session = Depends(get_db),
         current_user: models.User = Depends(oauth2.get_current_user),
         # user_access: None = Depends(oauth2.has_permission("read_user")),
@@ -111,7 +113,7 @@ async def get_user(
     if not role_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User not recognized!")
 
-    query = db.query(models.User).filter(models.User.location_id.ilike(f'%{role_id}%'),
+    query = db.query(models.User).filter(utils.scope_filter(models.User.location_id, role_id),
                                          models.User.is_deleted == False)
 
     # Apply filters based on query parameters
@@ -137,10 +139,12 @@ async def get_user(
         query = query.filter(models.User.is_active == False)
 
     # Apply pagination
-    query = query.offset(offset).limit(limit)
+    keyset = (models.User.id,)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
 
     # Execute the query and get the results
     users = query.all()
+    utils.set_next_cursor(response, users, keyset, limit)
 
     # Return results or raise an exception if no data is found
     if not users:
@@ -170,7 +174,7 @@ async def delete_user(user_id: str, db: Session = Depends(get_db),
 
     user = db.query(models.User).filter(models.User.user_id == user_id,
                                         models.User.is_deleted == False,
-                                        models.User.location_id.ilike(f"%{role}%")).first()
+                                        utils.scope_filter(models.User.location_id, role)).first()
 
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {user_id} not found")
@@ -178,7 +182,7 @@ async def delete_user(user_id: str, db: Session = Depends(get_db),
     # Create an instance of UpdateUser with the desired fields
     update_data = schemas.UpdateUser(
         is_deleted=True,
-        last_modify=datetime.now()
+        last_modify=datetime.now(timezone.utc)
     )
 
     # Update the user with the new data
@@ -186,6 +190,7 @@ async def delete_user(user_id: str, db: Session = Depends(get_db),
         setattr(user, field, value)
 
     db.commit()
+    oauth2.revoke_user_tokens(user_id)
 
     return {"status": "successful!",
             "message": f"User with ID: {user_id} has been marked as deleted."
@@ -203,7 +208,7 @@ async def update_user(user_id: str, update_data: schemas.UpdateUser, db: Session
 
     user = db.query(models.User).filter(models.User.user_id == user_id,
                                         models.User.is_deleted == False,
-                                        models.User.location_id.ilike(f"%{role}%")).first()
+                                        utils.scope_filter(models.User.location_id, role)).first()
 
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {user_id} not found")
@@ -214,11 +219,12 @@ async def update_user(user_id: str, update_data: schemas.UpdateUser, db: Session
         setattr(user, field, value)
 
     # Update last_modify and operation only once
-    user.last_modify = datetime.now()
+    user.last_modify = datetime.now(timezone.utc)
     user.operation = "update"
 
     db.commit()
     db.refresh(user)
+    oauth2.revoke_user_tokens(user_id)
 
     # Update related workers table with relevant fields
     update_worker_fields = {
@@ -259,6 +265,7 @@ def assign_roles_to_user(assign_roles: schemas.AssignRolesToUser,
     # Add roles to the user
     user.roles.extend(roles)
     db.commit()
+    oauth2.revoke_user_tokens(user.user_id)
 
     return {"status": "success", "message": "Roles assigned to user successfully"}
 
@@ -281,6 +288,7 @@ def remove_roles_from_user(user_id: int, role_ids: List[int],
             user.roles.remove(role)
 
     db.commit()
+    oauth2.revoke_user_tokens(user.user_id)
 
     return {
         "status": "success",
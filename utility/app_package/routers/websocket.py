@@ -1,81 +1,445 @@
-from typing import List, Dict, Tuple
+import asyncio
+import logging
+import math
+import time
+import uuid
+from typing import Dict, Optional, Set, Tuple
 from fastapi import WebSocket, WebSocketDisconnect, WebSocketException, APIRouter, Depends, HTTPException, FastAPI
 from sqlalchemy.orm import Session
 import json
-from .. import oauth2, database
+from .. import oauth2, database, utils
+from ..broker import Broker, InMemoryBroker, create_broker
+from ..config import settings
+from ..hierarchy import covering_scopes
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+BROKER_CHANNEL = "websocket"
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.user_ids: Dict[WebSocket, Tuple[str, str]] = {}
-        self.groups: Dict[str, List[WebSocket]] = {}
+    """ the open sockets of this server, indexed by user, by hierarchy prefix and by group so that routing a message
+    or dropping a socket never scans the other connections.
+
+    Messages are not sent by the caller: each socket has a bounded queue drained by its own writer task, so a slow or
+    dead client delays nobody else and a failed send only evicts that socket. Presence goes out as join/leave deltas
+    within each viewer's scope, see flush_presence, and as a whole snapshot of that scope every few heartbeats, see
+    snapshot_presence.
+
+    Everything that crosses sockets goes through the broker, and every process delivers what it receives to its own
+    sockets: broadcasts, group and scoped notifications, personal messages and presence. With a shared broker the
+    users connected to another worker are reached and listed too, see _track for the directory of who is online """
+
+    def __init__(self, broker: Optional[Broker] = None):
+        self.broker = broker or InMemoryBroker()
+        self.node_id = uuid.uuid4().hex  # this process among the others sharing the broker
+        self._subscribed = False
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.user_ids: Dict[WebSocket, Tuple[str, str]] = {}  # socket -> (user_id, location_id), in connection order
+        self.by_user: Dict[str, Set[WebSocket]] = {}  # a user may be connected from several devices
+        self.by_location: Dict[str, Set[WebSocket]] = {}  # every hierarchy prefix of the socket's location id
+        self.scopes: Dict[WebSocket, str] = {}  # the socket user's access scope, see utils.create_admin_access_id
+        self.by_scope: Dict[str, Set[WebSocket]] = {}
+        self.groups: Dict[str, Set[WebSocket]] = {}
+        self.socket_groups: Dict[WebSocket, Set[str]] = {}
+        self.queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.writers: Dict[WebSocket, asyncio.Task] = {}
+        self.sent = 0
+        self.dropped = 0  # messages not queued because the socket's queue was full
+        self.evicted = 0  # sockets dropped after a failed or timed out send
+        self.publish_failures = 0  # envelopes the broker could not take
+        self.presence_changes: Dict[Tuple[str, str], str] = {}  # (user_id, location_id) -> joined or left, last wins
+        self._presence_flush = None  # (loop, timer handle) of the pending flush_presence
+        # the directory of the users online on every node, this one included
+        self.nodes: Dict[str, Dict[Tuple[str, str], int]] = {}  # node -> (user_id, location_id) -> devices there
+        self.node_seen: Dict[str, Tuple[int, float]] = {}  # other node -> (last presence seq applied, last heard)
+        self.syncing: Dict[str, float] = {}  # other node -> when its snapshot was asked for
+        self.online: Dict[str, int] = {}  # user_id -> devices over every node
+        self.online_under: Dict[str, Dict[str, int]] = {}  # hierarchy prefix -> "user@location" -> devices
+        self.devices_under: Dict[str, int] = {}  # hierarchy prefix -> devices over every node
+        self.seq = 0  # presence events this node published
+        self.beats = 0  # heartbeats this node sent
+        self.outbox: list = []  # [user_id, location_id, delta] of this node not yet published, see _device_changed
+        self._outbox_publish: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _index(index: dict, key: str, websocket: WebSocket):
+        index.setdefault(key, set()).add(websocket)
+
+    @staticmethod
+    def _unindex(index: dict, key: str, websocket: WebSocket):
+        sockets = index.get(key)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del index[key]
+
+    @staticmethod
+    def _count(counts: dict, key, delta: int):
+        count = counts.get(key, 0) + delta
+        if count > 0:
+            counts[key] = count
+        else:
+            counts.pop(key, None)
+
+    async def start(self):
+        """ subscribe to the broker, once, and ask the other nodes who is online there. Done on the first connection,
+        a process without sockets delivers nothing """
+        if not self._subscribed:
+            self._subscribed = True
+            await self.broker.subscribe(BROKER_CHANNEL, self._deliver)
+            await self._send({"to": "sync", "node": self.node_id, "target": None})
 
-    async def connect(self, websocket: WebSocket, user_id: str, location_id: str):
+        loop = asyncio.get_running_loop()
+        if self._heartbeat is None or self._heartbeat.done() or self._heartbeat.get_loop() is not loop:
+            self._heartbeat = loop.create_task(self._beat())
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._outbox_publish is not None:
+            self._outbox_publish.cancel()
+            self._outbox_publish = None
+        self.outbox = []
+        if self._subscribed:
+            await self._send({"to": "bye", "node": self.node_id})
+        await self.broker.close()
+
+    async def _send(self, envelope: dict):
+        """ publish an envelope to every node. The fan-out is best effort: a broker that is down is logged and never
+        fails the caller, which has usually committed a write already. Lost presence is repaired by the heartbeats """
+        try:
+            await self.broker.publish(BROKER_CHANNEL, json.dumps(envelope))
+        except Exception as e:
+            self.publish_failures += 1
+            logger.warning("WebSocket broker publish failed, %s envelope not delivered: %s", envelope["to"], e)
+
+    async def connect(self, websocket: WebSocket, user_id: str, location_id: str, scope: Optional[str] = None):
+        await self.start()
         await websocket.accept()
-        self.active_connections.append(websocket)
         self.user_ids[websocket] = (user_id, location_id)
-        await self.broadcast_user_list()
-        await self.broadcast_user_count()
+        if scope:
+            self.scopes[websocket] = scope
+            self._index(self.by_scope, scope, websocket)
+        self.queues[websocket] = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.writers[websocket] = asyncio.create_task(self._writer(websocket, self.queues[websocket]))
+        self._index(self.by_user, user_id, websocket)
+        for prefix in covering_scopes(location_id):
+            self._index(self.by_location, prefix, websocket)
+        await self._device_changed(user_id, location_id, 1)
 
     async def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            del self.user_ids[websocket]
-            await self.broadcast_user_list()
-            await self.broadcast_user_count()
+        if websocket in self.user_ids:
+            user_id, location_id = self.user_ids.pop(websocket)
+            self._unindex(self.by_user, user_id, websocket)
+            for prefix in covering_scopes(location_id):
+                self._unindex(self.by_location, prefix, websocket)
+            for group_name in self.socket_groups.pop(websocket, ()):
+                self._unindex(self.groups, group_name, websocket)
+            if websocket in self.scopes:
+                self._unindex(self.by_scope, self.scopes.pop(websocket), websocket)
+            self.queues.pop(websocket, None)
+            writer = self.writers.pop(websocket, None)
+            if writer is not None and writer is not asyncio.current_task():
+                writer.cancel()
+            await self._device_changed(user_id, location_id, -1)
+
+    def sockets_of(self, user_id: str) -> Set[WebSocket]:
+        return self.by_user.get(user_id, set())
+
+    def sockets_under(self, location_prefix: str) -> Set[WebSocket]:
+        """ the sockets of this process whose users are located at or below a state, region, group or location id """
+        return self.by_location.get(location_prefix, set())
+
+    def is_online(self, user_id: str) -> bool:
+        """ the user has a socket open on any node """
+        return user_id in self.online
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """ send the socket's queued messages in order, evicting the socket on the first send that fails or stalls """
+        while True:
+            message = await queue.get()
+            try:
+                await asyncio.wait_for(websocket.send_text(message), settings.WS_SEND_TIMEOUT_SECONDS)
+                self.sent += 1
+            except Exception as e:
+                print(f"Evicting websocket after a failed send: {e!r}")
+                self.evicted += 1
+                await self.disconnect(websocket)
+                try:
+                    await websocket.close(code=1011)
+                except Exception:
+                    pass
+                return
+
+    def _enqueue(self, websocket: WebSocket, message: str):
+        queue = self.queues.get(websocket)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        depths = [queue.qsize() for queue in self.queues.values()]
+        return {
+            "connections": len(self.user_ids),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "publish_failures": self.publish_failures,
+            "nodes": len(self.nodes),
+            "online_users": len(self.online),
+        }
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        self._enqueue(websocket, message)
+
+    async def send_to_user(self, user_id: str, message: str):
+        """ every device of the user, on whichever node it is connected """
+        await self._send({"to": "user", "user_id": user_id, "message": message})
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        await self._send({"to": "all", "message": message})
 
-    async def send_user_list(self, websocket: WebSocket):
-        users = [f"{user_id}@{location_id}" for user_id, location_id in self.user_ids.values()]
-        message = json.dumps({
-            "type": "user_list",
-            "users": users
-        })
-        await self.send_personal_message(message, websocket)
+    async def publish(self, message: str, *location_ids: str):
+        """ send a notification about rows at these location ids to the sockets whose user scope covers at least one
+        of them, each socket once. The other sockets are not authorised to see the rows and get nothing """
+        await self._send({"to": "scope", "location_ids": list(location_ids), "message": message})
 
-    async def broadcast_user_list(self):
-        users = [f"{user_id}@{location_id}" for user_id, location_id in self.user_ids.values()]
-        message = json.dumps({
-            "type": "user_list",
-            "users": users
-        })
-        await self.broadcast(message)
+    async def broadcast_to_group(self, group_name: str, message: str):
+        await self._send({"to": "group", "group": group_name, "message": message})
+
+    async def _deliver(self, data: str):
+        """ act on an envelope received from the broker: queue a message to the matching sockets of this process, or
+        update the directory from another node's presence """
+        envelope = json.loads(data)
+        kind = envelope["to"]
+
+        if kind in ("presence", "heartbeat", "snapshot", "sync", "bye"):
+            if envelope["node"] != self.node_id:
+                await self._node_event(kind, envelope)
+            return
+
+        if kind == "all":
+            recipients = self.user_ids
+        elif kind == "user":
+            recipients = self.by_user.get(envelope["user_id"], ())
+        elif kind == "group":
+            recipients = self.groups.get(envelope["group"], ())
+        else:
+            recipients = set()
+            for location_id in envelope["location_ids"]:
+                for scope in covering_scopes(location_id):
+                    recipients.update(self.by_scope.get(scope, ()))
 
-    async def broadcast_user_count(self):
-        user_count = len(self.user_ids)
+        for connection in recipients:
+            self._enqueue(connection, envelope["message"])
+
+    def _track(self, node: str, user_id: str, location_id: str, delta: int):
+        """ move the device count of a user on a node, and record a join or leave when the user comes online on a
+        first node or goes offline on the last one """
+        devices = self.nodes.setdefault(node, {})
+        key = (user_id, location_id)
+        delta = max(delta, -devices.get(key, 0))  # a node never has fewer than zero devices of a user
+        if not delta:
+            return
+        self._count(devices, key, delta)
+
+        before = self.online.get(user_id, 0)
+        self._count(self.online, user_id, delta)
+        name = f"{user_id}@{location_id}"
+        for prefix in covering_scopes(location_id):
+            self._count(self.devices_under, prefix, delta)
+            self._count(self.online_under.setdefault(prefix, {}), name, delta)
+            if not self.online_under[prefix]:
+                del self.online_under[prefix]
+
+        if not before:
+            self._presence_changed(user_id, location_id, "joined")
+        elif user_id not in self.online:
+            self._presence_changed(user_id, location_id, "left")
+
+    def _replace_node(self, node: str, devices: Dict[Tuple[str, str], int]):
+        """ make the directory entry of a node match its snapshot, an empty one forgets the node """
+        current = self.nodes.get(node, {})
+        for key in set(current) | set(devices):
+            delta = devices.get(key, 0) - current.get(key, 0)
+            if delta:
+                self._track(node, *key, delta)
+        if not devices:
+            self.nodes.pop(node, None)
+
+    async def _device_changed(self, user_id: str, location_id: str, delta: int):
+        """ count the device here at once, and tell the other nodes with the next publish_outbox: a reconnect storm
+        costs one broker message per interval instead of one per socket """
+        self._track(self.node_id, user_id, location_id, delta)
+        self.outbox.append([user_id, location_id, delta])
+        task = self._outbox_publish
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            self._outbox_publish = asyncio.create_task(self._publish_outbox_later())
+
+    async def _publish_outbox_later(self):
+        await asyncio.sleep(settings.PRESENCE_INTERVAL_SECONDS)
+        self._outbox_publish = None
+        await self.publish_outbox()
+
+    async def publish_outbox(self):
+        """ one presence event, one seq, carrying every device change of this node since the last one """
+        if self.outbox:
+            changes, self.outbox = self.outbox, []
+            self.seq += 1
+            await self._send({"to": "presence", "node": self.node_id, "seq": self.seq, "changes": changes})
+
+    async def _snapshot(self):
+        await self.publish_outbox()  # the snapshot includes them, they must not come again after it
+        devices = self.nodes.get(self.node_id, {})
+        await self._send({"to": "snapshot", "node": self.node_id, "seq": self.seq,
+                          "devices": [[*key, count] for key, count in devices.items()]})
+
+    async def _request_sync(self, node: str):
+        """ ask a node for its whole directory entry after one of its presence events went missing """
+        now = time.monotonic()
+        if now - self.syncing.get(node, -math.inf) > settings.PRESENCE_HEARTBEAT_SECONDS:
+            self.syncing[node] = now
+            await self._send({"to": "sync", "node": self.node_id, "target": node})
+
+    async def _node_event(self, kind: str, envelope: dict):
+        node = envelope["node"]
+        if kind == "sync":
+            if envelope["target"] in (None, self.node_id):
+                await self._snapshot()
+            return
+
+        if kind == "bye":
+            self._replace_node(node, {})
+            self.node_seen.pop(node, None)
+            self.syncing.pop(node, None)
+            return
+
+        known = self.node_seen.get(node, (0, 0.0))[0]
+        now = time.monotonic()
+
+        if kind == "snapshot":
+            self._replace_node(node, {(user_id, location_id): count
+                                      for user_id, location_id, count in envelope["devices"]})
+            self.node_seen[node] = (envelope["seq"], now)
+            self.syncing.pop(node, None)
+
+        elif kind == "presence":
+            seq = envelope["seq"]
+            if seq == known + 1 and node not in self.syncing:
+                for user_id, location_id, delta in envelope["changes"]:
+                    self._track(node, user_id, location_id, delta)
+                self.node_seen[node] = (seq, now)
+            elif seq > known:
+                # an event was lost on the way, the snapshot replaces everything this node sent so far
+                self.node_seen[node] = (known, now)
+                await self._request_sync(node)
+
+        elif kind == "heartbeat":
+            self.node_seen[node] = (known, now)
+            if envelope["seq"] != known or node in self.syncing:
+                await self._request_sync(node)
+
+    async def _beat(self):
+        """ tell the other nodes this one is alive and how many presence events it sent, and forget the nodes that
+        went silent for three beats: their users are reported as left """
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_SECONDS)
+            try:
+                await self._send({"to": "heartbeat", "node": self.node_id, "seq": self.seq})
+                self.beats += 1
+                if self.beats % settings.PRESENCE_SNAPSHOT_BEATS == 0:
+                    self.snapshot_presence()
+                horizon = time.monotonic() - 3 * settings.PRESENCE_HEARTBEAT_SECONDS
+                for node in [node for node, (_, seen) in self.node_seen.items() if seen < horizon]:
+                    self._replace_node(node, {})
+                    del self.node_seen[node]
+                    self.syncing.pop(node, None)
+            except Exception as e:
+                print(e)
+
+    def _presence_changed(self, user_id: str, location_id: str, event: str):
+        self.presence_changes[(user_id, location_id)] = event
+        loop = asyncio.get_running_loop()
+        if self._presence_flush is None or self._presence_flush[0] is not loop:
+            self._presence_flush = (loop, loop.call_later(settings.PRESENCE_INTERVAL_SECONDS, self.flush_presence))
+
+    def flush_presence(self):
+        """ send each viewer one message with the users who joined or left within its scope since the last flush and
+        the number of connections now online in that scope, over every node. A reconnect storm costs one message per
+        viewer and interval instead of the full user list to every socket on every connection.
+
+        The message is built once per scope and shared by the sockets of that scope. When more than a page of users
+        changed it only carries the count and resync, the viewer then pages through request_user_list """
+        self._presence_flush = None
+        changes, self.presence_changes = self.presence_changes, {}
+
+        deltas: Dict[str, dict] = {}
+        for (user_id, location_id), event in changes.items():
+            for scope in covering_scopes(location_id):
+                if scope in self.by_scope:
+                    delta = deltas.setdefault(scope, {"joined": [], "left": []})
+                    delta[event].append(f"{user_id}@{location_id}")
+
+        for scope, delta in deltas.items():
+            resync = len(delta["joined"]) + len(delta["left"]) > settings.PRESENCE_PAGE_SIZE
+            message = json.dumps({
+                "type": "presence",
+                "joined": [] if resync else delta["joined"],
+                "left": [] if resync else delta["left"],
+                "resync": resync,
+                "count": self.devices_under.get(scope, 0)
+            })
+            for connection in self.by_scope.get(scope, ()):
+                self._enqueue(connection, message)
+
+    def snapshot_presence(self):
+        """ send each viewer the users online within its scope and their count, replacing whatever it built from the
+        deltas. A viewer that missed a presence message, because its queue was full or it reconnected, is right again
+        after one snapshot. Past a page of users only the count and resync are sent, as in flush_presence """
+        for scope, connections in self.by_scope.items():
+            users = sorted(self.online_under.get(scope, ()))
+            resync = len(users) > settings.PRESENCE_PAGE_SIZE
+            message = json.dumps({
+                "type": "presence_snapshot",
+                "users": [] if resync else users,
+                "resync": resync,
+                "count": self.devices_under.get(scope, 0)
+            })
+            for connection in connections:
+                self._enqueue(connection, message)
+
+    async def send_user_list(self, websocket: WebSocket, offset: int = 0, limit: Optional[int] = None):
+        """ one page of the users online within the viewer's scope on every node, sorted so the pages stay stable """
+        limit = min(limit or settings.PRESENCE_PAGE_SIZE, settings.PRESENCE_PAGE_SIZE)
+        scope = self.scopes.get(websocket)
+        users = sorted(self.online_under.get(scope, ())) if scope else []
         message = json.dumps({
-            "type": "user_count",
-            "count": user_count
+            "type": "user_list",
+            "users": users[offset:offset + limit],
+            "total": len(users),
+            "offset": offset,
+            "next_offset": offset + limit if offset + limit < len(users) else None
         })
-        await self.broadcast(message)
+        await self.send_personal_message(message, websocket)
 
     async def add_to_group(self, group_name: str, websocket: WebSocket):
-        if group_name not in self.groups:
-            self.groups[group_name] = []
-        self.groups[group_name].append(websocket)
+        self._index(self.groups, group_name, websocket)
+        self.socket_groups.setdefault(websocket, set()).add(group_name)
 
     async def remove_from_group(self, group_name: str, websocket: WebSocket):
-        if group_name in self.groups:
-            self.groups[group_name].remove(websocket)
-            if not self.groups[group_name]:
-                del self.groups[group_name]
+        self._unindex(self.groups, group_name, websocket)
+        self._unindex(self.socket_groups, websocket, group_name)
 
-    async def broadcast_to_group(self, group_name: str, message: str):
-        if group_name in self.groups:
-            for connection in self.groups[group_name]:
-                await connection.send_text(message)
 
-
-manager = ConnectionManager()
+manager = ConnectionManager(create_broker(settings.BROKER_URL))
 
 
 @router.websocket("/ws")
@@ -90,7 +454,11 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(databas
         current_user = oauth2.get_current_user(token, db)
         user_id = current_user.user_id
         location_id = current_user.location_id
-        await manager.connect(websocket, user_id, location_id)
+        try:
+            scope = await utils.create_admin_access_id(current_user)
+        except ValueError:  # a user without a role receives no scoped notifications
+            scope = None
+        await manager.connect(websocket, user_id, location_id, scope)
     except HTTPException as e:
         await websocket.close(code=1008)
         return
@@ -99,21 +467,18 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(databas
         while True:
             data = await websocket.receive_text()
             if data.startswith("request_user_list"):
-                await manager.send_user_list(websocket)
+                # request_user_list[:offset[:limit]]
+                page = [int(value) for value in data.split(":")[1:3] if value.isdigit()]
+                await manager.send_user_list(websocket, *page)
             elif data.startswith("pm:"):
                 _, recipient_user_id, message = data.split(":", 2)
-                recipient_ws = None
-                for ws, (uid, loc_id) in manager.user_ids.items():
-                    if uid == recipient_user_id:
-                        recipient_ws = ws
-                        break
-                if recipient_ws:
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "personal_message",
-                            "sender": user_id,
-                            "message": message
-                        }), recipient_ws)
+                if manager.is_online(recipient_user_id):
+                    # every device the recipient is connected from, on whichever node
+                    await manager.send_to_user(recipient_user_id, json.dumps({
+                        "type": "personal_message",
+                        "sender": user_id,
+                        "message": message
+                    }))
                 else:
                     await manager.send_personal_message(
                         json.dumps({
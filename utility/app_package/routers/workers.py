@@ -1,11 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Optional
 
-from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi import status, HTTPException, Depends, APIRouter, Response
 from sqlalchemy.orm import Session
 
 from .. import utils, models, schemas, oauth2
-from ..database import get_db
+from ..database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/workers",
@@ -52,14 +52,17 @@ async def create_worker(worker: schemas.CreateWorkers,
 
 
 # this endpoint get workers details base on search parameters and data are filtered based on user access
-@router.get('/read-worker/', response_model=Union[schemas.WorkerResponse, List[schemas.WorkerResponse]])
+@router.get('/read-worker/', response_model=schemas.sparse(schemas.WorkerResponse))
 async def get_workers(
+        response: Response,
         user_id: Optional[str] = None,
         limit: Optional[int] = 100,  # Default limit set to 100
         offset: Optional[int] = 0,  # Default offset set to 0
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = None,  # X-Next-Cursor of the previous page, replaces offset
+        db: Session = Depends(get_read_db),
         current_user: str = Depends(oauth2.get_current_user),
         user_access: None = Depends(oauth2.has_permission("read_worker")),
+        fields: Optional[str] = None,  # comma separated response fields, all of them by default
         location_id: Optional[str] = None,
         gender: Optional[str] = None,
         location: Optional[str] = None,
@@ -76,8 +79,11 @@ async def get_workers(
     if not user_type:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User not recognized")
 
-    query = db.query(models.Workers).filter(models.Workers.location_id.ilike(f'%{user_type}%'),
-                                            models.Workers.is_deleted == False)
+    # rows of the asked fields only, list screens skip the wide address and occupation columns
+    names = utils.response_fields(schemas.WorkerResponse, fields)
+    keyset = (models.Workers.id,)
+    query = db.query(*utils.response_columns(models.Workers, names, keyset)).filter(
+        utils.scope_filter(models.Workers.location_id, user_type), models.Workers.is_deleted == False)
 
     if user_id:
         query = query.filter(models.Workers.id == user_id)
@@ -107,26 +113,27 @@ async def get_workers(
         query = query.filter(models.Workers.address == address)
 
     # Apply pagination
-    query = query.offset(offset).limit(limit)
+    query = utils.paginate(query, keyset, cursor, offset, limit)
 
     # Execute the query and get the results
     worker = query.all()
+    utils.set_next_cursor(response, worker, keyset, limit)
 
     if not worker:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Worker(s) not found!")
 
     if get_all:
-        return worker
+        return utils.rows_response(response, worker, names)
 
     # If a single user was requested by ID, return just that user
     if user_id:
         if len(worker) == 1:
-            return worker[0]
+            return utils.rows_response(response, worker[0], names)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'Worker with id: {user_id} not found!')
 
-    return worker
+    return utils.rows_response(response, worker, names)
 
 
 @router.patch("/update-worker/", status_code=status.HTTP_200_OK)
@@ -140,7 +147,7 @@ async def update_worker(worker_id: str, worker: schemas.UpdateWorker, db: Sessio
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No read privilege for user type!")
 
     user_query = db.query(models.Workers).filter(models.Workers.user_id == worker_id,
-                                                 models.Workers.location_id.ilike(f'%{role}%'))
+                                                 utils.scope_filter(models.Workers.location_id, role))
 
     user = user_query.first()
 
@@ -152,7 +159,7 @@ async def update_worker(worker_id: str, worker: schemas.UpdateWorker, db: Sessio
     for field, value in update_fields.items():
         setattr(user, field, value)
 
-    user.last_modify = datetime.now()
+    user.last_modify = datetime.now(timezone.utc)
     user.operation = "update"
 
     db.commit()
@@ -173,6 +180,7 @@ async def update_worker(worker_id: str, worker: schemas.UpdateWorker, db: Sessio
     if update_user_fields:
         db.query(models.User).filter(models.User.user_id == worker_id).update(update_user_fields)
         db.commit()
+        oauth2.revoke_user_tokens(worker_id)
 
     return {"status": "successful!",
             "message": f"User with ID: {worker_id} updated successfully."
@@ -194,14 +202,14 @@ async def delete_workers(worker_id: str, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized access!")
 
     worker = db.query(models.Workers).filter(models.Workers.user_id == worker_id,
-                                             models.Workers.location_id.ilike(f'%{role}%')).first()
+                                             utils.scope_filter(models.Workers.location_id, role)).first()
 
     if worker is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"worker with id: {worker_id} is not found!")
 
     update_data = schemas.UpdateWorker(
         is_deleted=True,
-        last_modify=datetime.now(),
+        last_modify=datetime.now(timezone.utc),
         operation='delete'
     )
 
@@ -221,6 +229,7 @@ async def delete_workers(worker_id: str, db: Session = Depends(get_db),
     if delete_user:
         db.query(models.User).filter(models.User.user_id == worker_id).update(delete_user)
         db.commit()
+        oauth2.revoke_user_tokens(worker_id)
 
     return {"status": "successful!",
             "message": f"Worker with ID: {worker_id} deleted successfully!"
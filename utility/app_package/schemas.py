@@ -1,6 +1,7 @@
 from datetime import datetime, date
+from functools import lru_cache
 from typing import Optional, Union, List
-from pydantic import BaseModel, EmailStr, RootModel
+from pydantic import BaseModel, EmailStr, RootModel, create_model
 
 
 # ############################################# THE ROLE SCHEMAS ###############################################
@@ -329,6 +330,7 @@ class CreateCount(BaseModel):
     operation: Optional[str] = "create"
     is_deleted: Optional[bool] = False
     created_at: Optional[datetime] = None
+    client_uuid: Optional[str] = None  # unique per upload, a retry with the same value creates nothing
 
     class Config:
         from_attributes = True
@@ -357,6 +359,26 @@ class CountResponse(BaseModel):
     operation: str
     is_deleted: bool
     created_at: datetime
+    client_uuid: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class CountRollup(BaseModel):
+    """ *** Schemas that returns the summed counts of one hierarchy node over one period *** """
+
+    level: str
+    node_id: str
+    period: date
+    records: int
+    adult_male: int
+    adult_female: int
+    youth_male: int
+    youth_female: int
+    boys: int
+    girls: int
+    total: int
 
     class Config:
         from_attributes = True
@@ -434,6 +456,7 @@ class UsersResponse(BaseModel):
     name: str
     email: str
     roles: List[Role]
+    scope: Optional[str] = None  # the admin access id signed into a stateless token
 
 
 # ############################################# CONVERT/INVITEE SCHEMAS #############################################
@@ -463,6 +486,7 @@ class CreateRecord(BaseModel):
     operation: Optional[str] = "create"
     is_deleted: Optional[bool] = False
     created_at: Optional[datetime] = None
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -494,6 +518,7 @@ class RecordResponse(BaseModel):
     operation: str
     is_deleted: bool
     created_at: datetime
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -799,6 +824,7 @@ class CreateAttendance(BaseModel):
     operation: Optional[str] = "create"
     is_deleted: Optional[bool] = False
     created_at: Optional[datetime] = None
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -826,6 +852,7 @@ class AttendanceResponse(BaseModel):
     operation: str
     is_deleted: bool
     created_at: datetime
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -860,6 +887,7 @@ class CreateTithe(BaseModel):
     operation: Optional[str] = 'create'
     is_deleted: Optional[bool] = False
     created_at: Optional[datetime] = None
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -876,6 +904,7 @@ class TitheResponse(BaseModel):
     operation: str
     is_deleted: bool
     created_at: datetime
+    client_uuid: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -1440,3 +1469,54 @@ class UpdateInformation(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# ########################################### THE OFFLINE SYNC SCHEMAS #############################################
+class SyncChange(BaseModel):
+    """ *** one row created, updated or deleted since the client's last sync *** """
+
+    table: str
+    operation: Optional[str] = None
+    is_deleted: bool
+    last_modify: datetime
+    data: dict  # the full row, only the keys for a deleted row
+
+
+class SyncChanges(BaseModel):
+    """ *** one page of a sync, next_cursor is None on the last page *** """
+
+    changes: List[SyncChange]
+    next_cursor: Optional[str] = None
+    high_water: datetime  # send it back as `since` on the next sync
+
+
+class BatchItem(BaseModel):
+    """ *** what happened to one item of a batch upload *** """
+
+    index: int  # position of the item in the posted list
+    status: str  # created, replayed (already stored under its client_uuid), invalid or conflict
+    client_uuid: Optional[str] = None
+    errors: Optional[List[dict]] = None  # the validation errors of an invalid item, the reason of a conflict
+
+
+class BatchResponse(BaseModel):
+    """ *** result of a batch upload, written in one transaction *** """
+
+    detail: str
+    created: int
+    replayed: int
+    invalid: int
+    conflict: int = 0  # items whose key the user already stored with other values
+    items: List[BatchItem]
+
+
+@lru_cache(maxsize=None)
+def sparse(schema):
+    """ the response of a read route that takes ?fields=a,b,c, one row or a list of them: the schema with every field
+    optional, since only the fields asked for are returned. Used for the docs, the rows are serialized by
+    utils.rows_response """
+    model = create_model(f"Sparse{schema.__name__}", __base__=schema,
+                         **{name: (Optional[field.annotation], None) for name, field in schema.model_fields.items()})
+    model.__doc__ = (f"{schema.__name__} limited to the fields asked for with ?fields=a,b,c, every field when none "
+                     f"is given. An unknown field is a 400")
+    return Union[model, List[model]]
@@ -1,29 +1,113 @@
-from datetime import datetime, timedelta
-
+import asyncio
+import base64
+import binascii
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, date
+from typing import Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Response, status
+from fastapi.responses import ORJSONResponse
 from passlib.context import CryptContext
+from sqlalchemy import or_, false, tuple_, extract, func, cast, Date
 from sqlalchemy.orm import Session
 from . import models
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from .config import settings
+
+# min and max rounds are pinned to the configured cost so hashes made with any other cost are flagged for a rehash
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
+
+
+class HashingBusyError(RuntimeError):
+    """ raised when too many password hashes are already waiting for the hashing pool """
+
+
+class HashingPool:
+    """ a small dedicated thread pool so bcrypt never runs on the event loop or starves the default executor """
+
+    def __init__(self, workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0  # submitted and not finished yet, running or queued
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _call(self, func, args):
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusyError("Too many password operations in progress")
+            self.pending += 1
+            self.peak_queued = max(self.peak_queued, self.pending - self.running)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, func, args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "running": self.running,
+                "queued": self.pending - self.running,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+            }
+
+
+hashing_pool = HashingPool(settings.HASHING_WORKERS, settings.HASHING_MAX_PENDING)
 
 
 async def hash_password(password):
-    return pwd_context.hash(password)
+    return await hashing_pool.run(pwd_context.hash, password)
 
 
 async def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return await hashing_pool.run(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """ verify a password and return a new hash when the stored one was made with a different bcrypt cost """
+    return await hashing_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
 
 
 async def hash_answer(answer: str) -> str:
-    return pwd_context.hash(answer)
+    return await hashing_pool.run(pwd_context.hash, answer)
 
 
 async def verify_answer(stored_hash: str, answer: str) -> bool:
-    return pwd_context.verify(answer, stored_hash)
+    return await hashing_pool.run(pwd_context.verify, answer, stored_hash)
 
 
 async def create_admin_access_id(user):
+    # a stateless token already carries the access id computed at login
+    if getattr(user, "scope", None):
+        return user.scope
+
     # Check if the user has roles
     print(user)
     if not user.roles:
@@ -59,6 +143,147 @@ async def create_admin_access_id(user):
         return False
 
 
+def scope_filter(column, scope):
+    """ match the rows whose hierarchical id is the scope itself or sits below it (scope-...).
+
+    The pattern is anchored at the start of the id so PostgreSQL can serve it from the text_pattern_ops
+    index on the column, unlike ilike('%scope%') which always scans the table. """
+    if not scope:
+        return false()
+
+    escaped = scope.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return or_(column == scope, column.like(f"{escaped}-%", escape="\\"))
+
+
+def parse_date(value, name: str) -> date:
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{name} must be a YYYY-MM-DD date")
+
+
+def date_range_filter(column, start_month: Optional[int] = None, end_month: Optional[int] = None,
+                      start_year: Optional[int] = None, end_year: Optional[int] = None,
+                      from_date=None, to_date=None) -> list:
+    """ conditions for query.filter(*...) that keep the date column bare (column >= X AND column < Y) so its index
+    is used. Start month/year and end month/year are read as one continuous range, e.g. 11/2023 to 02/2024 """
+    conditions = []
+
+    try:
+        if start_year and end_year:
+            start = date(start_year, start_month if start_month and end_month else 1, 1)
+            last_month = end_month if start_month and end_month else 12
+            end = date(end_year + 1, 1, 1) if last_month == 12 else date(end_year, last_month + 1, 1)
+            conditions += [column >= start, column < end]
+        elif start_month and end_month:
+            # without a year the range repeats every year, only the month of the date can be compared
+            conditions += [extract('month', column) >= start_month, extract('month', column) <= end_month]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid month or year range")
+
+    if from_date:
+        conditions.append(column >= parse_date(from_date, "from_date"))
+    if to_date:
+        conditions.append(column <= parse_date(to_date, "to_date"))
+
+    return conditions
+
+
+def period_start(column, period: str, dialect: str):
+    """ SQL expression for the first day of the week (monday), month or year the date column falls in """
+    if dialect == "postgresql":
+        return cast(func.date_trunc(period, column), Date)
+
+    # sqlite, used for local development
+    if period == "week":
+        # move to the sunday that ends the week, then back to its monday
+        return func.date(column, "weekday 0", "-6 days")
+    return func.date(column, f"start of {period}")
+
+
+def encode_cursor(values) -> str:
+    """ opaque cursor for the sort key of the last row of a page """
+    raw = json.dumps([value.isoformat() if isinstance(value, (date, datetime)) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, columns) -> list:
+    """ the values of encode_cursor, typed like the columns (or python types) they were read from """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+
+        decoded = []
+        for column, value in zip(columns, values):
+            python_type = column if isinstance(column, type) else column.type.python_type
+            if value is not None and python_type in (date, datetime):
+                value = python_type.fromisoformat(value)
+            elif value is not None and python_type in (int, str):
+                value = python_type(value)
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def paginate(query, columns, cursor: Optional[str], offset: Optional[int], limit: Optional[int]):
+    """ newest first on the sort key (e.g. date, id), seeking past the cursor when one is given and falling back
+    to offset otherwise. The trailing id makes the order total so pages are stable while rows are being inserted """
+    query = query.order_by(*[column.desc() for column in columns])
+
+    if cursor:
+        query = query.filter(tuple_(*columns) < tuple_(*decode_cursor(cursor, columns)))
+    elif offset:
+        query = query.offset(offset)
+
+    return query.limit(limit)
+
+
+def set_next_cursor(response: Response, rows, columns, limit: Optional[int]):
+    """ expose the cursor of the following page in the X-Next-Cursor header when the page came back full """
+    if rows and limit and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+
+class FastJSONResponse(ORJSONResponse):
+    """ the default response class of the app: orjson, writing UTC datetimes with a Z as pydantic does """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def response_fields(schema, fields: Optional[str]) -> list:
+    """ the fields of a response schema asked for with ?fields=a,b,c, all of them when none is given """
+    if not fields:
+        return list(schema.model_fields)
+
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in schema.model_fields]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def response_columns(model, names: list, keyset=()) -> list:
+    """ the table columns behind the response fields, for the read routes that select rows, not objects. The sort key
+    columns follow, set_next_cursor takes the cursor from them even when they were not asked for """
+    return [model.__table__.c[name] for name in names] + [column for column in keyset if column.key not in names]
+
+
+def rows_response(response: Response, rows, names: list) -> FastJSONResponse:
+    """ serialize rows selected with response_columns as they are, keeping the named fields only. Rows read from the
+    database are trusted, so the response_model validation of every row is skipped (the route keeps response_model for
+    the docs). The headers set on the route's response, X-Next-Cursor, are carried over """
+    if isinstance(rows, list):
+        content = [dict(zip(names, row)) for row in rows]
+    else:
+        content = dict(zip(names, rows))
+    return FastJSONResponse(content, headers=dict(response.headers))
+
+
 async def generate_id(location_id: str, phone: str, db: Session):
     if location_id and phone:
         if "+" in phone:
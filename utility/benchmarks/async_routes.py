@@ -0,0 +1,160 @@
+""" What a slow read costs the other clients of the same worker: N concurrent slow reads on a sync session against
+the same reads on database.get_async_db, while one client keeps logging in and another keeps asking for the
+WebSocket user list.
+
+    python benchmarks/async_routes.py [reads] [rows]
+
+The app is served by uvicorn in this process, one worker, against a throwaway SQLite file. The slow read is a
+recursive count to [rows], the same SQL in every variant:
+
+    sync, async def   a sync Session in an async def route, as the routes were before the async engine. The query
+                      runs on the event loop and every other request of the worker waits for it
+    sync, def         a sync Session in a def route, run in the threadpool (40 threads) by FastAPI
+    get_async_db      an AsyncSession in an async def route, the event loop is free while the query runs
+
+Reported: wall time of the N reads, and the latency of the logins and user list round trips made meanwhile. The pool
+is sized above [reads]: with the default 5 + 10 connections the sync, async def variant does not return its sessions
+while the loop is blocked, and past 15 reads the next one waits DB_POOL_TIMEOUT on the loop and fails """
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("DB_POOL_SIZE", "50")  # above [reads]: the event loop is measured, not the pool
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+from fastapi import Depends  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app_package import database, models, utils  # noqa: E402
+from app_package.main import app  # noqa: E402
+
+SLOW_READ = text("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :rows) "
+                 "SELECT count(*) FROM c")
+
+
+@app.get("/benchmark/sync-async-def/")
+async def sync_async_def(rows: int, db: Session = Depends(database.get_db)):
+    return db.execute(SLOW_READ, {"rows": rows}).scalar()
+
+
+@app.get("/benchmark/sync-def/")
+def sync_def(rows: int, db: Session = Depends(database.get_db)):
+    return db.execute(SLOW_READ, {"rows": rows}).scalar()
+
+
+@app.get("/benchmark/async/")
+async def async_read(rows: int, db: AsyncSession = Depends(database.get_async_db)):
+    return (await db.execute(SLOW_READ, {"rows": rows})).scalar()
+
+
+VARIANTS = (("sync, async def", "/benchmark/sync-async-def/"), ("sync, def", "/benchmark/sync-def/"),
+            ("get_async_db", "/benchmark/async/"))
+
+
+def seed():
+    """ a user with a role, to log in and open a WebSocket """
+    with database.SessionLocal() as db:
+        role_score = models.RoleScore(score=5, score_name="state", operation="create", is_deleted=False)
+        db.add(role_score)
+        db.flush()
+        role = models.Role(role_name="state_admin", score_id=role_score.id, operation="create", is_deleted=False)
+        user = models.User(location_id="DCL-234-KW-GOI-GRP-01", user_id="KW/1", name="admin", phone="080",
+                           email="admin@example.com", password=asyncio.run(utils.hash_password("password")),
+                           is_active=True, operation="create", is_deleted=False)
+        user.roles.append(role)
+        db.add(user)
+        db.commit()
+
+
+def serve() -> str:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"127.0.0.1:{port}"
+
+
+async def logins(client: httpx.AsyncClient, done: asyncio.Event, latencies: list):
+    while not done.is_set():
+        start = time.perf_counter()
+        response = await client.post("/login/", data={"username": "admin@example.com", "password": "password"})
+        assert response.status_code == 200, response.text
+        latencies.append(time.perf_counter() - start)
+
+
+async def user_lists(host: str, token: str, done: asyncio.Event, latencies: list):
+    async with websockets.connect(f"ws://{host}/ws", extra_headers={"Authorization": f"Bearer {token}"},
+                                  ping_interval=None) as ws:  # a blocked server misses the pings
+        while not done.is_set():
+            start = time.perf_counter()
+            await ws.send("request_user_list")
+            while '"user_list"' not in await ws.recv():  # presence messages may come first
+                pass
+            latencies.append(time.perf_counter() - start)
+
+
+async def run(host: str, path: str, reads: int, rows: int, token: str) -> tuple:
+    async with httpx.AsyncClient(base_url=f"http://{host}", timeout=600) as client:
+        done, login_latencies, list_latencies = asyncio.Event(), [], []
+        traffic = [asyncio.create_task(logins(client, done, login_latencies)),
+                   asyncio.create_task(user_lists(host, token, done, list_latencies))]
+        await asyncio.sleep(0.2)  # the traffic is flowing before the reads start
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[client.get(path, params={"rows": rows}) for _ in range(reads)])
+        wall = time.perf_counter() - start
+        done.set()
+        await asyncio.gather(*traffic)
+        assert all(response.status_code == 200 and response.json() == rows for response in responses)
+    return wall, login_latencies, list_latencies
+
+
+def summary(latencies: list) -> str:
+    if not latencies:
+        return f"{'none':>24s}"
+    ms = [latency * 1000 for latency in latencies]
+    return f"{len(ms):5d} {statistics.median(ms):7.1f} ms {max(ms):8.1f} ms"
+
+
+async def main(host: str):
+    reads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 300_000
+    async with httpx.AsyncClient(base_url=f"http://{host}") as client:
+        response = await client.post("/login/", data={"username": "admin@example.com", "password": "password"})
+        token = response.json()["access_token"]
+        start = time.perf_counter()
+        await client.get("/benchmark/async/", params={"rows": rows})
+        one = time.perf_counter() - start
+
+    print(f"{reads} concurrent reads of {one * 1000:.0f} ms each, "
+          f"logins and user lists meanwhile (count, median, max)")
+    print(f"{'':16s} {'reads wall':>10s}   {'logins':>24s}   {'user lists':>24s}")
+    for name, path in VARIANTS:
+        wall, login_latencies, list_latencies = await run(host, path, reads, rows, token)
+        print(f"{name:16s} {wall * 1000:7.0f} ms   {summary(login_latencies)}   {summary(list_latencies)}")
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    database.upgrade_schema(database.engine)
+    seed()
+    asyncio.run(main(serve()))
@@ -0,0 +1,76 @@
+""" a convention-sized batch of attendance rows: the per-row ORM path the create-attendance route used to take against
+bulk.create_batch, validation and commit included.
+
+    python benchmarks/batch_attendance.py [rows]
+
+Runs on a throwaway SQLite file unless DATABASE_URL names a scratch database, 10,000 rows by default """
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, func, select  # noqa: E402
+
+from app_package import bulk, database, models, schemas  # noqa: E402
+from app_package.config import settings  # noqa: E402
+
+
+def batch(rows: int) -> list:
+    return [{"program_domain": "convention", "program_type": "ministers", "location_level": "location",
+             "location_id": f"DCL-234-S{i % 36:02d}-R{i % 7}-G{i % 5}-L{i % 11}", "date": "2024-12-22",
+             "worker_id": f"W/{i}", "name": f"worker {i}", "gender": "female" if i % 2 else "male",
+             "contact": f"080{i:08d}", "email": f"worker{i}@example.com", "unit": "ushering", "church_id": "DLBC",
+             "local_church": "headquarters", "status": "present"} for i in range(rows)]
+
+
+async def orm_path(db, items: list):
+    """ the route before the bulk path: FastAPI validated the whole list, then one ORM object per row """
+    for item in [schemas.CreateAttendance(**item) for item in items]:
+        db.add(models.Attendance(**item.dict()))
+    await db.commit()
+
+
+async def bulk_path(db, items: list):
+    await bulk.create_batch(db, schemas.CreateAttendance, models.Attendance, items)
+    await db.commit()
+
+
+async def run(path, items: list, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(models.Attendance))
+            await db.commit()
+            start = time.perf_counter()
+            await path(db, [dict(item) for item in items])
+            times.append(time.perf_counter() - start)
+            stored = (await db.execute(select(func.count()).select_from(models.Attendance))).scalar()
+            assert stored == len(items), stored
+    return statistics.median(times) * 1000
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    settings.BATCH_MAX_ITEMS = max(settings.BATCH_MAX_ITEMS, rows)
+    database.upgrade_schema(database.engine)
+    items = batch(rows)
+
+    orm = await run(orm_path, items)
+    fast = await run(bulk_path, items)
+    print(f"{database.engine.dialect.name}, {rows:,} attendance rows, median of 3")
+    print(f"per-row ORM  {orm:8.1f} ms")
+    print(f"bulk         {fast:8.1f} ms  ({orm / fast:.1f}x)")
+    await database.dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+""" CPU per request of a 1000-row /counts/read-counts/ page, before and after the orjson row fast path.
+
+    python benchmarks/read_counts.py [requests]
+
+"before" serializes the page as the route used to: ORM objects validated against schemas.CountResponse, then
+jsonable_encoder and the stdlib json encoder, without the request handling around it so the gap is understated.
+"after" is the whole route, rows through utils.rows_response. Both run in process against a throwaway SQLite file,
+the query included """
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+
+from app_package import database, models, schemas, utils  # noqa: E402
+from app_package.main import app  # noqa: E402
+
+ROWS = 1000
+
+
+def seed() -> dict:
+    """ a state admin of DCL-234-KW and ROWS counts in its scope, returns the auth headers """
+    with database.SessionLocal() as db:
+        role_score = models.RoleScore(score=5, score_name="state", operation="create", is_deleted=False)
+        db.add(role_score)
+        db.flush()
+        role = models.Role(role_name="state_admin", score_id=role_score.id, operation="create", is_deleted=False)
+        role.permissions.append(models.Permission(permission="read_count", name="read_count", operation="create",
+                                                  is_deleted=False))
+        user = models.User(location_id="DCL-234-KW-GOI-GRP-01", user_id="KW/1", name="admin", phone="080",
+                           email="admin@example.com", password=asyncio.run(utils.hash_password("password")),
+                           is_active=True, operation="create", is_deleted=False)
+        user.roles.append(role)
+        db.add(user)
+        db.execute(insert(models.Counter), [{
+            "program_domain": "church", "program_type": "sunday", "location_level": "group",
+            "location_id": "DCL-234-KW-GOI", "church_type": "DLBC", "date": date(2024, 1, 7),
+            "adult_male": 1, "adult_female": 2, "youth_male": 3, "youth_female": 4, "boys": 5, "girls": 6,
+            "total": i, "author": "benchmark", "operation": "create", "is_deleted": False} for i in range(ROWS)])
+        db.commit()
+
+    response = client.post("/login/", data={"username": "admin@example.com", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def before() -> bytes:
+    with database.SessionLocal() as db:
+        counts = db.execute(select(models.Counter).order_by(models.Counter.date.desc(), models.Counter.id.desc())
+                            .limit(ROWS)).scalars().all()
+        content = jsonable_encoder([schemas.CountResponse.model_validate(count) for count in counts])
+        return json.dumps(content).encode()
+
+
+def after() -> bytes:
+    response = client.get("/counts/read-counts/", params={"limit": ROWS, "get_all": True}, headers=headers)
+    assert response.status_code == 200 and len(response.json()) == ROWS, response.text
+    return response.content
+
+
+def cpu_per_call(function, calls: int) -> float:
+    for _ in range(5):
+        function()
+    start = time.process_time()
+    for _ in range(calls):
+        function()
+    return (time.process_time() - start) * 1000 / calls
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    database.upgrade_schema(database.engine)
+    client = TestClient(app)
+    headers = seed()
+    print(f"{ROWS} counts, CPU ms per page over {calls} pages")
+    print(f"before (validated ORM objects, stdlib json)  {cpu_per_call(before, calls):6.1f} ms")
+    print(f"after  (read-counts route, rows and orjson)  {cpu_per_call(after, calls):6.1f} ms")
@@ -0,0 +1,87 @@
+""" scoped reads of the counts table: ilike('%scope%') against the anchored prefix match of utils.scope_filter.
+
+    python benchmarks/scope_filter.py [rows]
+
+Runs on a throwaway SQLite file unless DATABASE_URL names a scratch database, the table is filled with `rows` counts
+(1,000,000 by default) spread over 36 states. SQLite only serves a LIKE prefix from a plain index with
+case_sensitive_like on, which matches PostgreSQL's case-sensitive LIKE, so the pragma is set for the run """
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, func, insert, select, text  # noqa: E402
+
+from app_package import database, models, utils  # noqa: E402
+
+engine = database.engine
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _case_sensitive_like(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA case_sensitive_like = ON")
+
+SCOPES = {"state": "DCL-234-S07", "region": "DCL-234-S07-R3", "group": "DCL-234-S07-R3-G1"}
+
+
+def fill(rows: int):
+    database.upgrade_schema(engine)
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(models.Counter)).scalar() >= rows:
+            return
+        conn.execute(models.Counter.__table__.delete())
+        start = date(2020, 1, 5)
+        for first in range(0, rows, 50000):
+            conn.execute(insert(models.Counter), [{
+                "program_domain": "church", "program_type": "sunday", "location_level": "location",
+                "location_id": f"DCL-234-S{i % 36:02d}-R{i % 7}-G{i % 5}-L{i % 11}", "church_type": "DLBC",
+                "date": start + timedelta(weeks=i % 260), "adult_male": 1, "adult_female": 1, "youth_male": 1,
+                "youth_female": 1, "boys": 1, "girls": 1, "total": 6, "author": "benchmark", "operation": "create",
+                "is_deleted": False} for i in range(first, min(first + 50000, rows))])
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def plan(conn, stmt) -> str:
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    if engine.dialect.name == "sqlite":
+        return "; ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    return "; ".join(row[0].strip() for row in conn.execute(text(f"EXPLAIN {sql}")))
+
+
+def timed(conn, stmt, repeat: int = 5):
+    conn.execute(stmt).scalar()  # warm the cache
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matched = conn.execute(stmt).scalar()
+        times.append(time.perf_counter() - start)
+    return matched, statistics.median(times) * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    start = time.perf_counter()
+    fill(rows)
+    print(f"{engine.dialect.name}, {rows:,} counts ready in {time.perf_counter() - start:.1f} s\n")
+
+    with engine.connect() as conn:
+        for level, scope in SCOPES.items():
+            for name, condition in (("ilike", models.Counter.location_id.ilike(f"%{scope}%")),
+                                    ("scope_filter", utils.scope_filter(models.Counter.location_id, scope))):
+                stmt = select(func.count()).select_from(models.Counter).filter(condition)
+                matched, ms = timed(conn, stmt)
+                print(f"{level:6s} {name:12s} {matched:8,d} rows {ms:9.1f} ms  {plan(conn, stmt)}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+""" 10,000 simulated WebSocket connections: the list-based ConnectionManager the app used to have against the indexed
+one of routers/websocket.py. Times connecting every socket, finding the sockets of a pm: recipient, and leaving a
+group then disconnecting every socket in random order.
+
+    python benchmarks/websocket_routing.py [connections]
+
+The old manager is reproduced below without its user list and count broadcasts on every connect and disconnect, so
+only the bookkeeping is compared. The indexed connect does more than the old one: it starts the socket's writer task
+and counts the device in the presence directory under every hierarchy prefix, its presence event is published once
+per interval for all the sockets that connected in it """
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_package.routers.websocket import ConnectionManager  # noqa: E402
+
+
+class ListManager:
+    """ the bookkeeping of the manager before the indexes: a list of sockets, and groups as lists """
+
+    def __init__(self):
+        self.active_connections = []
+        self.user_ids = {}
+        self.groups = {}
+
+    async def connect(self, websocket, user_id: str, location_id: str, scope=None):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+        self.user_ids[websocket] = (user_id, location_id)
+
+    async def disconnect(self, websocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+            del self.user_ids[websocket]
+
+    def sockets_of(self, user_id: str):
+        # the pm: branch of the endpoint scanned every socket for the recipient
+        return {websocket for websocket, (user, _) in self.user_ids.items() if user == user_id}
+
+    async def add_to_group(self, group_name: str, websocket):
+        self.groups.setdefault(group_name, []).append(websocket)
+
+    async def remove_from_group(self, group_name: str, websocket):
+        self.groups[group_name].remove(websocket)
+        if not self.groups[group_name]:
+            del self.groups[group_name]
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(manager, connections: int) -> tuple:
+    sockets = [FakeWebSocket() for _ in range(connections)]
+    start = time.perf_counter()
+    for i, websocket in enumerate(sockets):
+        location_id = f"DCL-234-S{i % 36:02d}-R{i % 7}-G{i % 5}"
+        await manager.connect(websocket, f"U{i}", location_id, scope=location_id)
+    connect = time.perf_counter() - start
+
+    for websocket in sockets[:connections // 2]:
+        await manager.add_to_group("ushers", websocket)
+    recipients = [f"U{random.randrange(connections)}" for _ in range(2000)]
+    start = time.perf_counter()
+    for user_id in recipients:
+        manager.sockets_of(user_id)
+    lookup = (time.perf_counter() - start) / len(recipients)
+
+    random.shuffle(sockets)
+    start = time.perf_counter()
+    for websocket in sockets:
+        if websocket in manager.groups.get("ushers", ()):
+            await manager.remove_from_group("ushers", websocket)
+        await manager.disconnect(websocket)
+    leave = time.perf_counter() - start
+    return connect * 1000, lookup * 1e6, leave * 1000
+
+
+async def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"{connections:,} connections        connect     pm lookup   leave + disconnect")
+    for name, manager in (("list (before)", ListManager()), ("indexed (after)", ConnectionManager())):
+        connect, lookup, leave = await run(manager, connections)
+        print(f"{name:22s} {connect:9.1f} ms {lookup:10.1f} us {leave:14.1f} ms")
+        if isinstance(manager, ConnectionManager):
+            await manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
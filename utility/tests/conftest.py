@@ -0,0 +1,100 @@
+""" shared fixtures: the app runs on a throwaway SQLite file, every table is emptied after each test """
+import asyncio
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="utility-tests-")
+os.environ.update({
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmp, 'test.db')}",
+    "BCRYPT_ROUNDS": "4",
+    "EXPORT_CACHE_DIR": os.path.join(_tmp, "exports"),
+    "BROKER_URL": "",
+    "DATABASE_REPLICA_URLS": "",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app_package import database, models, oauth2, utils  # noqa: E402
+from app_package.main import app  # noqa: E402
+
+LOCATION = "DCL-234-KW-GOI-GRP-01"  # a state admin (score 5) of it sees DCL-234-KW and below
+
+
+def count_values(**values) -> dict:
+    """ the fields of schemas.CreateCount, overridden by values """
+    return {"program_domain": "church", "program_type": "sunday", "location_level": "group",
+            "location_id": "DCL-234-KW-GOI", "church_type": "DLBC", "date": "2024-01-07", "adult_male": 1,
+            "adult_female": 1, "youth_male": 1, "youth_female": 1, "boys": 1, "girls": 1, "total": 6,
+            "author": "test", **values}
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def clean_tables(monkeypatch):
+    oauth2.permission_cache.invalidate()
+    monkeypatch.setattr(oauth2, "revocations", oauth2.TokenRevocations())
+    yield
+    with database.engine.begin() as conn:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    oauth2.permission_cache.invalidate()
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def login(client):
+    """ seed a user with one role holding the given permissions and return the headers of its bearer token """
+
+    def _login(*permissions, score: int = 5, location_id: str = LOCATION, email: str = "admin@example.com"):
+        session = database.SessionLocal()
+        try:
+            role_score = session.query(models.RoleScore).filter(models.RoleScore.score == score).first()
+            if role_score is None:
+                role_score = models.RoleScore(score=score, score_name=f"score {score}", operation="create",
+                                              is_deleted=False)
+                session.add(role_score)
+                session.flush()
+            role = models.Role(role_name=f"role_{email}", score_id=role_score.id, operation="create",
+                               is_deleted=False)
+            for name in permissions:
+                permission = session.query(models.Permission).filter(models.Permission.permission == name).first()
+                role.permissions.append(permission or models.Permission(permission=name, name=name,
+                                                                        operation="create", is_deleted=False))
+            user_id = f"KW/{email}"
+            session.add(models.Workers(user_id=user_id, location_id=location_id, location="church",
+                                       church_type="DLBC", state_="kw", region="region", group="group", name="name",
+                                       gender="male", phone=email, email=email, unit="unit", operation="create",
+                                       is_deleted=False))
+            user = models.User(location_id=location_id, user_id=user_id, name="name", phone=email, email=email,
+                               password=asyncio.run(utils.hash_password("password")), is_active=True,
+                               operation="create", is_deleted=False)
+            user.roles.append(role)
+            session.add(user)
+            session.commit()
+        finally:
+            session.close()
+
+        response = client.post("/login/", data={"username": email, "password": "password"})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return _login
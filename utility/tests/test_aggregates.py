@@ -0,0 +1,72 @@
+""" count_aggregates is kept in step with the counts table: the stored rollup equals the fresh sum after every write """
+import pytest
+
+from app_package import models
+from .conftest import count_values
+
+LEVELS = ["state", "region", "group", "location"]
+PERIODS = ["week", "month", "year"]
+
+
+@pytest.fixture
+def headers(login):
+    return login("read_count", "update_count", "delete_count")
+
+
+def _create(client, headers, **values) -> int:
+    response = client.post("/counts/create-counts/", json=count_values(**values), headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def _assert_rollups_match(client, headers):
+    for level in LEVELS:
+        for period in PERIODS:
+            params = {"level": level, "period": period}
+            stored = client.get("/counts/rollup/", params=params, headers=headers)
+            fresh = client.get("/counts/rollup/", params={**params, "fresh": True}, headers=headers)
+            assert stored.status_code == fresh.status_code == 200, stored.text
+            assert stored.json() == fresh.json(), (level, period)
+
+
+def _records(client, headers, **params) -> dict:
+    rows = client.get("/counts/rollup/", params=params, headers=headers).json()
+    return {row["node_id"]: (row["records"], row["total"]) for row in rows}
+
+
+@pytest.fixture
+def counts(client, headers, db):
+    ids = [_create(client, headers, location_id="DCL-234-KW-GOI-GRP-01", total=10),
+           _create(client, headers, location_id="DCL-234-KW-GOI-GRP-02", date="2024-01-14", total=20),
+           _create(client, headers, location_id="DCL-234-KW-ILR-GRP-01", date="2024-02-04", total=30)]
+    assert db.query(models.CountAggregate).count() > 0  # the stored rollups below read these rows
+    _assert_rollups_match(client, headers)
+    return ids
+
+
+def test_value_change_moves_the_totals(client, headers, counts):
+    response = client.patch("/counts/update-counts/", params={"count_id": counts[0]}, headers=headers,
+                            json={"date": "2024-01-07", "total": 15, "boys": 9})
+
+    assert response.status_code == 200, response.text
+    _assert_rollups_match(client, headers)
+    assert _records(client, headers, level="region")["DCL-234-KW-GOI"] == (2, 35)
+
+
+def test_location_and_date_move_the_count_between_nodes(client, headers, counts):
+    response = client.patch("/counts/update-counts/", params={"count_id": counts[1]}, headers=headers,
+                            json={"date": "2024-02-11", "location_id": "DCL-234-KW-ILR-GRP-03"})
+
+    assert response.status_code == 200, response.text
+    _assert_rollups_match(client, headers)
+    assert _records(client, headers, level="region", period="year") == {"DCL-234-KW-GOI": (1, 10),
+                                                                         "DCL-234-KW-ILR": (2, 50)}
+    assert "DCL-234-KW-GOI-GRP-02" not in _records(client, headers, level="group")
+
+
+def test_delete_takes_the_count_out(client, headers, counts):
+    response = client.delete("/counts/delete-counts/", params={"_id": counts[2]}, headers=headers)
+
+    assert response.status_code == 204
+    _assert_rollups_match(client, headers)
+    assert _records(client, headers, level="state", period="year") == {"DCL-234-KW": (2, 30)}
@@ -0,0 +1,51 @@
+""" the batch create routes: items are validated one by one and each upload is written and counted once """
+from app_package import models
+from app_package.config import settings
+from .conftest import count_values
+
+
+def test_invalid_items_are_reported_and_the_rest_saved(client, login, db):
+    headers = login("read_count")
+    response = client.post("/counts/create-counts/batch/", headers=headers,
+                           json=[count_values(), count_values(total="many"), count_values()])
+
+    assert response.status_code == 201, response.text
+    body = response.json()
+    assert (body["created"], body["replayed"], body["invalid"]) == (2, 0, 1)
+    assert [item["status"] for item in body["items"]] == ["created", "invalid", "created"]
+    assert body["items"][1]["errors"][0]["loc"] == ["total"]
+    assert db.query(models.Counter).count() == 2
+
+
+def test_batch_without_a_valid_item_is_rejected(client, login, db):
+    headers = login("read_count")
+    response = client.post("/counts/create-counts/batch/", json=[{"total": 1}], headers=headers)
+
+    assert response.status_code == 422
+    assert db.query(models.Counter).count() == 0
+
+
+def test_client_uuid_repeated_in_one_batch_is_written_once(client, login, db):
+    headers = login("read_count")
+    batch = [count_values(client_uuid="a", boys=1), count_values(client_uuid="b"),
+             count_values(client_uuid="a", boys=1), count_values(client_uuid="a", boys=99)]
+
+    response = client.post("/counts/create-counts/batch/", json=batch, headers=headers)
+
+    body = response.json()
+    assert (body["created"], body["replayed"], body["conflict"]) == (2, 1, 1)
+    assert [item["status"] for item in body["items"]] == ["created", "created", "replayed", "conflict"]
+    assert db.query(models.Counter).filter(models.Counter.client_uuid.like("%:a")).one().boys == 1
+
+    stored = client.get("/counts/rollup/", headers=headers).json()
+    fresh = client.get("/counts/rollup/", params={"fresh": True}, headers=headers).json()
+    assert stored == fresh
+    assert [(row["records"], row["boys"]) for row in stored] == [(2, 2)]
+
+
+def test_oversized_batch_is_refused(client, login, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_MAX_ITEMS", 2)
+    headers = login("read_count")
+
+    response = client.post("/counts/create-counts/batch/", json=[count_values()] * 3, headers=headers)
+    assert response.status_code == 413
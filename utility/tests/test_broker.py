@@ -0,0 +1,286 @@
+""" the WebSocket fan-out across processes: two or three ConnectionManagers share a RedisBroker whose client is a
+local stand-in for Redis pub/sub, each manager playing one worker """
+import asyncio
+import json
+
+import pytest
+
+from app_package import models
+from app_package.broker import InMemoryBroker, RedisBroker
+from app_package.config import settings
+from app_package.routers.websocket import ConnectionManager, manager
+from .conftest import count_values
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = set()
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+        self.redis.subscribers.append(self)
+
+    async def listen(self):
+        yield {"type": "subscribe", "channel": b"ignored", "data": 1}
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        self.redis.subscribers.remove(self)
+
+
+class FakeRedis:
+    """ PUBLISH/SUBSCRIBE of one Redis server: every subscriber of the channel gets the message, the publisher too """
+
+    def __init__(self):
+        self.subscribers = []
+        self.lost = lambda data: False  # drop the messages it matches, to simulate a dropped connection
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def publish(self, channel, data):
+        if self.lost(data):
+            return
+        for subscriber in self.subscribers:
+            if channel in subscriber.channels:
+                subscriber.queue.put_nowait({"type": "message", "channel": channel.encode(), "data": data.encode()})
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code=1000):
+        pass
+
+    def received(self, kind):
+        return [message for message in self.sent if message.get("type") == kind]
+
+
+async def until(predicate, timeout: float = 2):
+    """ wait for the broker readers and writer tasks to deliver """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def fast_presence(monkeypatch):
+    monkeypatch.setattr(settings, "PRESENCE_INTERVAL_SECONDS", 0.02)
+    monkeypatch.setattr(settings, "PRESENCE_HEARTBEAT_SECONDS", 0.1)
+
+
+def test_in_memory_broker_calls_every_handler():
+    async def scenario():
+        broker, received = InMemoryBroker(), []
+
+        async def handler(data):
+            received.append(data)
+
+        await broker.subscribe("websocket", handler)
+        await broker.subscribe("websocket", handler)
+        await broker.publish("websocket", "hello")
+        await broker.publish("other", "ignored")
+        return received
+
+    assert asyncio.run(scenario()) == ["hello", "hello"]
+
+
+def test_scoped_notification_reaches_the_other_worker():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        kwara, lagos, national = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await first.connect(kwara, "KW/1", "DCL-234-KW-GOI", scope="DCL-234-KW")
+        await second.connect(lagos, "LA/1", "DCL-234-LA-IKJ", scope="DCL-234-LA")
+        await second.connect(national, "NG/1", "DCL-234", scope="DCL-234")
+
+        await first.publish(json.dumps({"type": "notification", "note": "kwara"}), "DCL-234-KW-GOI-GRP-01")
+        await second.broadcast(json.dumps({"type": "broadcast", "message": "all"}))
+        await until(lambda: len(kwara.received("broadcast")) == len(lagos.received("broadcast")) == 1)
+        await until(lambda: national.received("notification"))
+
+        assert kwara.received("notification") == [{"type": "notification", "note": "kwara"}]
+        assert lagos.received("notification") == []
+        assert len(national.received("broadcast")) == 1
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_personal_and_group_messages_cross_workers():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        sender, phone, laptop = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await first.connect(sender, "KW/1", "DCL-234-KW-GOI", scope="DCL-234-KW")
+        await second.connect(phone, "LA/1", "DCL-234-LA-IKJ")
+        await first.connect(laptop, "LA/1", "DCL-234-LA-IKJ")  # the same user on both workers
+        await until(lambda: first.is_online("LA/1") and second.is_online("KW/1"))
+        assert not first.is_online("nobody")
+
+        await first.send_to_user("LA/1", json.dumps({"type": "personal_message", "message": "hi"}))
+        await until(lambda: phone.received("personal_message") and laptop.received("personal_message"))
+        assert sender.received("personal_message") == []
+
+        await first.add_to_group("ushers", sender)
+        await second.add_to_group("ushers", phone)
+        await second.broadcast_to_group("ushers", json.dumps({"type": "group_message", "message": "meet"}))
+        await until(lambda: sender.received("group_message") and phone.received("group_message"))
+        assert laptop.received("group_message") == []
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_presence_and_user_list_cover_every_worker():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        admin, phone, laptop = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await first.connect(admin, "NG/1", "DCL-234", scope="DCL-234")
+        await second.connect(phone, "LA/1", "DCL-234-LA-IKJ")
+        await second.connect(laptop, "LA/1", "DCL-234-LA-IKJ")
+        await until(lambda: any("LA/1@DCL-234-LA-IKJ" in message["joined"]
+                                for message in admin.received("presence")))
+        assert admin.received("presence")[-1]["count"] == 3
+
+        await first.send_user_list(admin)
+        await until(lambda: admin.received("user_list"))
+        assert admin.received("user_list")[-1]["users"] == ["LA/1@DCL-234-LA-IKJ", "NG/1@DCL-234"]
+
+        # the user stays online while one device is left, and leaves with the last one
+        await second.disconnect(phone)
+        await until(lambda: first.devices_under.get("DCL-234") == 2)
+        assert first.is_online("LA/1")
+        await second.disconnect(laptop)
+        await until(lambda: not first.is_online("LA/1"))
+        await until(lambda: any("LA/1@DCL-234-LA-IKJ" in message["left"] for message in admin.received("presence")))
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_late_worker_and_lost_events_are_repaired_by_snapshots():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        await first.connect(FakeWebSocket(), "KW/1", "DCL-234-KW-GOI")
+
+        # second subscribes after KW/1 connected, it learns about it from the snapshot answering its sync
+        await second.connect(FakeWebSocket(), "LA/1", "DCL-234-LA-IKJ")
+        await until(lambda: second.is_online("KW/1") and first.is_online("LA/1"))
+
+        # a presence event of second never arrives, the next one reveals the gap and a snapshot fills it
+        redis.lost = lambda data: '"to": "presence"' in data and '"LA/2"' in data
+        seq = second.seq
+        await second.connect(FakeWebSocket(), "LA/2", "DCL-234-LA-IKJ")
+        await until(lambda: second.seq == seq + 1)
+        redis.lost = lambda data: False
+        await second.connect(FakeWebSocket(), "LA/3", "DCL-234-LA-IKJ")
+        await until(lambda: first.is_online("LA/2") and first.is_online("LA/3"))
+        assert first.stats()["online_users"] == 4
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_connect_storm_is_published_as_one_presence_event():
+    async def scenario():
+        redis, published = FakeRedis(), []
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        admin = FakeWebSocket()
+        await first.connect(admin, "NG/1", "DCL-234", scope="DCL-234")
+        await second.connect(FakeWebSocket(), "LA/0", "DCL-234-LA-IKJ")
+        await until(lambda: first.is_online("LA/0"))
+
+        redis.lost = lambda data: published.append(json.loads(data)) or False
+        for i in range(1, 51):
+            await second.connect(FakeWebSocket(), f"LA/{i}", "DCL-234-LA-IKJ")
+        await until(lambda: first.stats()["online_users"] == 52)
+
+        events = [envelope for envelope in published if envelope["to"] == "presence"]
+        assert len(events) == 1 and len(events[0]["changes"]) == 50
+        await until(lambda: admin.received("presence") and admin.received("presence")[-1]["count"] == 52)
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_users_of_a_worker_that_leaves_or_dies_go_offline():
+    async def scenario():
+        redis = FakeRedis()
+        first, second, third = (ConnectionManager(RedisBroker(redis)) for _ in range(3))
+        await first.connect(FakeWebSocket(), "KW/1", "DCL-234-KW-GOI")
+        await second.connect(FakeWebSocket(), "LA/1", "DCL-234-LA-IKJ")
+        await third.connect(FakeWebSocket(), "OY/1", "DCL-234-OY-OGB")
+        await until(lambda: first.is_online("LA/1") and first.is_online("OY/1"))
+
+        # a clean shutdown says bye
+        await third.close()
+        await until(lambda: not first.is_online("OY/1"))
+
+        # a crash says nothing, the missing heartbeats drop its users after three beats
+        second._heartbeat.cancel()
+        await second.broker.close()
+        await until(lambda: not first.is_online("LA/1"), timeout=3)
+        assert first.stats()["nodes"] == 1
+        await first.close()
+
+    asyncio.run(scenario())
+
+
+def test_broker_outage_does_not_fail_a_committed_write(client, login, db, monkeypatch):
+    async def unavailable(channel, data):
+        raise ConnectionError("Connection refused")
+
+    monkeypatch.setattr(manager.broker, "publish", unavailable)
+    failures = manager.publish_failures
+    headers = login("read_count")
+
+    single = client.post("/counts/create-counts/", json=count_values(), headers=headers)
+    batch = client.post("/counts/create-counts/batch/", json=[count_values(), count_values()], headers=headers)
+
+    assert single.status_code == batch.status_code == 201
+    assert db.query(models.Counter).count() == 3
+    assert manager.publish_failures == failures + 2
+
+
+def test_viewers_get_a_scoped_snapshot_every_few_heartbeats(monkeypatch):
+    monkeypatch.setattr(settings, "PRESENCE_SNAPSHOT_BEATS", 2)
+
+    async def scenario():
+        redis = FakeRedis()
+        first, second = ConnectionManager(RedisBroker(redis)), ConnectionManager(RedisBroker(redis))
+        kwara, lagos = FakeWebSocket(), FakeWebSocket()
+        await first.connect(kwara, "KW/1", "DCL-234-KW-GOI", scope="DCL-234-KW")
+        await second.connect(lagos, "LA/1", "DCL-234-LA-IKJ", scope="DCL-234-LA")
+        await second.connect(FakeWebSocket(), "KW/2", "DCL-234-KW-ILR")
+
+        # a lost delta is repaired by the next snapshot without the viewer asking
+        kwara.sent.clear()
+        await until(lambda: kwara.received("presence_snapshot"), timeout=3)
+        assert kwara.received("presence_snapshot")[-1] == {
+            "type": "presence_snapshot", "users": ["KW/1@DCL-234-KW-GOI", "KW/2@DCL-234-KW-ILR"],
+            "resync": False, "count": 2}
+        await until(lambda: lagos.received("presence_snapshot"), timeout=3)
+        assert lagos.received("presence_snapshot")[-1]["users"] == ["LA/1@DCL-234-LA-IKJ"]
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+""" the Arrow and Parquet exports: the cache key follows the statement and the version of its rows, and the cache is
+pruned by last use. The file tests need pyarrow """
+import asyncio
+import os
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app_package import columnar, models, utils
+from app_package.config import settings
+from app_package.database import async_database_url
+from .conftest import count_values
+
+
+def _version(conditions):
+    async def read():
+        engine = create_async_engine(async_database_url(settings.DATABASE_URL))
+        try:
+            async with async_sessionmaker(engine)() as session:
+                return await columnar.rows_version(session, models.Counter, conditions)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(read())
+
+
+def _add(db, **values):
+    row = models.Counter(**count_values(date=date(2024, 1, 7), **values), operation="create", is_deleted=False)
+    db.add(row)
+    db.commit()
+    return row
+
+
+def test_rows_version_moves_with_every_write(db):
+    scope = [utils.scope_filter(models.Counter.location_id, "DCL-234-KW"), models.Counter.is_deleted == False]
+    row = _add(db)
+    versions = [_version(scope)]
+
+    _add(db, location_id="DCL-234-LA-IKJ")  # outside the scope
+    versions.append(_version(scope))
+    assert versions[-1] == versions[0]
+
+    _add(db)
+    versions.append(_version(scope))
+
+    row.is_deleted = True
+    db.commit()
+    versions.append(_version(scope))
+    assert len(set(versions)) == 3
+
+
+def test_cache_path_follows_statement_and_version():
+    def stmt(scope):
+        return select(models.Counter.total).filter(utils.scope_filter(models.Counter.location_id, scope))
+
+    path = columnar.cache_path(stmt("DCL-234-KW"), "1:2024:1", "arrow")
+    assert path == columnar.cache_path(stmt("DCL-234-KW"), "1:2024:1", "arrow")
+    assert path.startswith(settings.EXPORT_CACHE_DIR) and path.endswith(".arrow")
+    assert path != columnar.cache_path(stmt("DCL-234-LA"), "1:2024:1", "arrow")
+    assert path != columnar.cache_path(stmt("DCL-234-KW"), "2:2024:2", "arrow")
+    assert path[:-6] == columnar.cache_path(stmt("DCL-234-KW"), "1:2024:1", "parquet")[:-8]
+
+
+def test_prune_drops_the_least_recently_served(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EXPORT_CACHE_MAX_MB", 1)
+    for age, name in enumerate(["new", "old", "keep"]):
+        (tmp_path / name).write_bytes(b"x" * 600 * 1024)
+        os.utime(tmp_path / name, (1000 - age * 100, 1000 - age * 100))
+
+    columnar.prune_cache(keep=str(tmp_path / "keep"))
+    assert sorted(os.listdir(tmp_path)) == ["keep", "new"]
+
+
+def test_columnar_formats_need_pyarrow(client, login, monkeypatch):
+    monkeypatch.setattr(columnar, "pa", None)
+    headers = login("read_count")
+    response = client.get("/export/counts/", params={"format": "parquet"}, headers=headers)
+    assert response.status_code == 501
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+def test_repeated_pull_is_served_from_the_cache(client, login, db, format):
+    pytest.importorskip("pyarrow")
+    headers = login("read_count")
+    _add(db, total=1)
+
+    first = client.get("/export/counts/", params={"format": format}, headers=headers)
+    assert first.status_code == 200, first.text
+    files = os.listdir(settings.EXPORT_CACHE_DIR)
+    again = client.get("/export/counts/", params={"format": format}, headers=headers)
+    assert again.content == first.content
+    assert os.listdir(settings.EXPORT_CACHE_DIR) == files
+
+    _add(db, total=2)
+    client.get("/export/counts/", params={"format": format}, headers=headers)
+    assert len(os.listdir(settings.EXPORT_CACHE_DIR)) == len(files) + 1
+
+
+def test_prune_keeps_files_served_within_the_grace_period(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EXPORT_CACHE_MAX_MB", 1)
+    for name in ("served", "keep"):
+        (tmp_path / name).write_bytes(b"x" * 600 * 1024)
+
+    columnar.prune_cache(keep=str(tmp_path / "keep"))
+    assert sorted(os.listdir(tmp_path)) == ["keep", "served"]
+
+
+def test_prune_skips_files_another_worker_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EXPORT_CACHE_MAX_MB", 1)
+    for age, name in enumerate(["new", "old", "older", "keep"]):
+        (tmp_path / name).write_bytes(b"x" * 600 * 1024)
+        os.utime(tmp_path / name, (1000 - age * 100, 1000 - age * 100))
+
+    remove = os.remove
+
+    def raced(path):
+        remove(path)
+        if path.endswith("older"):
+            raise FileNotFoundError(path)  # the other worker got there first
+
+    monkeypatch.setattr(columnar.os, "remove", raced)
+    columnar.prune_cache(keep=str(tmp_path / "keep"))
+    assert sorted(os.listdir(tmp_path)) == ["keep", "new"]
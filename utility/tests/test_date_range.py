@@ -0,0 +1,58 @@
+""" utils.date_range_filter: continuous month/year ranges that keep the date column indexable """
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, text
+
+from app_package import database, models, utils
+from .conftest import count_values
+
+
+def _dates(db, *args):
+    stmt = select(models.Counter.date).filter(*utils.date_range_filter(models.Counter.date, *args))
+    return sorted(db.execute(stmt).scalars())
+
+
+@pytest.fixture
+def counts(db):
+    for day in (date(2023, 10, 31), date(2023, 11, 1), date(2024, 2, 29), date(2024, 3, 1)):
+        db.add(models.Counter(**count_values(date=day), operation="create", is_deleted=False))
+    db.commit()
+
+
+def test_month_range_across_a_year_boundary(db, counts):
+    assert _dates(db, 11, 2, 2023, 2024) == [date(2023, 11, 1), date(2024, 2, 29)]
+
+
+def test_years_without_months_cover_whole_years(db, counts):
+    assert _dates(db, None, None, 2024, 2024) == [date(2024, 2, 29), date(2024, 3, 1)]
+
+
+def test_from_and_to_date_are_inclusive(db, counts):
+    assert _dates(db, None, None, None, None, "2023-11-01", "2024-03-01") == [
+        date(2023, 11, 1), date(2024, 2, 29), date(2024, 3, 1)]
+
+
+def test_invalid_input_is_a_400():
+    with pytest.raises(HTTPException) as error:
+        utils.date_range_filter(models.Counter.date, from_date="01/11/2023")
+    assert error.value.status_code == 400
+
+    with pytest.raises(HTTPException) as error:
+        utils.date_range_filter(models.Counter.date, 13, 2, 2023, 2024)
+    assert error.value.status_code == 400
+
+
+def test_range_is_served_by_the_date_index(db):
+    stmt = select(models.Counter.id).filter(*utils.date_range_filter(models.Counter.date, 11, 2, 2023, 2024))
+    compiled = stmt.compile(database.engine, compile_kwargs={"literal_binds": True})
+    plan = " ".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "USING INDEX" in plan or "USING COVERING INDEX" in plan, plan
+    assert "date" in plan
+
+
+def test_bad_date_on_a_route_is_a_400(client, login):
+    headers = login("read_count")
+    response = client.get("/counts/read-counts/", params={"from_date": "2024-13-01"}, headers=headers)
+    assert response.status_code == 400, response.text
@@ -0,0 +1,82 @@
+""" the CSV and NDJSON exports: streamed in EXPORT_BATCH chunks, limited to the caller's scope and projected """
+import csv
+import io
+import json
+from datetime import date
+
+import pytest
+
+from app_package import models
+from app_package.config import settings
+from .conftest import count_values
+
+
+@pytest.fixture
+def counts(db, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_BATCH", 2)  # several chunks for a handful of rows
+    rows = [count_values(location_id="DCL-234-KW-GOI", date=f"2024-01-0{day}", total=day) for day in range(1, 6)]
+    rows += [count_values(location_id="DCL-234-KW-ILR", date="2024-02-01", total=10),
+             count_values(location_id="DCL-234-KWA-OFA", date="2024-01-01", total=100),  # KW is not a prefix of it
+             count_values(location_id="DCL-234-LA-IKJ", date="2024-01-01", total=200)]
+    for row in rows:
+        db.add(models.Counter(**{**row, "date": date.fromisoformat(row["date"])}, operation="create", is_deleted=False))
+    db.add(models.Counter(**count_values(date=date(2024, 1, 6), total=300), operation="delete", is_deleted=True))
+    db.commit()
+
+
+def _csv(response):
+    return list(csv.DictReader(io.StringIO(response.text)))
+
+
+def test_csv_streams_the_rows_of_the_scope(client, login, counts):
+    headers = login("read_count")
+    response = client.get("/export/counts/", params={"format": "csv"}, headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="counts.csv"'
+    assert response.text.count("program_domain") == 1  # one header across the chunks
+    rows = _csv(response)
+    assert [int(row["total"]) for row in rows] == [1, 2, 3, 4, 5, 10]
+    assert {row["location_id"] for row in rows} == {"DCL-234-KW-GOI", "DCL-234-KW-ILR"}
+
+
+def test_ndjson_streams_one_object_per_line(client, login, counts):
+    headers = login("read_count")
+    response = client.get("/export/counts/", params={"format": "ndjson", "from_date": "2024-01-04"},
+                          headers=headers)
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["date"], row["total"]) for row in rows] == [("2024-01-04", 4), ("2024-01-05", 5),
+                                                             ("2024-02-01", 10)]
+
+
+def test_location_id_narrows_the_export(client, login, counts):
+    headers = login("read_count")
+    narrowed = client.get("/export/counts/", params={"location_id": "DCL-234-KW-ILR"}, headers=headers)
+    outside = client.get("/export/counts/", params={"location_id": "DCL-234-LA"}, headers=headers)
+
+    assert [row["total"] for row in _csv(narrowed)] == ["10"]
+    assert outside.text.strip() == ",".join(column.key for column in models.Counter.__table__.columns)
+
+
+def test_columns_are_projected(client, login, counts):
+    headers = login("read_count")
+    response = client.get("/export/counts/", params={"format": "ndjson", "columns": "date, total"},
+                          headers=headers)
+
+    assert json.loads(response.text.splitlines()[0]) == {"date": "2024-01-01", "total": 1}
+
+
+def test_unknown_column_is_a_400(client, login, counts):
+    headers = login("read_count")
+    response = client.get("/export/counts/", params={"columns": "total,password"}, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown columns: password"
+
+
+def test_export_needs_the_read_permission(client, login, counts):
+    headers = login("read_record")
+    assert client.get("/export/counts/", headers=headers).status_code == 403
@@ -0,0 +1,111 @@
+""" uploads carrying a client_uuid or an Idempotency-Key are written and counted once, however often they are sent """
+from app_package import models
+from .conftest import count_values
+
+
+def _stored(db):
+    return db.query(models.Counter).count()
+
+
+def _records(client, headers, **params):
+    response = client.get("/counts/rollup/", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return sum(row["records"] for row in response.json())
+
+
+def test_retried_count_is_replayed(client, login, db):
+    headers = login("read_count")
+    body = count_values(client_uuid="phone-1:count-1")
+
+    first = client.post("/counts/create-counts/", json=body, headers=headers)
+    retry = client.post("/counts/create-counts/", json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+    assert _stored(db) == 1
+    assert _records(client, headers) == _records(client, headers, fresh=True) == 1
+
+
+def test_idempotency_key_stands_in_for_client_uuid(client, login, db):
+    headers = login("read_count")
+    keyed = {**headers, "Idempotency-Key": "retry-7"}
+
+    first = client.post("/counts/create-counts/", json=count_values(), headers=keyed)
+    retry = client.post("/counts/create-counts/", json=count_values(), headers=keyed)
+    other = client.post("/counts/create-counts/", json=count_values(), headers=headers)
+
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+    assert other.json()["id"] != first.json()["id"]
+    assert _stored(db) == 2
+
+
+def test_replayed_batch_writes_nothing(client, login, db):
+    headers = login("read_count")
+    keyed = {**headers, "Idempotency-Key": "batch-1"}
+    batch = [count_values(date="2024-01-07"), count_values(date="2024-01-14"),
+             count_values(date="2024-01-21", client_uuid="own-key")]
+
+    first = client.post("/counts/create-counts/batch/", json=batch, headers=keyed)
+    retry = client.post("/counts/create-counts/batch/", json=batch, headers=keyed)
+
+    assert (first.json()["created"], first.json()["replayed"]) == (3, 0)
+    assert (retry.json()["created"], retry.json()["replayed"]) == (0, 3)
+    assert [item["client_uuid"] for item in retry.json()["items"]] == ["batch-1:0", "batch-1:1", "own-key"]
+    assert _stored(db) == 3
+    assert _records(client, headers) == _records(client, headers, fresh=True) == 3
+
+
+def test_partly_stored_batch_writes_the_rest(client, login, db):
+    headers = login("read_count")
+    client.post("/counts/create-counts/", json=count_values(client_uuid="a"), headers=headers)
+
+    response = client.post("/counts/create-counts/batch/", headers=headers,
+                           json=[count_values(client_uuid="a"), count_values(client_uuid="b")])
+
+    assert [item["status"] for item in response.json()["items"]] == ["replayed", "created"]
+    assert _stored(db) == 2
+
+
+def test_another_user_reusing_a_key_gets_its_own_row(client, login, db):
+    kwara = login("read_count")
+    other = login("read_count", location_id="DCL-999-ZZ-AA-GRP-01", email="other@example.com")
+
+    first = client.post("/counts/create-counts/", json=count_values(client_uuid="1", total=6), headers=kwara)
+    second = client.post("/counts/create-counts/", headers=other,
+                         json=count_values(client_uuid="1", location_id="DCL-999-ZZ-AA", total=7))
+
+    assert second.status_code == 201, second.text
+    assert "Idempotent-Replayed" not in second.headers
+    assert second.json()["id"] != first.json()["id"]
+    assert second.json()["location_id"] == "DCL-999-ZZ-AA"
+    assert _stored(db) == 2
+
+
+def test_key_reused_for_a_different_upload_is_a_409(client, login, db):
+    headers = login("read_count")
+    client.post("/counts/create-counts/", json=count_values(client_uuid="1", total=6), headers=headers)
+
+    response = client.post("/counts/create-counts/", json=count_values(client_uuid="1", total=9), headers=headers)
+
+    assert response.status_code == 409
+    assert db.query(models.Counter).one().total == 6
+
+
+def test_batch_reports_a_key_reused_for_a_different_upload(client, login, db):
+    headers = login("read_count")
+    other = login("read_count", location_id="DCL-999-ZZ-AA-GRP-01", email="other@example.com")
+    client.post("/counts/create-counts/", json=count_values(client_uuid="a", total=6), headers=headers)
+
+    response = client.post("/counts/create-counts/batch/", headers=headers,
+                           json=[count_values(client_uuid="a", total=9), count_values(client_uuid="b"),
+                                 count_values(client_uuid="b", total=8)])
+    shared = client.post("/counts/create-counts/batch/", headers=other, json=[count_values(client_uuid="a")])
+
+    body = response.json()
+    assert [item["status"] for item in body["items"]] == ["conflict", "created", "conflict"]
+    assert (body["created"], body["replayed"], body["conflict"]) == (1, 0, 2)
+    assert shared.json()["items"][0]["status"] == "created"
+    assert _stored(db) == 3
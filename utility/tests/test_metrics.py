@@ -0,0 +1,13 @@
+""" the /metrics/ route is open to the administrators of roles and permissions """
+
+
+def test_metrics_for_a_permission_administrator(client, login):
+    response = client.get("/metrics/", headers=login("read_permission"))
+
+    assert response.status_code == 200, response.text
+    assert {"permission_cache", "password_hashing", "database_pool", "read_replicas", "websocket"} <= set(
+        response.json())
+
+
+def test_metrics_refused_to_other_users(client, login):
+    assert client.get("/metrics/", headers=login("read_count")).status_code == 403
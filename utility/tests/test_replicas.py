@@ -0,0 +1,103 @@
+""" ReplicaSet: replica selection, lag and reachability checks and the fallback to the primary. Local SQLite files
+stand in for the replicas, they always report a lag of 0 so the lagging case sets it by hand """
+import os
+
+import pytest
+from sqlalchemy import exc, text
+
+from app_package import database, models
+
+
+@pytest.fixture
+def replica_urls(tmp_path):
+    return [f"sqlite:///{tmp_path / name}" for name in ("replica_a.db", "replica_b.db")]
+
+
+@pytest.fixture
+def replica_set(replica_urls):
+    replicas = database.ReplicaSet(replica_urls, "round_robin", max_lag=10, check_seconds=60)
+    replicas.check()
+    yield replicas
+    for replica in replicas.replicas:
+        replica.engine.dispose()
+
+
+def test_check_measures_every_replica(replica_set):
+    assert [replica.lag for replica in replica_set.replicas] == [0.0, 0.0]
+    assert [replica.error for replica in replica_set.replicas] == [None, None]
+    assert not replica_set.needs_check()
+
+
+def test_round_robin_alternates(replica_set):
+    first, second = replica_set.replicas
+    picked = []
+    for _ in range(4):
+        replica = replica_set.acquire()
+        picked.append(replica)
+        replica_set.release(replica)
+    assert picked == [first, second, first, second]
+    assert replica_set.primary_reads == 0
+
+
+def test_least_loaded_skips_the_busy_replica(replica_set):
+    replica_set.selection = "least_loaded"
+    busy = replica_set.acquire()
+    for _ in range(3):
+        replica = replica_set.acquire()
+        assert replica is not busy
+        replica_set.release(replica)
+    assert busy.in_use == 1
+
+
+def test_lagging_replica_is_skipped(replica_set):
+    lagging, fresh = replica_set.replicas
+    lagging.lag = 30
+    assert {replica_set.acquire() for _ in range(4)} == {fresh}
+
+
+def test_no_fresh_replica_reads_from_the_primary(replica_set):
+    for replica in replica_set.replicas:
+        replica.lag = 30
+    assert replica_set.acquire() is None
+    assert replica_set.primary_reads == 1
+
+
+def test_unreachable_replica_records_the_error(tmp_path, replica_urls):
+    missing = f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    replicas = database.ReplicaSet([replica_urls[0], missing], "round_robin", max_lag=10, check_seconds=60)
+    replicas.check()
+
+    reachable, unreachable = replicas.replicas
+    assert unreachable.lag is None and "unable to open database file" in unreachable.error
+    assert replicas.acquire() is reachable
+    assert replicas.stats()["replicas"][1]["error"] == unreachable.error
+
+    # the error is cleared once the replica answers again
+    os.mkdir(tmp_path / "missing")
+    unreachable.checked_at = 0
+    replicas.check()
+    assert unreachable.lag == 0 and unreachable.error is None
+
+
+def test_read_db_uses_the_replica_and_refuses_writes(monkeypatch, replica_set):
+    monkeypatch.setattr(database, "replicas", replica_set)
+    reads = database.get_read_db()
+    db = next(reads)
+    assert db.get_bind().url.database == replica_set.replicas[0].engine.url.database
+    assert db.execute(text("SELECT 1")).scalar() == 1
+
+    db.add(models.RoleScore(score=1, score_name="group", operation="create", is_deleted=False))
+    with pytest.raises(exc.InvalidRequestError):
+        db.flush()
+    reads.close()
+    assert replica_set.replicas[0].in_use == 0
+
+
+def test_read_db_falls_back_to_the_primary(monkeypatch, replica_set):
+    for replica in replica_set.replicas:
+        replica.lag = 30
+    monkeypatch.setattr(database, "replicas", replica_set)
+    reads = database.get_read_db()
+    db = next(reads)
+    assert db.get_bind() is database.engine
+    reads.close()
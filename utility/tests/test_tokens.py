@@ -0,0 +1,45 @@
+""" stateless tokens: revocations and user changes are compared with the signing time at millisecond precision """
+from datetime import datetime, timezone
+
+import pytest
+
+from app_package import models, oauth2
+from app_package.config import settings
+
+
+@pytest.fixture(autouse=True)
+def stateless(monkeypatch):
+    monkeypatch.setattr(settings, "STATELESS_TOKENS", True)
+
+
+def _authorized(client, headers) -> bool:
+    return client.get("/counts/read-counts/", headers=headers).status_code != 401
+
+
+def test_login_right_after_a_revocation_is_accepted(client, login):
+    old = login("read_count")
+    oauth2.revoke_user_tokens("KW/admin@example.com")
+    fresh = client.post("/login/", data={"username": "admin@example.com", "password": "password"})
+    new = {"Authorization": f"Bearer {fresh.json()['access_token']}"}
+
+    assert not _authorized(client, old)
+    assert _authorized(client, new)
+
+
+def test_user_change_right_after_signing_revokes_the_token(client, login, db):
+    headers = login("read_count")
+    user = db.query(models.User).filter(models.User.email == "admin@example.com").one()
+    user.last_modify = datetime.now(timezone.utc)
+    db.commit()
+
+    assert _authorized(client, headers)  # served from the database, the token is refused from now on
+    assert not _authorized(client, headers)
+
+
+def test_token_without_milliseconds_is_refused_in_the_second_of_a_revocation():
+    revocations = oauth2.TokenRevocations()
+    revocations.revoke("KW/1")
+    second = int(revocations._revoked["KW/1"])
+
+    assert revocations.is_revoked("KW/1", second * 1000)
+    assert not revocations.is_revoked("KW/1", (second + 1) * 1000)
@@ -0,0 +1,88 @@
+""" the per-socket send queues of ConnectionManager: a failing, stalled or overloaded socket only costs itself """
+import asyncio
+import json
+
+import pytest
+
+from app_package.config import settings
+from app_package.routers.websocket import ConnectionManager
+from .test_broker import FakeWebSocket, until
+
+
+class FailingWebSocket(FakeWebSocket):
+    async def send_text(self, message):
+        raise RuntimeError("connection reset")
+
+
+class StalledWebSocket(FakeWebSocket):
+    async def send_text(self, message):
+        await asyncio.sleep(3600)
+
+
+class BlockedWebSocket(FakeWebSocket):
+    """ takes its first message and then waits until released, so its queue fills up """
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send_text(self, message):
+        await self.release.wait()
+        await super().send_text(message)
+
+
+@pytest.fixture(autouse=True)
+def small_queues(monkeypatch):
+    monkeypatch.setattr(settings, "WS_SEND_QUEUE_SIZE", 3)
+    monkeypatch.setattr(settings, "WS_SEND_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "PRESENCE_INTERVAL_SECONDS", 0.01)
+
+
+async def _broadcast(manager, note: str):
+    await manager.broadcast(json.dumps({"type": "broadcast", "message": note}))
+
+
+@pytest.mark.parametrize("broken", [FailingWebSocket, StalledWebSocket])
+def test_broken_socket_is_evicted_and_the_others_are_served(broken):
+    async def scenario():
+        manager, healthy, socket = ConnectionManager(), FakeWebSocket(), broken()
+        await manager.connect(healthy, "KW/1", "DCL-234-KW-GOI")
+        await manager.connect(socket, "KW/2", "DCL-234-KW-GOI")
+
+        await _broadcast(manager, "first")
+        await until(lambda: manager.evicted == 1)
+        await _broadcast(manager, "second")
+        await until(lambda: len(healthy.received("broadcast")) == 2)
+
+        assert manager.stats()["connections"] == 1
+        assert not manager.is_online("KW/2") and manager.is_online("KW/1")
+        assert manager.sockets_of("KW/2") == set()
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_drops_messages_for_that_socket_only(monkeypatch):
+    monkeypatch.setattr(settings, "WS_SEND_TIMEOUT_SECONDS", 60)  # blocked, but not long enough to be evicted
+
+    async def scenario():
+        manager, healthy, blocked = ConnectionManager(), FakeWebSocket(), BlockedWebSocket()
+        await manager.connect(healthy, "KW/1", "DCL-234-KW-GOI")
+        await manager.connect(blocked, "KW/2", "DCL-234-KW-GOI")
+        await asyncio.sleep(0.05)  # presence settled, the blocked writer holds one message
+        dropped = manager.dropped
+
+        for note in range(10):
+            await _broadcast(manager, str(note))
+            await asyncio.sleep(0.005)  # the healthy socket keeps up
+        await until(lambda: len(healthy.received("broadcast")) == 10)
+
+        assert manager.queues[blocked].full()
+        assert manager.dropped - dropped >= 10 - settings.WS_SEND_QUEUE_SIZE - 1
+        assert manager.stats()["max_queue_depth"] == settings.WS_SEND_QUEUE_SIZE
+        blocked.release.set()
+        await until(lambda: manager.stats()["queued"] == 0)
+        assert manager.evicted == 0 and manager.is_online("KW/2")
+        await manager.close()
+
+    asyncio.run(scenario())